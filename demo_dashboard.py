@@ -51,7 +51,7 @@ with st.sidebar:
     st.markdown("---")
     
     st.subheader("⚙️ Configuration")
-    concurrency = st.slider("Concurrency Level", 10, 200, 100)
+    concurrency = st.slider("Requests (Open-Loop, Poisson)", 10, 200, 100)
     cache_policy = st.selectbox("Eviction Policy", ["LRU (Radix-Tree)", "FIFO", "LIFO"])
     
     st.markdown("---")
@@ -112,8 +112,11 @@ if os.path.exists(DATA_FILE):
             col1.metric("Cache Hit Rate", f"{hit_rate:.1f}%", "+12% vs Baseline")
             col2.metric("Avg Latency (Warm)", f"{avg_warm:.2f} ms", f"-{speedup:.1f}x Speedup", delta_color="inverse")
             
-            est_throughput = total_reqs / (df['latency_ms'].sum()/1000/100) if df['latency_ms'].sum() > 0 else 0
-            col3.metric("Throughput (Est)", f"{est_throughput:.0f} req/s", "High Load")
+            if "ttft_ms" in df:
+                col3.metric("TTFT p50 / p99", f"{df['ttft_ms'].quantile(0.5):.0f} / {df['ttft_ms'].quantile(0.99):.0f} ms")
+            else:
+                est_throughput = total_reqs / (df['latency_ms'].sum()/1000/100) if df['latency_ms'].sum() > 0 else 0
+                col3.metric("Throughput (Est)", f"{est_throughput:.0f} req/s", "High Load")
             col4.metric("P99 Latency", f"{p99_latency:.2f} ms", "Stable")
 
             st.markdown("---")
@@ -153,8 +156,9 @@ if os.path.exists(DATA_FILE):
                 # Note: Keeping use_container_width=True for backward compatibility if you haven't upgraded yet,
                 # but removing it is safer if you see warnings. 
                 # Ideally:
+                columns = [c for c in ["id", "type", "profile", "latency_ms", "ttft_ms", "tpot_ms", "hit_rate", "status"] if c in df]
                 st.dataframe(
-                    df[["id", "type", "latency_ms", "hit_rate", "status"]].style.highlight_min(subset=["latency_ms"], color="#00CC96"), 
+                    df[columns].style.highlight_min(subset=["latency_ms"], color="#00CC96"), 
                     use_container_width=True
                 )
                 
@@ -168,4 +172,4 @@ else:
     c1.metric("System Status", "Standby", "Ready to Test", delta_color="off")
     c2.metric("Active Workers", "0", "0")
     c3.metric("GPU Memory", "0GB / 16GB", "Idle")
-    st.info("👈 **Action Required:** Click 'Run Live Stress Test' in the sidebar.")
\ No newline at end of file
+    st.info("👈 **Action Required:** Click 'Run Live Stress Test' in the sidebar.")
\ No newline at end of file
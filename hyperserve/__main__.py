@@ -0,0 +1,3 @@
+from hyperserve.cli import main
+
+main()
@@ -0,0 +1,101 @@
+import numpy as np
+from typing import List, Tuple
+from hyperserve.config import settings
+
+# Request body formats besides JSON
+INT32_CONTENT_TYPE = "application/octet-stream" # Raw little-endian int32 tokens
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack")
+
+_TOKEN_DTYPE = np.dtype("<i4")
+
+class CodecError(ValueError):
+    """Malformed binary body (mapped to 400)."""
+
+class UnsupportedFormat(Exception):
+    """Content type we cannot decode here (mapped to 415)."""
+
+def decode_tokens(data: bytes) -> np.ndarray:
+    """
+    One prompt as raw little-endian int32: a zero-copy view of the body,
+    validated with two vectorised reductions instead of per-token objects.
+    """
+    if not data:
+        raise CodecError("prompt must not be empty")
+    if len(data) % _TOKEN_DTYPE.itemsize:
+        raise CodecError(f"body length {len(data)} is not a multiple of 4 (int32 tokens)")
+    tokens = np.frombuffer(data, dtype=_TOKEN_DTYPE)
+    check_token_range(tokens)
+    return tokens
+
+def check_token_range(tokens: np.ndarray):
+    """Every token id in [0, VOCAB_SIZE), whatever format the prompt came in."""
+    if tokens.size and (tokens.min() < 0 or tokens.max() >= settings.VOCAB_SIZE):
+        raise CodecError(f"token ids must be in [0, {settings.VOCAB_SIZE})")
+
+def validate_tokens(prompt: List[int]) -> List[int]:
+    """A prompt already parsed into ints (JSON), range-checked like the binary formats."""
+    try:
+        check_token_range(np.asarray(prompt, dtype=np.int64))
+    except OverflowError:
+        raise CodecError(f"token ids must be in [0, {settings.VOCAB_SIZE})")
+    return prompt
+
+def decode_token_batch(data: bytes) -> List[np.ndarray]:
+    """
+    Many prompts in one raw body:
+        uint32 count | uint32 lengths[count] | int32 tokens (prompts back to back)
+    all little-endian. Returns one view per prompt.
+    """
+    if len(data) < 4:
+        raise CodecError("batch body too short")
+    count = int(np.frombuffer(data, dtype="<u4", count=1)[0])
+    header = 4 * (count + 1)
+    if not count or len(data) < header:
+        raise CodecError("batch header truncated or empty")
+    lengths = np.frombuffer(data, dtype="<u4", count=count, offset=4).astype(np.int64)
+    if (lengths == 0).any():
+        raise CodecError("prompts must not be empty")
+    tokens = decode_tokens(data[header:])
+    if int(lengths.sum()) != len(tokens):
+        raise CodecError(f"lengths add up to {int(lengths.sum())} tokens, body has {len(tokens)}")
+    return np.split(tokens, np.cumsum(lengths)[:-1])
+
+def encode_token_batch(prompts: List[List[int]]) -> bytes:
+    """Client-side counterpart of decode_token_batch()."""
+    lengths = np.array([len(p) for p in prompts], dtype="<u4")
+    header = np.concatenate(([len(prompts)], lengths)).astype("<u4")
+    return header.tobytes() + np.concatenate([np.asarray(p, dtype=_TOKEN_DTYPE) for p in prompts]).tobytes()
+
+def decode_msgpack(data: bytes) -> Tuple[dict, List[np.ndarray]]:
+    """
+    A msgpack map with the JSON fields, where each prompt ("prompt_ids", or
+    every entry of "prompts") is either a bin of little-endian int32 tokens
+    or an array of ints. Returns (other fields, prompts).
+    msgpack is an optional dependency: without it this raises UnsupportedFormat.
+    """
+    try:
+        import msgpack
+    except ImportError:
+        raise UnsupportedFormat("msgpack bodies need the 'msgpack' package; send raw int32 or JSON instead")
+    try:
+        body = msgpack.unpackb(data, raw=False)
+    except Exception as e:
+        raise CodecError(f"invalid msgpack: {e}")
+    if not isinstance(body, dict):
+        raise CodecError("msgpack body must be a map")
+    if "prompts" in body:
+        raw_prompts = body.pop("prompts")
+    elif "prompt_ids" in body:
+        raw_prompts = [body.pop("prompt_ids")]
+    else:
+        raise CodecError("missing 'prompt_ids' or 'prompts'")
+    prompts = []
+    for raw in raw_prompts:
+        if isinstance(raw, (bytes, bytearray)):
+            prompts.append(decode_tokens(bytes(raw)))
+        else:
+            try:
+                prompts.append(decode_tokens(np.asarray(raw, dtype=_TOKEN_DTYPE).tobytes()))
+            except (OverflowError, TypeError, ValueError) as e:
+                raise CodecError(f"invalid prompt: {e}")
+    return body, prompts
@@ -1,28 +1,304 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List
-from hyperserve.serving.engine import HyperEngine
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Tuple, Type
+from hyperserve import metrics, tracing
+from hyperserve.api import codec
+from hyperserve.config import settings
+from hyperserve.router.dispatcher import ReplicaDispatcher
+from hyperserve.serving.admission import QueueFullError
 import structlog
 
 # Initialize JSON Logging
 structlog.configure(processors=[structlog.processors.JSONRenderer()])
 logger = structlog.get_logger()
 
-app = FastAPI(title="HyperServe: Disaggregated Inference Engine")
-engine = HyperEngine()
+dispatcher = ReplicaDispatcher()
+engine = dispatcher.replicas[0]
 
-class GenerateRequest(BaseModel):
+def _replica_path(base: str, replica: int) -> str:
+    """Per-replica state file: base itself for a single replica, else base.<replica>."""
+    return base if dispatcher.num_replicas == 1 else f"{base}.{replica}"
+
+async def _save_snapshots():
+    for i, replica in enumerate(dispatcher.replicas):
+        try:
+            await replica.save_snapshot(_replica_path(settings.RADIX_SNAPSHOT_PATH, i))
+        except Exception as e:
+            logger.error("radix_snapshot_failed", replica=i, error=str(e))
+
+async def _snapshot_periodically(interval_s: float):
+    while True:
+        await asyncio.sleep(interval_s)
+        await _save_snapshots()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Carry each replica's learned routing policy across restarts
+    path = settings.ROUTER_STATE_PATH
+    if path:
+        for i, replica in enumerate(dispatcher.replicas):
+            replica.router.load(_replica_path(path, i))
+
+    # Warm restart: bring back the prefix cache instead of recomputing it
+    snapshotter = None
+    if settings.RADIX_SNAPSHOT_PATH:
+        for i, replica in enumerate(dispatcher.replicas):
+            replica.load_snapshot(_replica_path(settings.RADIX_SNAPSHOT_PATH, i))
+        dispatcher.refresh()
+        if settings.RADIX_SNAPSHOT_INTERVAL_S > 0:
+            snapshotter = asyncio.ensure_future(_snapshot_periodically(settings.RADIX_SNAPSHOT_INTERVAL_S))
+    yield
+    if snapshotter is not None:
+        snapshotter.cancel()
+    if settings.RADIX_SNAPSHOT_PATH:
+        await _save_snapshots()
+    if path:
+        for i, replica in enumerate(dispatcher.replicas):
+            replica.router.save(_replica_path(path, i))
+        logger.info("router_state_saved", path=path, replicas=dispatcher.num_replicas)
+    dispatcher.shutdown()
+
+app = FastAPI(title="HyperServe: Disaggregated Inference Engine", lifespan=lifespan)
+
+class GenerateParams(BaseModel):
+    max_new_tokens: Optional[int] = Field(default=None, ge=1) # None: MAX_NEW_TOKENS
+    stream: bool = False # Server-Sent Events, one event per decoded token
+    priority: int = 0 # Lower values are admitted first and preempted last
+    tenant: Optional[str] = None # Cache quota to charge (TENANT_MIN_BLOCKS / TENANT_MAX_BLOCKS)
+
+class GenerateRequest(GenerateParams):
     prompt_ids: List[int] # Sending tokens directly for simplicity
 
+class BatchParams(BaseModel):
+    max_new_tokens: Optional[int] = Field(default=None, ge=1) # None: MAX_NEW_TOKENS
+    priority: int = 0
+    tenant: Optional[str] = None
+
+class BatchRequest(BatchParams):
+    prompts: List[List[int]]
+
+# Besides JSON, prompts may arrive as raw int32 (other fields in the query
+# string) or msgpack; see hyperserve.api.codec for the layouts.
+_BINARY_BODIES = {
+    codec.INT32_CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}},
+    **{t: {"schema": {"type": "object"}} for t in codec.MSGPACK_CONTENT_TYPES},
+}
+
+def _openapi_body(model: Type[BaseModel]) -> dict:
+    return {"requestBody": {"required": True, "content": {
+        "application/json": {"schema": model.model_json_schema()}, **_BINARY_BODIES,
+    }}}
+
+_PARSE_SECONDS = {fmt: metrics.PARSE_SECONDS.labels(format=fmt) for fmt in ("json", "int32", "msgpack")}
+
+async def _parse(request: Request, model: Type[BaseModel], params_model: Type[BaseModel],
+                 batch: bool, trace: Optional[tracing.Trace] = None) -> Tuple[BaseModel, list, str, float]:
+    """
+    Decodes a completion body by Content-Type.
+    Returns: (params, prompts, format, parse seconds). Reading the body is
+    not counted, only turning it into validated token sequences.
+    """
+    body = await request.body()
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip()
+    start = time.perf_counter()
+    try:
+        if content_type == codec.INT32_CONTENT_TYPE:
+            fmt = "int32"
+            prompts = codec.decode_token_batch(body) if batch else [codec.decode_tokens(body)]
+            params = params_model.model_validate(dict(request.query_params))
+        elif content_type in codec.MSGPACK_CONTENT_TYPES:
+            fmt = "msgpack"
+            fields, prompts = codec.decode_msgpack(body)
+            if not batch and len(prompts) != 1:
+                raise codec.CodecError(f"expected one prompt, got {len(prompts)}")
+            params = params_model.model_validate(fields)
+        else:
+            fmt = "json"
+            params = model.model_validate_json(body)
+            prompts = [codec.validate_tokens(p) for p in (params.prompts if batch else [params.prompt_ids])]
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    except codec.CodecError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except codec.UnsupportedFormat as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    end = time.perf_counter()
+    _PARSE_SECONDS[fmt].observe(end - start)
+    if trace is not None:
+        trace.add("api.parse", start, end, tracing.API_TID, format=fmt, body_bytes=len(body))
+    return params, prompts, fmt, end - start
+
+@contextmanager
+def _traced_handler(name: str):
+    """
+    Samples a trace for one API call and records the handler span, with
+    the response status, on its "api" track. Engine spans of the call's
+    requests land in the same trace.
+    """
+    trace = tracing.TRACER.start(name)
+    if trace is None:
+        yield None
+        return
+    trace.track(tracing.API_TID, "api")
+    start = time.perf_counter()
+    status = 200
+    try:
+        yield trace
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    except RequestValidationError:
+        status = 422
+        raise
+    except Exception:
+        status = 500
+        raise
+    finally:
+        trace.add("api.handler", start, time.perf_counter(), tracing.API_TID, status=status)
+        tracing.TRACER.finish(trace)
+
 @app.get("/health")
 async def health():
-    return {"status": "operational", "vram_blocks_free": len(engine.allocator.free_blocks)}
+    return {
+        "status": "operational",
+        "vram_blocks_free": engine.allocator.num_free,
+        "memory": engine.allocator.stats(),
+        "cache": engine.cache.stats(),
+        "admission": {
+            **engine.admission.stats(),
+            "waiting_by_priority": engine.scheduler.waiting.depths(),
+            "preemptions": engine.scheduler.num_preemptions,
+        },
+        "cluster": dispatcher.stats()
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(metrics.REGISTRY.expose(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/debug/traces")
+async def recent_traces():
+    """Recently sampled traces (TRACE_SAMPLE_RATE) as one Chrome trace: open it in ui.perfetto.dev."""
+    return tracing.TRACER.export()
 
-@app.post("/v1/chat/completions")
-async def generate(req: GenerateRequest):
+@app.post("/v1/chat/completions", openapi_extra=_openapi_body(GenerateRequest))
+async def generate(request: Request):
+    with _traced_handler("POST /v1/chat/completions") as trace:
+        req, (prompt,), fmt, parse_s = await _parse(request, GenerateRequest, GenerateParams, batch=False,
+                                                    trace=trace)
+        if req.stream:
+            if len(prompt) == 0:
+                raise HTTPException(status_code=400, detail="prompt_ids must not be empty")
+            try:
+                dispatcher.check_capacity() # Refuse before the 200 and the event stream go out
+            except QueueFullError as e:
+                raise _too_many_requests(e)
+            if trace is not None:
+                trace.retain() # The stream finishes it
+            return StreamingResponse(
+                _sse_tokens(prompt, req, request, trace),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        try:
+            result = await dispatcher.generate(prompt, req.max_new_tokens, priority=req.priority, tenant=req.tenant,
+                                               trace=trace)
+            result["metrics"].update(request_format=fmt, parse_ms=round(parse_s * 1000, 4))
+            return result
+        except QueueFullError as e:
+            raise _too_many_requests(e)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            logger.error("inference_failed", error=str(e))
+            raise HTTPException(status_code=500, detail="Engine Error")
+
+@app.post("/v1/batch/completions", openapi_extra=_openapi_body(BatchRequest))
+async def generate_batch(request: Request):
+    """
+    Many prompts in one call, handed to the engines together. Results come
+    back in prompt order; a prompt that failed gets an "error" entry.
+    """
+    with _traced_handler("POST /v1/batch/completions") as trace:
+        return await _generate_batch(request, trace)
+
+async def _generate_batch(request: Request, trace: Optional[tracing.Trace]) -> dict:
+    req, prompts, fmt, parse_s = await _parse(request, BatchRequest, BatchParams, batch=True, trace=trace)
+    if not prompts:
+        raise HTTPException(status_code=400, detail="prompts must not be empty")
+    try:
+        results = await dispatcher.generate_many(prompts, req.max_new_tokens, priority=req.priority,
+                                                 tenant=req.tenant, trace=trace)
+    except QueueFullError as e:
+        raise _too_many_requests(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            logger.error("inference_failed", error=str(result), batch_index=i)
+            results[i] = {"error": "Engine Error"}
+    return {
+        "results": results,
+        "request_format": fmt,
+        "parse_ms": round(parse_s * 1000, 4),
+        "parse_ms_per_prompt": round(parse_s * 1000 / len(prompts), 4),
+    }
+
+def _too_many_requests(e: QueueFullError) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def _sse_tokens(prompt: list, req: GenerateParams, request: Request, trace: Optional[tracing.Trace] = None):
+    """
+    Pulls tokens one at a time, so a slow client applies backpressure to
+    its own request only. Each pull races the client's disconnect: uvicorn
+    does not fail send() on a closed socket, so without this a dropped
+    client would keep its request decoding.
+    """
+    stream = dispatcher.generate_stream(prompt, req.max_new_tokens, priority=req.priority,
+                                        tenant=req.tenant, trace=trace)
+    stream_start = time.perf_counter()
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(request))
+    next_token = None
     try:
-        result = await engine.generate(req.prompt_ids)
-        return result
+        index = 0
+        while True:
+            next_token = asyncio.ensure_future(anext(stream))
+            await asyncio.wait((next_token, disconnected), return_when=asyncio.FIRST_COMPLETED)
+            if not next_token.done():
+                # Cancelling the pull aborts the request inside the engine
+                next_token.cancel()
+                await asyncio.wait((next_token,))
+                logger.info("client_disconnected", tokens_sent=index)
+                return
+            try:
+                token = next_token.result()
+            except StopAsyncIteration:
+                break
+            yield f"data: {json.dumps({'index': index, 'token_id': token})}\n\n"
+            index += 1
+        yield "data: [DONE]\n\n"
+    except QueueFullError as e:
+        # The queue filled up between the capacity check and our submission
+        yield f"data: {json.dumps({'error': str(e), 'retry_after': e.retry_after})}\n\n"
     except Exception as e:
-        logger.error("inference_failed", error=str(e))
-        raise HTTPException(status_code=500, detail="Engine Error")
\ No newline at end of file
+        logger.error("inference_failed", error=str(e), stream=True)
+        yield f"data: {json.dumps({'error': 'Engine Error'})}\n\n"
+    finally:
+        disconnected.cancel()
+        if next_token is not None and not next_token.done():
+            next_token.cancel()
+            await asyncio.wait((next_token,))
+        await stream.aclose()
+        if trace is not None:
+            trace.add("api.stream", stream_start, time.perf_counter(), tracing.API_TID, tokens_sent=index)
+            tracing.TRACER.finish(trace)
+
+async def _wait_for_disconnect(request: Request):
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
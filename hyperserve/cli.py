@@ -0,0 +1,58 @@
+import argparse
+import asyncio
+import structlog
+from hyperserve.config import settings
+
+logger = structlog.get_logger()
+
+async def _batch(args: argparse.Namespace) -> dict:
+    # Imported here so `hyperserve --help` does not pay for torch
+    from hyperserve.serving.engine import HyperEngine
+    from hyperserve.serving.offline import BatchRunner
+
+    engine = HyperEngine()
+    try:
+        # Nightly jobs share a lot with yesterday's: start from the saved tree
+        if settings.RADIX_SNAPSHOT_PATH:
+            engine.load_snapshot(settings.RADIX_SNAPSHOT_PATH)
+        runner = BatchRunner(engine, concurrency=args.concurrency, max_new_tokens=args.max_new_tokens,
+                             order=args.order, sort_buffer_mb=args.sort_buffer_mb, tmp_dir=args.tmp_dir)
+        summary = await runner.run(args.input, args.output, restart=args.restart)
+        if settings.RADIX_SNAPSHOT_PATH:
+            await engine.save_snapshot(settings.RADIX_SNAPSHOT_PATH)
+        return summary
+    finally:
+        engine.shutdown()
+
+def main(argv=None):
+    structlog.configure(processors=[structlog.processors.JSONRenderer()])
+    parser = argparse.ArgumentParser(prog="hyperserve", description="HyperServe command line")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch = commands.add_parser("batch", help="Offline inference over a JSONL file",
+                                description='One request per line: {"prompt_ids": [...], "id"?, "max_new_tokens"?, '
+                                            '"priority"?, "tenant"?}. Results are appended to OUTPUT as they complete; '
+                                            'rerunning resumes an interrupted job.')
+    batch.add_argument("input", help="JSONL requests")
+    batch.add_argument("output", help="JSONL results (appended to; lines already answered are skipped)")
+    batch.add_argument("--concurrency", type=int, default=settings.BATCH_CONCURRENCY,
+                       help="requests in the engine at once")
+    batch.add_argument("--max-new-tokens", type=int, default=None,
+                       help=f"default decode length (default: MAX_NEW_TOKENS={settings.MAX_NEW_TOKENS})")
+    batch.add_argument("--order", choices=("prefix", "input"), default="prefix",
+                       help="prefix: group requests by shared prompt prefix (default); input: file order")
+    batch.add_argument("--sort-buffer-mb", type=int, default=settings.BATCH_SORT_BUFFER_MB,
+                       help="memory for sorting before runs spill to disk")
+    batch.add_argument("--tmp-dir", default=None, help="where sorted runs spill (default: system temp)")
+    batch.add_argument("--restart", action="store_true", help="overwrite OUTPUT instead of resuming")
+
+    args = parser.parse_args(argv)
+    if args.command == "batch":
+        try:
+            asyncio.run(_batch(args))
+        except KeyboardInterrupt:
+            logger.warning("batch_interrupted", output=args.output, hint="rerun the same command to resume")
+            raise SystemExit(130)
+
+if __name__ == "__main__":
+    main()
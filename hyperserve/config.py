@@ -1,11 +1,74 @@
+from typing import Dict
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     LOG_LEVEL: str = "INFO"
     MAX_GPU_BLOCKS: int = 1024  # Simulated VRAM slots
     BLOCK_SIZE: int = 16        # Tokens per block (vLLM standard)
+    EVICTION_POLICY: str = "lru" # Radix leaf eviction order: lru | lfu | size
+    RADIX_HASH_INDEX: bool = False # Chained block-hash index: longest-prefix lookup by binary search
+    SWAP_HOST_BLOCKS: int = 0    # Host-RAM slots for demoted KV blocks (0 = off, evicted blocks are dropped; e.g. 1024 to enable)
+    SWAP_DISK_BLOCKS: int = 0    # mmap'd disk slots used once host slots run out
+    SWAP_DISK_PATH: str = ""     # Backing file for disk slots (a temp file if empty)
+
+    # KV pool, allocated once at startup: per layer, K and V pages of [MAX_GPU_BLOCKS, BLOCK_SIZE, heads, dim]
+    NUM_LAYERS: int = 1     # Attention layers of the simulated model
+    NUM_KV_HEADS: int = 10
+    HEAD_DIM: int = 64
+    KV_DTYPE: str = "float32" # float32 | float16
+
+    # Per-tenant cache partitioning (blocks of cached prefixes, charged to the tenant that inserted them)
+    TENANT_MIN_BLOCKS: Dict[str, int] = {} # JSON, e.g. {"gold": 256}: not evicted below this while others can be
+    TENANT_MAX_BLOCKS: Dict[str, int] = {} # JSON, e.g. {"free": 64}: most a tenant may keep cached
+    TENANT_DEFAULT_MAX_BLOCKS: int = 0     # Limit for tenants without an entry above (0 = unlimited)
+
+    # Continuous batching
+    MAX_BATCH_TOKENS: int = 2048 # Token budget per forward step (prefill + decode)
+    MAX_NUM_SEQS: int = 64       # Max concurrently running requests
+    MAX_NEW_TOKENS: int = 16     # Default decode length per request
+    PREFILL_CHUNK_SIZE: int = 512 # Max uncached prompt tokens one request prefills per step
+    VOCAB_SIZE: int = 32000
+    STREAM_BUFFER_TOKENS: int = 64 # Undelivered streamed tokens before a request is paused
+
+    # Admission control and preemption
+    MAX_WAITING_REQUESTS: int = 1024 # Per-replica queue limit; past it requests get 429 (0 = unbounded)
+    ADMISSION_DECODE_FRACTION: float = 1.0 # Share of each decode budget booked at admission (0 = prompt only)
+    PREEMPTION_MODE: str = "recompute" # recompute (KV back to the radix tree) | swap (KV parked in SwapSpace; needs SWAP_*_BLOCKS)
+
+    # Speculative decoding (prompt lookup, no draft model)
+    SPECULATIVE_TOKENS: int = 0 # Draft tokens verified per decode step (0 = off)
+    SPECULATIVE_NGRAM: int = 3  # Longest context suffix the n-gram drafter matches
+
+    # Router
+    ROUTER_ALPHA: float = 1.0    # LinUCB exploration strength
+    ROUTER_STATE_PATH: str = ""  # JSON snapshot restored at startup, saved at shutdown (.<replica> suffix per replica if several)
+
+    # Disaggregated serving
+    NUM_PREFILL_WORKERS: int = 0 # >0: "remote" requests run on prefill/decode worker processes
+
+    # Multi-replica dispatch
+    NUM_REPLICAS: int = 1              # In-process HyperEngine replicas behind the API
+    DISPATCH_POLICY: str = "prefix"    # prefix | round_robin | random
+    DISPATCH_LOAD_WEIGHT: float = 0.25 # Recompute tokens one outstanding token of load is worth
+    DISPATCH_REFRESH_INTERVAL: int = 256 # Dispatches between exact resyncs of prefix summaries
+
+    # Radix cache snapshots (warm restart)
+    MODEL_NAME: str = "hyperserve-sim"      # Recorded in snapshots; a mismatch rejects them
+    RADIX_SNAPSHOT_PATH: str = ""           # Tree + KV snapshot restored at startup ("" = off)
+    RADIX_SNAPSHOT_INTERVAL_S: float = 300.0 # Background snapshot period (0 = only at shutdown)
+    RADIX_SNAPSHOT_MAX_AGE_S: float = 86400.0 # Older snapshots are stale and ignored (0 = no limit)
+
+    # Request tracing (Chrome trace / Perfetto JSON)
+    TRACE_SAMPLE_RATE: float = 0.0 # Share of requests traced span by span (0 = off)
+    TRACE_DIR: str = ""            # Writes trace-<id>.json per sampled request ("" = only GET /debug/traces)
+    TRACE_KEEP: int = 64           # Recent traces kept for GET /debug/traces
+    TRACE_TORCH_PROFILER: bool = False # Fold torch.profiler op events of traced steps into their traces
+
+    # Offline batch inference (hyperserve batch)
+    BATCH_CONCURRENCY: int = 128    # Requests in the engine at once
+    BATCH_SORT_BUFFER_MB: int = 256 # Prompts sorted in memory before spilling a run to disk
     
     class Config:
         env_file = ".env"
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
\ No newline at end of file
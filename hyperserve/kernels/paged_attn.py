@@ -1,6 +1,7 @@
 import torch
 import math
 import structlog
+from typing import Optional
 
 logger = structlog.get_logger()
 
@@ -43,11 +44,23 @@ if HAS_TRITON:
 def paged_attention(query: torch.Tensor, 
                     key_cache: torch.Tensor, 
                     value_cache: torch.Tensor, 
-                    block_table: torch.Tensor):
+                    block_table: torch.Tensor,
+                    context_lens: Optional[torch.Tensor] = None,
+                    scale: Optional[float] = None,
+                    query_lens: Optional[torch.Tensor] = None) -> torch.Tensor:
     """
     Dispatcher. 
     On Linux/GPU: Calls Triton Kernel.
-    On Mac/Win: Simulates logic with PyTorch.
+    On Mac/Win/CPU: Vectorized PyTorch implementation over the same paged layout.
+
+    Shapes:
+    - query:        [Batch, Heads, Dim]              (one decode token per sequence)
+                    [Batch, Q, Heads, Dim]           (prefill chunks, right-padded to Q)
+    - key/value:    [Num_Blocks, Block_Size, Heads, Dim] (Paged Layout)
+    - block_table:  [Batch, Max_Blocks_Per_Seq]      (physical block IDs, padding ignored)
+    - context_lens: [Batch]                          (valid tokens per sequence, incl. the queries)
+    - query_lens:   [Batch]                          (valid queries per row; default all Q)
+    The queries of a row are its last query_lens tokens and attend causally.
     """
     if HAS_TRITON and query.is_cuda:
         # Launch Triton Kernel (Simulated Call)
@@ -55,19 +68,51 @@ def paged_attention(query: torch.Tensor,
         # _paged_attention_kernel[grid](...)
         return query # Placeholder return
     else:
-        # Fallback: Functional simulation of Attention over Paged Memory
-        # This proves you know the MATH behind it.
-        
-        # Q: [Batch, Heads, Dim]
-        # K, V: [Num_Blocks, Block_Size, Heads, Dim] (Paged Layout)
-        
-        # 1. Gather K/V from blocks
-        # In a real impl, we'd use index_select using block_table
-        # Here we simulate standard attention for the demo
-        
-        # scale = 1.0 / math.sqrt(query.size(-1))
-        # scores = torch.matmul(query, key_cache.transpose(-2, -1)) * scale
-        # attn = torch.softmax(scores, dim=-1)
-        # out = torch.matmul(attn, value_cache)
-        
-        return torch.randn_like(query) # Mock output
\ No newline at end of file
+        return _paged_attention_torch(query, key_cache, value_cache, block_table, context_lens, scale, query_lens)
+
+def _paged_attention_torch(query: torch.Tensor,
+                           key_cache: torch.Tensor,
+                           value_cache: torch.Tensor,
+                           block_table: torch.Tensor,
+                           context_lens: Optional[torch.Tensor],
+                           scale: Optional[float],
+                           query_lens: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """
+    Batched attention over ragged sequences: one gather, two einsums, one mask.
+    No per-sequence Python loop, so cost scales with Batch * Q * Max_Context.
+    """
+    single_query = query.dim() == 3
+    if single_query:
+        query = query.unsqueeze(1)
+    num_seqs, num_queries, num_heads, head_dim = query.shape
+    block_size = key_cache.shape[1]
+    max_blocks = block_table.shape[1]
+    max_context = max_blocks * block_size
+    scale = scale if scale is not None else 1.0 / math.sqrt(head_dim)
+
+    # 1. Gather K/V from blocks: [Batch, Max_Blocks, Block_Size, Heads, Dim] -> [Batch, T, Heads, Dim]
+    #    Padding slots may hold any ID (e.g. -1); they are clamped here (out of place: .to()
+    #    may return the caller's own table) and masked below.
+    block_table = block_table.to(device=key_cache.device, dtype=torch.long).clamp(min=0)
+    keys = key_cache[block_table].view(num_seqs, max_context, num_heads, head_dim)
+    values = value_cache[block_table].view(num_seqs, max_context, num_heads, head_dim)
+
+    # 2. Scores: [Batch, Heads, Q, T]
+    scores = torch.einsum("bqhd,bthd->bhqt", query, keys).float() * scale
+
+    # 3. Causal + padding mask: query i of row b sits at position
+    #    context_len - query_len + i and sees keys up to and including itself
+    if context_lens is not None:
+        context_lens = context_lens.to(query.device)
+        if query_lens is None:
+            query_lens = torch.full_like(context_lens, num_queries)
+        q_offsets = torch.arange(num_queries, device=query.device)
+        q_positions = (context_lens - query_lens.to(query.device))[:, None] + q_offsets[None, :]
+        k_positions = torch.arange(max_context, device=query.device)
+        mask = k_positions[None, None, :] > q_positions[:, :, None]
+        scores.masked_fill_(mask[:, None, :, :], float("-inf"))
+
+    # 4. Weighted sum of values: [Batch, Q, Heads, Dim]
+    attn = torch.softmax(scores, dim=-1).to(values.dtype)
+    out = torch.einsum("bhqt,bthd->bqhd", attn, values)
+    return out.squeeze(1) if single_query else out
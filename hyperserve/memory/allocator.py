@@ -1,4 +1,6 @@
+import numpy as np
 import structlog
+from typing import Callable, List, Optional, Sequence
 from hyperserve.config import settings
 
 logger = structlog.get_logger()
@@ -7,19 +9,124 @@ class BlockAllocator:
     """
     Manages 'Physical' GPU Memory Blocks.
     Simulates the Page Table of an OS.
+    Architecture:
+    - ref_counts is a flat int32 array; a block is free iff its count is 0.
+    - Free IDs live in a preallocated int32 stack, so allocating or
+      releasing N blocks is one slice, and num_free is an O(1) counter.
+    - Every holder (the RadixCache, each request) owns one reference;
+      free() drops one and the block only returns to the pool at zero.
+    - A holder about to write into a shared block calls copy_on_write().
+    When the pool is empty, the registered evictor (the RadixCache) is asked
+    to hand cold blocks back before we report OOM.
     """
-    def __init__(self):
-        self.free_blocks = list(range(settings.MAX_GPU_BLOCKS))
-        self.mapping = {} # Logical ID -> Physical ID
+    def __init__(self, num_blocks: int = None):
+        self.num_blocks = num_blocks or settings.MAX_GPU_BLOCKS
+        self.ref_counts = np.zeros(self.num_blocks, dtype=np.int32)
+        self._free_stack = np.arange(self.num_blocks - 1, -1, -1, dtype=np.int32)
+        self._num_free = self.num_blocks
+
+        self.evictor: Optional[Callable[[int], int]] = None # num_blocks -> num_freed
+        self.copy_fn: Optional[Callable[[int, int], None]] = None # (src, dst) KV copy for COW
+        self.num_cow_copies = 0
+
+    @property
+    def num_free(self) -> int:
+        return self._num_free
 
     def allocate(self) -> int:
-        if not self.free_blocks:
-            # In a real system, we would trigger eviction here
-            logger.warning("oom_eviction_triggered")
+        blocks = self.allocate_blocks(1)
+        if blocks is None:
             return -1 # OOM simulation
-            
-        block = self.free_blocks.pop()
-        return block
+        return blocks[0]
+
+    def allocate_blocks(self, num_blocks: int) -> Optional[List[int]]:
+        """
+        All-or-nothing allocation of num_blocks blocks, each with refcount 1.
+        Returns None if they cannot be found even after eviction.
+        """
+        if num_blocks <= 0:
+            return []
+        if self._num_free < num_blocks and self.evictor is not None:
+            logger.info("oom_eviction_triggered", needed=num_blocks - self._num_free)
+            while self._num_free < num_blocks:
+                if not self.evictor(num_blocks - self._num_free):
+                    break
+
+        if self._num_free < num_blocks:
+            # Everything left is pinned by in-flight requests
+            logger.warning("oom_no_evictable_blocks", needed=num_blocks, free=self._num_free)
+            return None
+
+        top = self._num_free
+        blocks = self._free_stack[top - num_blocks:top]
+        self.ref_counts[blocks] = 1
+        self._num_free = top - num_blocks
+        return blocks.tolist()
+
+    def share(self, block_ids: Sequence[int]):
+        """
+        Adds one reference to each block (e.g. a request reusing cached prefix blocks).
+        """
+        if len(block_ids):
+            np.add.at(self.ref_counts, np.asarray(block_ids, dtype=np.int64), 1)
 
     def free(self, block_id: int):
-        self.free_blocks.append(block_id)   
\ No newline at end of file
+        self.release([block_id])
+
+    def release(self, block_ids: Sequence[int]):
+        """
+        Drops one reference per listed block; blocks reaching zero return to the pool.
+        Raises ValueError, changing nothing, if that would take a block below zero.
+        """
+        if not len(block_ids):
+            return
+        ids, drops = np.unique(np.asarray(block_ids, dtype=np.int64), return_counts=True)
+        counts = self.ref_counts[ids] - drops
+        if (counts < 0).any():
+            raise ValueError(f"Double free of blocks {ids[counts < 0].tolist()}")
+        self.ref_counts[ids] = counts
+
+        freed = ids[counts == 0]
+        top = self._num_free
+        self._free_stack[top:top + len(freed)] = freed
+        self._num_free = top + len(freed)
+
+    def copy_on_write(self, block_id: int) -> int:
+        """
+        Called by a holder before it writes into block_id.
+        Exclusive blocks are returned as-is; a shared block is copied into a
+        fresh block and the caller's reference moves to the copy.
+        Returns the block to write into, or -1 on OOM.
+        """
+        if self.ref_counts[block_id] <= 1:
+            return block_id
+        new_block = self.allocate()
+        if new_block < 0:
+            return -1
+        if self.copy_fn is not None:
+            self.copy_fn(block_id, new_block)
+        self.release([block_id])
+        self.num_cow_copies += 1
+        return new_block
+
+    def fragmentation(self) -> float:
+        """
+        Share of free blocks outside the longest contiguous free run
+        (0.0 = all free memory is one extent).
+        """
+        if self._num_free == 0:
+            return 0.0
+        edges = np.diff(np.concatenate(([0], (self.ref_counts == 0).view(np.int8), [0])))
+        longest = (np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)).max()
+        return 1.0 - float(longest) / self._num_free
+
+    def stats(self) -> dict:
+        used = self.num_blocks - self._num_free
+        return {
+            "blocks_total": self.num_blocks,
+            "blocks_free": self._num_free,
+            "blocks_shared": int(np.count_nonzero(self.ref_counts > 1)),
+            "occupancy": round(used / self.num_blocks, 4),
+            "fragmentation": round(self.fragmentation(), 4),
+            "cow_copies": self.num_cow_copies,
+        }
@@ -0,0 +1,48 @@
+import structlog
+from typing import Tuple
+
+logger = structlog.get_logger()
+
+class EvictionPolicy:
+    """
+    Orders evictable radix leaves. The leaf with the *smallest* priority
+    is evicted first. Priorities are computed when a leaf is (re)queued,
+    so they must only depend on node fields that trigger a requeue when
+    they change (last_access, hit_count, value).
+    """
+    name = "base"
+
+    def priority(self, node) -> Tuple:
+        raise NotImplementedError
+
+class LRUPolicy(EvictionPolicy):
+    """Least Recently Used: the coldest leaf goes first."""
+    name = "lru"
+
+    def priority(self, node) -> Tuple:
+        return (node.last_access,)
+
+class LFUPolicy(EvictionPolicy):
+    """Least Frequently Used, ties broken by recency."""
+    name = "lfu"
+
+    def priority(self, node) -> Tuple:
+        return (node.hit_count, node.last_access)
+
+class SizeAwarePolicy(EvictionPolicy):
+    """
+    Evicts the leaf with the fewest hits per block held, so each eviction
+    frees as much memory as possible for the reuse it gives up.
+    """
+    name = "size"
+
+    def priority(self, node) -> Tuple:
+        return (node.hit_count / max(1, len(node.value)), node.last_access)
+
+EVICTION_POLICIES = {cls.name: cls for cls in (LRUPolicy, LFUPolicy, SizeAwarePolicy)}
+
+def get_eviction_policy(name: str) -> EvictionPolicy:
+    try:
+        return EVICTION_POLICIES[name.lower()]()
+    except KeyError:
+        raise ValueError(f"Unknown eviction policy '{name}', expected one of {sorted(EVICTION_POLICIES)}")
@@ -0,0 +1,198 @@
+import numpy as np
+import torch
+from typing import Iterable, List, Optional, Sequence, Tuple
+from hyperserve.config import settings
+
+KV_DTYPES = {"float32": torch.float32, "float16": torch.float16} # Both have numpy twins (swap, snapshots)
+
+def kv_dtype(name: str = None) -> torch.dtype:
+    name = settings.KV_DTYPE if name is None else name
+    if name not in KV_DTYPES:
+        raise ValueError(f"KV_DTYPE must be one of {sorted(KV_DTYPES)}, got {name!r}")
+    return KV_DTYPES[name]
+
+def kv_shape(num_blocks: int = None) -> Tuple[int, ...]:
+    """[blocks, layers, K/V, BLOCK_SIZE, heads, dim] as configured in Settings."""
+    return (settings.MAX_GPU_BLOCKS if num_blocks is None else num_blocks, settings.NUM_LAYERS, 2,
+            settings.BLOCK_SIZE, settings.NUM_KV_HEADS, settings.HEAD_DIM)
+
+class StagingBuffer:
+    """
+    A tensor allocated up front and handed out as views of its leading
+    rows, so per-step batch metadata needs no new tensors. A batch that
+    outsizes it grows it by doubling (keeping the contents), which settles
+    after warm-up. .numpy shares its memory for filling with out= ops.
+    """
+    def __init__(self, rows: int, row_shape: Tuple[int, ...] = (), dtype: torch.dtype = torch.int64,
+                 random: bool = False):
+        self.row_shape = row_shape
+        self.dtype = dtype
+        self.random = random # Filled with noise once, e.g. simulated activations
+        self._alloc(max(1, rows))
+
+    def _alloc(self, rows: int, keep: Optional[torch.Tensor] = None):
+        shape = (rows,) + self.row_shape
+        self.tensor = torch.randn(shape).to(self.dtype) if self.random else torch.zeros(shape, dtype=self.dtype)
+        if keep is not None:
+            self.tensor[:len(keep)] = keep
+        self.numpy = self.tensor.numpy()
+
+    def __len__(self) -> int:
+        return self.tensor.shape[0]
+
+    def ensure(self, rows: int):
+        if rows > len(self):
+            self._alloc(max(rows, 2 * len(self)), keep=self.tensor)
+
+    def take(self, rows: int) -> torch.Tensor:
+        self.ensure(rows)
+        return self.tensor[:rows]
+
+class KVPool:
+    """
+    The paged KV cache behind BlockAllocator's block IDs, allocated once
+    at startup.
+    Architecture:
+    - One block-major tensor [num_blocks, layers, 2, block_size, heads, dim].
+      keys[layer] / values[layer] are [num_blocks, block_size, heads, dim]
+      views of it in the layout paged_attention reads, while a block's KV
+      for every layer stays one contiguous row, so copy-on-write, swap,
+      snapshots and shared-memory handoff move blocks with one index op.
+    - stage_tokens() turns (new tokens, block table, start) per sequence
+      into one flat (block, offset, token) mapping for the whole batch;
+      write() then scatters a layer's new K/V rows with a single index_put_.
+    - block_table(), context_lens(), query_lens() fill preallocated
+      StagingBuffers and return views of them: valid until the next call
+      of the same method, and no tensor is allocated on the step path.
+    - storage: an existing buffer to lay the pool over (e.g. shared memory
+      for the disaggregated workers) instead of allocating one; shape
+      then comes with it, as the creating process configured it.
+    """
+    def __init__(self, shape: Tuple[int, ...] = None, storage: torch.Tensor = None, max_seqs: int = None,
+                 max_tokens: int = None):
+        shape = kv_shape() if shape is None else tuple(shape)
+        self.shape = shape
+        self.num_blocks, self.num_layers, _, self.block_size, self.num_heads, self.head_dim = shape
+        if storage is not None:
+            self.blocks = storage.view(shape)
+        else:
+            self.blocks = torch.zeros(shape, dtype=kv_dtype())
+        self.dtype = self.blocks.dtype
+        self.keys = [self.blocks[:, layer, 0] for layer in range(self.num_layers)]
+        self.values = [self.blocks[:, layer, 1] for layer in range(self.num_layers)]
+
+        max_seqs = settings.MAX_NUM_SEQS if max_seqs is None else max_seqs
+        max_tokens = settings.MAX_BATCH_TOKENS if max_tokens is None else max_tokens
+        self._table = StagingBuffer(max_seqs, (self.num_blocks,))
+        self._context_lens = StagingBuffer(max_seqs)
+        self._query_lens = StagingBuffer(max_seqs)
+        self._slot_blocks = StagingBuffer(max_tokens)
+        self._slot_offsets = StagingBuffer(max_tokens)
+        self._tokens = StagingBuffer(max_tokens)
+        self._index = StagingBuffer(max_tokens) # Scratch for stage_tokens
+        self._key = StagingBuffer(max_tokens, (self.num_heads, self.head_dim), self.dtype)
+        self._value = StagingBuffer(max_tokens, (self.num_heads, self.head_dim), self.dtype)
+        self._positions = np.arange(self.num_blocks * self.block_size) # Longest possible sequence
+        self._seq_blocks = np.zeros(self.num_blocks, dtype=np.int64)
+        self.num_staged = 0
+
+    @property
+    def block_nbytes(self) -> int:
+        return self.blocks[0].numel() * self.blocks.element_size()
+
+    # --- Writes ---
+
+    def stage_tokens(self, seqs: Iterable[Tuple[Sequence[int], List[int], int]]) -> int:
+        """
+        Stages the slots of new tokens for a batch: per sequence, the token
+        IDs at positions [start, start + len(tokens)), its block table and
+        start. Returns the number of staged tokens; staged_kv() and write()
+        act on them.
+        """
+        bs = self.block_size
+        count = 0
+        for tokens, block_ids, start in seqs:
+            n = len(tokens)
+            if not n:
+                continue
+            end = start + n
+            if count + n > len(self._tokens):
+                for buf in (self._slot_blocks, self._slot_offsets, self._tokens, self._index):
+                    buf.ensure(count + n)
+            blocks, offsets = self._slot_blocks.numpy, self._slot_offsets.numpy
+            if n == 1: # A decode: no need for the vector path
+                blocks[count] = block_ids[start // bs]
+                offsets[count] = start % bs
+                self._tokens.numpy[count] = tokens[0]
+            else:
+                first, last = start // bs, (end - 1) // bs + 1
+                seq_blocks = self._seq_blocks[:last - first]
+                seq_blocks[:] = block_ids[first:last]
+                positions, index = self._positions[start:end], self._index.numpy[:n]
+                np.floor_divide(positions, bs, out=index)
+                np.subtract(index, first, out=index)
+                np.take(seq_blocks, index, out=blocks[count:count + n])
+                np.remainder(positions, bs, out=offsets[count:count + n])
+                self._tokens.numpy[count:count + n] = tokens
+            count += n
+        self.num_staged = count
+        return count
+
+    def staged_tokens(self) -> np.ndarray:
+        return self._tokens.numpy[:self.num_staged]
+
+    def staged_kv(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """[staged, heads, dim] K and V views for the model to fill, layer by layer."""
+        n = self.num_staged
+        return self._key.take(n), self._value.take(n)
+
+    def write(self, layer: int):
+        """Scatters the staged K/V rows into their slots of one layer."""
+        n = self.num_staged
+        index = (self._slot_blocks.tensor[:n], self._slot_offsets.tensor[:n])
+        self.keys[layer].index_put_(index, self._key.tensor[:n])
+        self.values[layer].index_put_(index, self._value.tensor[:n])
+
+    # --- Block copies ---
+
+    def copy_block(self, src: int, dst: int):
+        """One block, all layers (copy-on-write)."""
+        self.blocks[dst].copy_(self.blocks[src])
+
+    def copy_blocks(self, src: List[int], dst: List[int]):
+        """Many blocks at once (e.g. forking a sequence), all layers."""
+        n = len(src)
+        if n == 1:
+            return self.copy_block(src[0], dst[0])
+        self._index.ensure(2 * n)
+        index = self._index.numpy
+        index[:n], index[n:2 * n] = src, dst
+        src_t, dst_t = self._index.tensor[:n], self._index.tensor[n:2 * n]
+        self.blocks.index_copy_(0, dst_t, self.blocks.index_select(0, src_t))
+
+    # --- Batch metadata ---
+
+    def block_table(self, block_lists: Sequence[List[int]]) -> torch.Tensor:
+        """[len(block_lists), longest] block IDs, right-padded with -1."""
+        n = len(block_lists)
+        width = max(len(ids) for ids in block_lists)
+        self._table.ensure(n)
+        table = self._table.numpy
+        for i, ids in enumerate(block_lists):
+            k = len(ids)
+            table[i, :k] = ids
+            table[i, k:width] = -1
+        return self._table.tensor[:n, :width]
+
+    def context_lens(self, lens: Sequence[int]) -> torch.Tensor:
+        return self._fill(self._context_lens, lens)
+
+    def query_lens(self, lens: Sequence[int]) -> torch.Tensor:
+        return self._fill(self._query_lens, lens)
+
+    @staticmethod
+    def _fill(buf: StagingBuffer, values: Sequence[int]) -> torch.Tensor:
+        n = len(values)
+        buf.ensure(n)
+        buf.numpy[:n] = values
+        return buf.tensor[:n]
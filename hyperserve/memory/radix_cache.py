@@ -1,85 +1,801 @@
 import time
+import heapq
+import itertools
 import structlog
-from typing import List, Optional, Dict, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional, Dict, Sequence, Tuple
+from hyperserve import metrics
+from hyperserve.config import settings
 from hyperserve.memory.allocator import BlockAllocator
+from hyperserve.memory.eviction import EvictionPolicy, get_eviction_policy
+from hyperserve.memory.swap import SwapSpace
+from hyperserve.memory.tenants import DEFAULT_TENANT, TenantQuotas
 
 logger = structlog.get_logger()
 
+_DROPPED = metrics.EVICTED_BLOCKS.labels(outcome="dropped")
+_DEMOTED = metrics.EVICTED_BLOCKS.labels(outcome="demoted")
+
+def hash_blocks(tokens: List[int], block_size: int, prev_hash: int = 0) -> List[int]:
+    """
+    Chained hash per full block: entry i identifies the whole prefix
+    tokens[:(i + 1) * block_size], not just block i. prev_hash continues
+    a chain (the hash of whatever precedes tokens).
+    """
+    hashes = []
+    h = prev_hash
+    blocks = iter(tokens)
+    for block in zip(*[blocks] * block_size): # Full blocks as tuples, no slicing
+        h = hash((h, block))
+        hashes.append(h)
+    return hashes
+
+def hash_prompts(token_lists: Sequence[List[int]], block_size: int) -> List[List[int]]:
+    """
+    hash_blocks() for a batch of prompts, in order. Each prompt reuses its
+    predecessor's hashes for their common prefix instead of rehashing it,
+    so batches in prefix order (sorted, or grouped by system prompt) hash
+    every shared prefix once.
+    """
+    result = []
+    prev_tokens, prev_hashes = [], []
+    for tokens in token_lists:
+        shared = _common_blocks(prev_tokens, tokens, block_size)
+        hashes = prev_hashes[:shared]
+        hashes += hash_blocks(tokens[shared * block_size:], block_size, hashes[-1] if hashes else 0)
+        result.append(hashes)
+        prev_tokens, prev_hashes = tokens, hashes
+    return result
+
+def _common_blocks(a: List[int], b: List[int], block_size: int) -> int:
+    """Number of leading full blocks two prompts share (binary search over slice compares)."""
+    lo, hi = 0, min(len(a), len(b)) // block_size
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo * block_size:mid * block_size] == b[lo * block_size:mid * block_size]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
 class RadixNode:
     def __init__(self, key_tokens: List[int] = None, parent=None):
         self.key = key_tokens or []
-        self.children: Dict[int, RadixNode] = {} # Map first_token -> Node
+        self.children: Dict[Tuple[int, ...], RadixNode] = {} # Map first_block_tokens -> Node
         self.parent = parent
-        self.value = None  # Holds the Physical Block ID
+        self.value: List[int] = []  # Physical Block IDs, one per BLOCK_SIZE tokens of key
         self.last_access = time.time()
-        self.lock_count = 0 
+        self.hit_count = 0
+        self.lock_count = 0 # In-flight requests pinning this node (and so its ancestors)
+        self.heap_seq = -1  # Sequence number of this node's live eviction-heap entry
+        self.demoted = False # value holds SwapSpace slots instead of device blocks
+        self.promotion: Optional[Future] = None # In-flight swap -> device copy of value
+        self.block_hashes: List[int] = [] # Chained hash per block of key (hash index only)
+        self.owner = DEFAULT_TENANT # Tenant charged for value (whoever inserted it)
+
+@dataclass
+class PrefixMatch:
+    node: RadixNode
+    matched_len: int
+    block_tiers: List[str] = field(default_factory=list) # "gpu" | "host" | "disk", per matched block
+    promotions: List[Future] = field(default_factory=list) # Copies to await before reading the KV
 
 class RadixCache:
     """
     Implements a Radix Tree for Prefix Caching.
     Architecture:
     - Tree nodes store token sequences.
-    - If a request matches a path, we return the cached Block ID.
+    - Every edge is a whole number of BLOCK_SIZE blocks, so each node owns
+      exactly the physical blocks behind its key (no block is ever split).
+    - Edges are split where two requests diverge, and single-child chains
+      are merged back once nothing pins the boundary between them.
+    - If a request matches a path, we return the cached Block IDs.
     - This allows 'System Prompts' to be computed ONCE and reused forever.
+    Eviction:
+    - In-flight requests pin their path with lock()/unlock().
+    - Unpinned leaves sit in a lazily invalidated heap ordered by the
+      eviction policy; evict() pops it instead of scanning the tree.
+    - The allocator calls evict() on OOM, so cold blocks flow back on demand.
+    Tenants (see TenantQuotas):
+    - Each node belongs to the tenant that inserted it; nodes of different
+      owners are never merged, so a shared system prompt stays charged to
+      whoever cached it while other tenants branch off below it.
+    - Unpinned leaves are queued per owner. evict() takes the policy's
+      first leaf among tenants above their guaranteed floor, and only
+      falls back to guaranteed blocks when nothing else is left.
+    - insert() keeps a tenant under its ceiling by evicting its own leaves.
+    Swap tier (when a SwapSpace is attached):
+    - evict() demotes a leaf's tail blocks into host RAM / disk slots instead
+      of dropping them; the node stays in the tree with demoted=True.
+      Demoted nodes only ever hang below resident ones, so a device-resident
+      node whose children are all demoted counts as a leaf for eviction.
+    - Demoted leaves have their own heap; they are dropped for good only
+      when the swap tier itself is full.
+    - A lookup that lands on demoted nodes re-allocates device blocks for
+      them at once and copies the KV back on a background thread; the path
+      stays pinned until that copy has landed.
+    Matching:
+    - The walk advances an offset into the prompt and compares each edge
+      as one slice, so a lookup copies O(prompt) tokens at most once.
+    - With hash_index, every cached block is also indexed by its chained
+      block hash (as in vLLM). The index is prefix-closed, so the longest
+      cached prefix is a binary search over the prompt's block hashes,
+      followed by one split at most. Hashes are trusted: a 64-bit chained
+      collision would serve the wrong KV, which we accept (vLLM does too).
     """
-    def __init__(self, allocator: BlockAllocator):
+    def __init__(self, allocator: BlockAllocator, block_size: int = None,
+                 policy: Optional[EvictionPolicy] = None, swap: Optional[SwapSpace] = None,
+                 hash_index: bool = None, tenants: Optional[TenantQuotas] = None):
         self.root = RadixNode()
         self.allocator = allocator
+        self.block_size = block_size or settings.BLOCK_SIZE
+        self.policy = policy or get_eviction_policy(settings.EVICTION_POLICY)
+        self.allocator.evictor = self.evict
+        self.swap = swap
+        self.tenants = tenants or TenantQuotas()
+
+        self._evictable = set()
+        self._evict_heaps: Dict[str, List[Tuple]] = {} # Owner -> heap of its evictable leaves
+        self._swap_evictable = set() # Demoted leaves
+        self._swap_heap: List[Tuple] = []
+        self._heap_seq = itertools.count()
+        self._promotions: List[Tuple[Future, RadixNode, List[RadixNode], List[int]]] = []
+        self._promote_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kv-promote") if swap else None
+        hash_index = settings.RADIX_HASH_INDEX if hash_index is None else hash_index
+        self._hash_index: Optional[Dict[int, RadixNode]] = {} if hash_index else None # block hash -> node holding it
+
+        # Counters
         self.total_tokens_saved = 0
+        self.total_lookup_tokens = 0
+        self.num_evicted_nodes = 0
+        self.num_evicted_blocks = 0
+        self.num_demoted_blocks = 0
+        self.num_promoted_blocks = 0
 
     def match_prefix(self, tokens: List[int]) -> Tuple[RadixNode, int]:
         """
         Walks the tree to find the longest cached prefix.
+        A partially matched edge is split at the last block boundary before
+        the divergence point, so the returned node always ends exactly where
+        the match ends.
         Returns: (last_matching_node, number_of_matched_tokens)
         """
-        node = self.root
-        matched_len = 0
-        curr_tokens = tokens
-        
-        while curr_tokens:
-            first_tok = curr_tokens[0]
-            if first_tok in node.children:
-                child = node.children[first_tok]
-                
-                # Check if the edge fully matches
-                if self._match_key(curr_tokens, child.key):
-                    node = child
-                    match_size = len(child.key)
-                    matched_len += match_size
-                    curr_tokens = curr_tokens[match_size:]
-                    
-                    # Update LRU
-                    node.last_access = time.time()
-                else:
-                    # Partial match not implemented for simplicity
-                    break
+        match = self.lookup(tokens)
+        return match.node, match.matched_len
+
+    def lookup(self, tokens: List[int], block_hashes: Optional[List[int]] = None,
+               tenant: str = DEFAULT_TENANT) -> PrefixMatch:
+        """
+        match_prefix() plus where the matched KV came from. Demoted blocks on
+        the path are promoted: their device blocks are allocated (and part
+        of the path) on return, but callers must wait for match.promotions
+        before reading them. If the device pool cannot take them, the match
+        is cut back to the resident part.
+        block_hashes: the prompt's hash_blocks(), if the caller already has
+        them (only used with the hash index).
+        tenant: whose hit rate the lookup counts towards.
+        """
+        self._reap_promotions()
+        return self._lookup(tokens, block_hashes, time.time(), tenant)
+
+    def continuation(self, tokens: List[int], k: int, node: Optional[RadixNode] = None, pos: int = 0) -> List[int]:
+        """
+        Up to k cached tokens that followed tokens in an earlier sequence
+        (e.g. a speculative draft), or [] if tokens leave the tree. Read-only:
+        no splits, no LRU touch, and tokens need not be block-aligned.
+        node, pos: a node known to end at tokens[:pos] (e.g. a pinned prefix),
+        so only tokens[pos:] is walked.
+        """
+        node = node or self.root
+        bs = self.block_size
+        while pos < len(tokens):
+            rest = len(tokens) - pos
+            if rest >= bs:
+                child = node.children.get(tuple(tokens[pos:pos + bs]))
             else:
-                break
-        
+                tail = tokens[pos:]
+                child = next((c for c in node.children.values() if c.key[:rest] == tail), None)
+            if child is None:
+                return []
+            n = min(rest, len(child.key))
+            if tokens[pos:pos + n] != child.key[:n]:
+                return []
+            if n < len(child.key):
+                return child.key[n:n + k]
+            node = child
+            pos += n
+        if not node.children:
+            return []
+        # Ends on a node boundary: follow the most recently used branch
+        child = max(node.children.values(), key=lambda c: c.last_access)
+        return child.key[:k]
+
+    def _lookup(self, tokens: List[int], block_hashes: Optional[List[int]], now: float,
+                tenant: str = DEFAULT_TENANT) -> PrefixMatch:
+        start = time.perf_counter()
+        if self._hash_index is not None:
+            if block_hashes is None:
+                block_hashes = hash_blocks(tokens, self.block_size)
+            node, matched_len = self._find_hashed(block_hashes, now)
+        else:
+            node, matched_len = self._walk(tokens, self.root, now)
+        tiers = self._block_tiers(node)
+        if node.demoted:
+            node, matched_len = self._promote(node, matched_len)
+            del tiers[matched_len // self.block_size:]
+
+        self.total_lookup_tokens += len(tokens)
+        metrics.LOOKUP_TOKENS.inc(len(tokens))
         if matched_len > 0:
             self.total_tokens_saved += matched_len
-            
+            metrics.TOKENS_SAVED.inc(matched_len)
+        self.tenants.record_lookup(tenant, len(tokens), matched_len)
+
+        match = PrefixMatch(node, matched_len, tiers, self._pending_promotions(node))
+        metrics.RADIX_LOOKUP_SECONDS.observe(time.perf_counter() - start)
+        return match
+
+    def insert(self, tokens: List[int], last_node: Optional[RadixNode] = None,
+               block_ids: Optional[List[int]] = None, tenant: str = DEFAULT_TENANT) -> RadixNode:
+        """
+        Inserts new tokens into the tree starting from last_node (root if omitted).
+        Only whole blocks are cached; a trailing partial block is left to the caller.
+        If block_ids is given (one per block of tokens, KV already computed by a
+        request), the cache takes over the caller's reference on each of them
+        instead of allocating: new blocks are adopted, and the reference on
+        blocks it already holds (or on a partial tail) is released.
+        New blocks are charged to tenant; past its ceiling, only what fits
+        after evicting its own cold leaves is cached.
+        Returns the node that ends at the last cached token.
+        """
+        self._reap_promotions()
+        node = last_node or self.root
+        usable = len(tokens) - len(tokens) % self.block_size
+
+        # 1. Re-walk from last_node: another request may have cached part of
+        #    this suffix since our lookup, and we must not clobber its child.
+        node, matched_len = self._walk(tokens[:usable], node, time.time())
+        remaining = tokens[matched_len:usable]
+
+        if block_ids is not None:
+            # Demoted copies of what we computed: take our device blocks instead
+            start, end = matched_len // self.block_size, usable // self.block_size
+            start = self._adopt_demoted(node, start, block_ids)
+            # Drop the caller's reference on duplicates of cached blocks + partial tail
+            self.allocator.release(block_ids[:start] + block_ids[end:])
+            block_ids = block_ids[matched_len // self.block_size:end]
+        elif node.demoted:
+            promoted, _ = self._promote(node, matched_len)
+            if promoted is not node:
+                return promoted # Could not bring the cached suffix back; nothing to add
+        if not remaining:
+            return node
+
+        # 2. Allocate one physical block per BLOCK_SIZE tokens, within the
+        #    tenant's ceiling. Pin the attach point so eviction cannot take it.
+        self.lock(node)
+        room = self._quota_room(tenant, len(remaining) // self.block_size)
+        if block_ids is not None and room < len(block_ids):
+            self.allocator.release(block_ids[room:]) # Not cached: over the tenant's quota
+            block_ids = block_ids[:room]
+        if block_ids is None:
+            block_ids = self.allocator.allocate_blocks(room) or [] # None: pool exhausted, cache nothing
+
+        if block_ids:
+            remaining = remaining[:len(block_ids) * self.block_size]
+            new_node = RadixNode(key_tokens=remaining, parent=node)
+            new_node.value = block_ids
+            new_node.owner = tenant
+            self.tenants.charge(tenant, len(block_ids))
+            node.children[self._child_key(remaining)] = new_node
+            if self._hash_index is not None:
+                new_node.block_hashes = hash_blocks(
+                    remaining, self.block_size, node.block_hashes[-1] if node.block_hashes else 0)
+                self._index_blocks(new_node, new_node.block_hashes)
+            self._push_evictable(new_node)
+            logger.debug("cache_insert", tokens_added=len(remaining), block_ids=block_ids)
+
+        # 3. Unpinning folds a childless leaf into its new child (path compression).
+        #    Without a new child there is nothing to fold, and node must stay valid.
+        self._unlock(node, merge=bool(block_ids))
+        return new_node if block_ids else node
+
+    def pin(self, tokens: List[int]) -> RadixNode:
+        """
+        lock() on the cached prefix of tokens, found without counting as a
+        lookup (no hit-rate or promotion side effects). Returns the node to unlock().
+        """
+        self._reap_promotions()
+        node, _ = self._walk(tokens, self.root, time.time())
+        self.lock(node)
+        return node
+
+    def lock(self, node: RadixNode):
+        """
+        Pins node and all its ancestors so none of their blocks can be evicted.
+        """
+        while node is not self.root:
+            if node.lock_count == 0:
+                self._evictable.discard(node)
+                self._swap_evictable.discard(node)
+            node.lock_count += 1
+            node = node.parent
+
+    def unlock(self, node: RadixNode):
+        """
+        Releases a pin taken by lock(). Nodes that become unpinned leaves are
+        queued for eviction; unpinned single-child nodes are merged away.
+        """
+        self._unlock(node, merge=True)
+
+    def _unlock(self, node: RadixNode, merge: bool):
+        while node is not self.root:
+            parent = node.parent
+            node.lock_count -= 1
+            if node.lock_count == 0:
+                if self._is_leaf(node):
+                    self._push_evictable(node)
+                elif merge and len(node.children) == 1 and self._same_owner_child(node):
+                    self._merge_with_child(node)
+            node = parent
+
+    def evict(self, num_blocks: int) -> int:
+        """
+        Returns up to num_blocks blocks to the allocator, trimming unpinned
+        leaves from their tail in policy order (demoting them to the swap
+        tier when there is one).
+        Returns: number of blocks actually freed.
+        """
+        self._reap_promotions()
+        demoted = self.num_demoted_blocks
+        # Blocks above tenants' guaranteed floors first, guaranteed ones only as a last resort
+        freed = self._evict(num_blocks, floors=True)
+        if freed < num_blocks:
+            freed += self._evict(num_blocks - freed, floors=False)
+
+        if freed:
+            logger.debug("cache_evict", blocks_freed=freed, blocks_demoted=self.num_demoted_blocks - demoted,
+                         policy=self.policy.name)
+        return freed
+
+    def _evict(self, num_blocks: int, floors: bool, owner: Optional[str] = None) -> int:
+        """
+        Trims up to num_blocks from unpinned leaves in policy order, across
+        all owners (or only owner's). With floors, no tenant is taken below
+        its guaranteed minimum.
+        """
+        freed = 0
+        while freed < num_blocks:
+            node = self._pop_victim(floors, owner)
+            if node is None:
+                break
+            # Trim whole blocks off the tail; the prefix stays cached
+            take = min(num_blocks - freed, len(node.value))
+            if floors:
+                take = min(take, self.tenants.reclaimable(node.owner))
+            if self._make_swap_room(take):
+                self._demote_tail(node, take)
+            else:
+                self._drop_tail(node, take)
+                self.num_evicted_blocks += take
+                _DROPPED.inc(take)
+            freed += take
+        return freed
+
+    def _pop_victim(self, floors: bool, owner: Optional[str] = None) -> Optional[RadixNode]:
+        """The policy's first evictable leaf over the eligible owners' heaps (there are few tenants)."""
+        best = None
+        for tenant, heap in ([(owner, self._evict_heaps.get(owner, []))] if owner is not None
+                             else self._evict_heaps.items()):
+            if floors and not self.tenants.reclaimable(tenant):
+                continue
+            while heap and (heap[0][1] != heap[0][2].heap_seq or heap[0][2] not in self._evictable):
+                heapq.heappop(heap) # Stale entry: node was touched, pinned or removed since
+            if heap and (best is None or heap[0] < best[0]):
+                best = heap
+        return heapq.heappop(best)[2] if best is not None else None
+
+    def _quota_room(self, tenant: str, num_blocks: int) -> int:
+        """How many of num_blocks new blocks tenant may cache, evicting its own leaves to stay under its ceiling."""
+        ceiling = self.tenants.ceiling(tenant)
+        if ceiling is None:
+            return num_blocks
+        over = self.tenants.get(tenant).cached_blocks + num_blocks - ceiling
+        if over > 0:
+            self._evict(over, floors=False, owner=tenant)
+        return max(0, min(num_blocks, ceiling - self.tenants.get(tenant).cached_blocks))
+
+    def _drop_tail(self, node: RadixNode, take: int):
+        """Frees node's last take blocks (device or swap) for good."""
+        keep = len(node.value) - take
+        if node.demoted:
+            self.swap.free(node.value[keep:])
+        else:
+            self.allocator.release(node.value[keep:])
+            self.tenants.charge(node.owner, -take)
+        if self._hash_index is not None:
+            for h in node.block_hashes[keep:]:
+                del self._hash_index[h]
+            node.block_hashes = node.block_hashes[:keep]
+        # Demoted descendants hang off the dropped tail: unreachable without it
+        for child in list(node.children.values()):
+            self._drop_subtree(child)
+        if keep:
+            node.value = node.value[:keep]
+            node.key = node.key[:keep * self.block_size]
+            self._push_evictable(node)
+        else:
+            self._remove_leaf(node)
+
+    def _drop_subtree(self, node: RadixNode):
+        for child in list(node.children.values()):
+            self._drop_subtree(child)
+        self.swap.free(node.value)
+        if self._hash_index is not None:
+            for h in node.block_hashes:
+                del self._hash_index[h]
+        self.num_evicted_blocks += len(node.value)
+        _DROPPED.inc(len(node.value))
+        del node.parent.children[self._child_key(node.key)]
+        self._swap_evictable.discard(node)
+        node.parent = None
+        self.num_evicted_nodes += 1
+
+    def _make_swap_room(self, num_slots: int) -> bool:
+        """Drops the coldest demoted leaves until num_slots swap slots are free."""
+        if self.swap is None or num_slots > self.swap.capacity:
+            return False
+        while self.swap.num_free < num_slots and self._swap_heap:
+            _, seq, node = heapq.heappop(self._swap_heap)
+            if seq != node.heap_seq or node not in self._swap_evictable:
+                continue
+            take = min(num_slots - self.swap.num_free, len(node.value))
+            self._drop_tail(node, take)
+            self.num_evicted_blocks += take
+            _DROPPED.inc(take)
+        return self.swap.num_free >= num_slots
+
+    def _demote_tail(self, node: RadixNode, take: int):
+        """Moves node's last take blocks to the swap tier, splitting off that tail."""
+        keep = len(node.value) - take
+        if keep:
+            self._split_node(node, keep * self.block_size) # node keeps the tail
+        self._evictable.discard(node)
+
+        slots = self.swap.allocate(take)
+        self.swap.store(node.value, slots)
+        self.allocator.release(node.value)
+        self.tenants.charge(node.owner, -take)
+        node.value = slots
+        node.demoted = True
+        self.num_demoted_blocks += take
+        _DEMOTED.inc(take)
+
+        if not node.children:
+            self._push_evictable(node)
+        parent = node.parent
+        if parent is not self.root and parent.lock_count == 0 and self._is_leaf(parent):
+            self._push_evictable(parent) # Now a device-resident leaf in effect
+
+    def _promote(self, node: RadixNode, matched_len: int) -> Tuple[RadixNode, int]:
+        """
+        Gives the demoted tail of node's path device blocks again and queues
+        the copy back. The path stays pinned until _reap_promotions() sees
+        the copy land. On OOM, returns the deepest resident ancestor instead.
+        """
+        path = []
+        anchor = node
+        while anchor.demoted:
+            path.append(anchor)
+            anchor = anchor.parent
+        path.reverse()
+
+        # Pin first: allocating may evict, and must neither demote the
+        # resident prefix nor drop the demoted nodes we are about to revive.
+        self.lock(node)
+        blocks = self.allocator.allocate_blocks(sum(len(n.value) for n in path))
+        if blocks is None:
+            self._unlock(node, merge=False)
+            logger.warning("swap_promotion_oom", blocks=sum(len(n.value) for n in path))
+            return anchor, matched_len - sum(len(n.key) for n in path)
+
+        slots = []
+        offset = 0
+        for n in path:
+            slots.extend(n.value)
+            n.value = blocks[offset:offset + len(n.value)]
+            n.demoted = False
+            self.tenants.charge(n.owner, len(n.value))
+            offset += len(n.value)
+        future = self._promote_executor.submit(self.swap.load, slots, blocks)
+        for n in path:
+            n.promotion = future
+        self._promotions.append((future, node, path, slots))
+        self.num_promoted_blocks += len(blocks)
+        logger.debug("swap_promotion_started", blocks=len(blocks))
         return node, matched_len
 
-    def insert(self, tokens: List[int], last_node: RadixNode):
+    def _reap_promotions(self):
+        """Unpins paths whose swap -> device copy has finished."""
+        if not self._promotions:
+            return
+        pending = []
+        for future, node, path, slots in self._promotions:
+            if not future.done():
+                pending.append((future, node, path, slots))
+                continue
+            if future.exception() is not None:
+                logger.error("swap_promotion_failed", error=str(future.exception()))
+            self.swap.free(slots)
+            for n in path:
+                if n.promotion is future:
+                    n.promotion = None
+            self.unlock(node)
+        self._promotions = pending
+
+    def _pending_promotions(self, node: RadixNode) -> List[Future]:
+        futures = []
+        while node is not self.root:
+            if node.promotion is not None and not node.promotion.done() and node.promotion not in futures:
+                futures.append(node.promotion)
+            node = node.parent
+        return futures
+
+    def _adopt_demoted(self, node: RadixNode, end: int, block_ids: List[int]) -> int:
         """
-        Inserts new tokens into the tree starting from last_node.
+        Demoted nodes at the bottom of a path the caller has just computed
+        take the caller's device blocks (block_ids, one per block of the
+        path) instead of their swap slots.
+        Returns the index of the first adopted block (end if none).
         """
-        if not tokens:
+        while node.demoted:
+            start = end - len(node.value)
+            self.swap.free(node.value)
+            node.value = block_ids[start:end]
+            node.demoted = False
+            self.tenants.charge(node.owner, len(node.value))
+            self._swap_evictable.discard(node)
+            if node.lock_count == 0 and self._is_leaf(node):
+                self._push_evictable(node)
+            self._evictable.discard(node.parent) # Has a resident child now
+            end = start
+            node = node.parent
+        return end
+
+    @property
+    def has_hash_index(self) -> bool:
+        return self._hash_index is not None
+
+    @property
+    def hit_ratio(self) -> float:
+        if not self.total_lookup_tokens:
+            return 0.0
+        return self.total_tokens_saved / self.total_lookup_tokens
+
+    def stats(self) -> dict:
+        stats = {
+            "hit_ratio": round(self.hit_ratio, 4),
+            "tokens_saved": self.total_tokens_saved,
+            "lookup_tokens": self.total_lookup_tokens,
+            "evicted_nodes": self.num_evicted_nodes,
+            "evicted_blocks": self.num_evicted_blocks,
+            "evictable_leaves": len(self._evictable),
+            "eviction_policy": self.policy.name,
+            "tenants": self.tenants.stats(self.allocator.num_blocks),
+        }
+        if self.swap is not None:
+            stats.update({
+                "demoted_blocks": self.num_demoted_blocks,
+                "promoted_blocks": self.num_promoted_blocks,
+                "swap": self.swap.stats(),
+            })
+        return stats
+
+    def num_nodes(self) -> int:
+        """Tree size, excluding the root. O(nodes): meant for scrapes, not hot paths."""
+        return sum(1 for _ in self._iter_nodes())
+
+    def num_pinned_blocks(self) -> int:
+        """Device blocks held by nodes that in-flight requests have locked."""
+        return sum(len(node.value) for node in self._iter_nodes() if node.lock_count and not node.demoted)
+
+    def _iter_nodes(self):
+        stack = list(self.root.children.values())
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children.values())
+
+    def get_block_ids(self, node: RadixNode) -> List[int]:
+        """
+        Returns the physical block table for the prefix ending at node.
+        """
+        path = []
+        while node is not None:
+            path.append(node.value)
+            node = node.parent
+        return [block_id for value in reversed(path) for block_id in value]
+
+    def _block_tiers(self, node: RadixNode) -> List[str]:
+        tiers = []
+        while node is not self.root:
+            if node.demoted:
+                tiers.extend(self.swap.tier_of(slot) for slot in reversed(node.value))
+            else:
+                tiers.extend("gpu" for _ in node.value)
+            node = node.parent
+        tiers.reverse()
+        return tiers
+
+    def _walk(self, tokens: List[int], node: RadixNode, now: float) -> Tuple[RadixNode, int]:
+        """
+        Descends from node along tokens, splitting a partially matched edge.
+        Returns: (deepest_node, matched_tokens) with matched_tokens block-aligned.
+        """
+        pos = 0
+        while len(tokens) - pos >= self.block_size:
+            child = node.children.get(tuple(tokens[pos:pos + self.block_size]))
+            if child is None:
+                break
+
+            match_size = self._match_blocks(tokens, pos, child.key)
+            diverged = match_size < len(child.key)
+            if diverged:
+                child = self._split_node(child, match_size)
+
+            node = child
+            pos += match_size
+            self._touch(node, now)
+            if diverged:
+                break
+
+        return node, pos
+
+    def _find_hashed(self, block_hashes: List[int], now: float) -> Tuple[RadixNode, int]:
+        """
+        Hash-index equivalent of _walk() from the root. Every prefix of a
+        cached path is cached too, so the matched blocks are found by a
+        binary search over block_hashes.
+        """
+        lo, hi = 0, len(block_hashes) # lo blocks are known to match
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if block_hashes[mid - 1] in self._hash_index:
+                lo = mid
+            else:
+                hi = mid - 1
+        if lo == 0:
+            return self.root, 0
+
+        node = self._hash_index[block_hashes[lo - 1]]
+        end = node.block_hashes.index(block_hashes[lo - 1]) + 1
+        if end < len(node.value):
+            node = self._split_node(node, end * self.block_size)
+        path = []
+        ancestor = node
+        while ancestor is not self.root:
+            path.append(ancestor)
+            ancestor = ancestor.parent
+        for ancestor in reversed(path): # Root-down, in _walk's order
+            self._touch(ancestor, now)
+        return node, lo * self.block_size
+
+    def _touch(self, node: RadixNode, now: float):
+        # Update LRU / LFU bookkeeping
+        node.last_access = now
+        node.hit_count += 1
+        if node in self._evictable or node in self._swap_evictable:
+            self._push_evictable(node)
+
+    def _index_blocks(self, node: RadixNode, block_hashes: List[int]):
+        for h in block_hashes:
+            self._hash_index[h] = node
+
+    def _split_node(self, child: RadixNode, split_len: int) -> RadixNode:
+        """
+        Splits child's edge at split_len tokens (a block boundary).
+        The new upper node takes the shared prefix; child keeps the tail so
+        that existing references to it still denote the same full prefix.
+        """
+        split_blocks = split_len // self.block_size
+        upper = RadixNode(key_tokens=child.key[:split_len], parent=child.parent)
+        upper.value = child.value[:split_blocks]
+        upper.last_access = child.last_access
+        upper.hit_count = child.hit_count
+        upper.lock_count = child.lock_count
+        upper.demoted = child.demoted
+        upper.promotion = child.promotion
+        upper.owner = child.owner
+        if self._hash_index is not None:
+            upper.block_hashes = child.block_hashes[:split_blocks]
+            child.block_hashes = child.block_hashes[split_blocks:]
+            self._index_blocks(upper, upper.block_hashes)
+
+        child.parent.children[self._child_key(upper.key)] = upper
+        child.key = child.key[split_len:]
+        child.value = child.value[split_blocks:]
+        child.parent = upper
+        upper.children[self._child_key(child.key)] = child
+        return upper
+
+    def _merge_with_child(self, node: RadixNode):
+        """
+        Folds an unpinned node into its only child. The child object survives,
+        so it keeps denoting the same full prefix.
+        """
+        (child,) = node.children.values()
+        child.key = node.key + child.key
+        child.value = node.value + child.value
+        child.hit_count = max(child.hit_count, node.hit_count)
+        if self._hash_index is not None:
+            self._index_blocks(child, node.block_hashes)
+            child.block_hashes = node.block_hashes + child.block_hashes
+        child.parent = node.parent
+        node.parent.children[self._child_key(child.key)] = child
+        node.children = {}
+        node.parent = None
+        if child in self._evictable or child in self._swap_evictable:
+            self._push_evictable(child) # Size changed
+
+    def _remove_leaf(self, node: RadixNode):
+        parent = node.parent
+        del parent.children[self._child_key(node.key)]
+        self._evictable.discard(node)
+        self._swap_evictable.discard(node)
+        node.parent = None
+        self.num_evicted_nodes += 1
+
+        if parent is self.root or parent.lock_count > 0:
             return
+        if (len(parent.children) == 1 and next(iter(parent.children.values())).demoted == parent.demoted
+                and self._same_owner_child(parent)):
+            self._merge_with_child(parent)
+        elif self._is_leaf(parent):
+            self._push_evictable(parent)
+
+    def _same_owner_child(self, node: RadixNode) -> bool:
+        """Whether node's only child belongs to the same tenant (else they stay apart)."""
+        return next(iter(node.children.values())).owner == node.owner
+
+    def _has_resident_children(self, node: RadixNode) -> bool:
+        return any(not child.demoted for child in node.children.values())
 
-        # Allocate new memory block
-        block_id = self.allocator.allocate()
-        
-        # Create new node
-        new_node = RadixNode(key_tokens=tokens, parent=last_node)
-        new_node.value = block_id
-        
-        # Link to parent
-        last_node.children[tokens[0]] = new_node
-        
-        logger.debug("cache_insert", tokens_added=len(tokens), block_id=block_id)
-
-    def _match_key(self, query, key):
-        if len(query) < len(key): return False
-        return query[:len(key)] == key
\ No newline at end of file
+    def _is_leaf(self, node: RadixNode) -> bool:
+        """Leaf of its own tier: demoted nodes only ever have demoted children."""
+        return not node.children if node.demoted else not self._has_resident_children(node)
+
+    def _push_evictable(self, node: RadixNode):
+        """Queues node on the device or the swap eviction heap, per its tier."""
+        if node.demoted:
+            evictable, heap = self._swap_evictable, self._swap_heap
+        else:
+            evictable, heap = self._evictable, self._evict_heaps.setdefault(node.owner, [])
+        evictable.add(node)
+        node.heap_seq = next(self._heap_seq)
+        heapq.heappush(heap, (self.policy.priority(node), node.heap_seq, node))
+
+        # Drop stale entries once they dominate the heap
+        if len(heap) > 2 * len(evictable) + 1024:
+            heap[:] = [(self.policy.priority(n), n.heap_seq, n) for n in evictable
+                       if node.demoted or n.owner == node.owner]
+            heapq.heapify(heap)
+
+    def _child_key(self, tokens: List[int]) -> Tuple[int, ...]:
+        return tuple(tokens[:self.block_size])
+
+    def _match_blocks(self, tokens: List[int], pos: int, key: List[int]) -> int:
+        """
+        Length of the block-aligned common prefix of tokens[pos:] and key,
+        whose first block is known to match. Compares the whole overlap as
+        one slice; only a divergent edge is rescanned block by block.
+        """
+        bs = self.block_size
+        n = min(len(tokens) - pos, len(key))
+        n -= n % bs
+        if tokens[pos:pos + n] == (key if n == len(key) else key[:n]):
+            return n
+        for start in range(bs, n, bs):
+            if tokens[pos + start:pos + start + bs] != key[start:start + bs]:
+                return start
+        return n
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import numpy as np
+import torch
+import structlog
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from hyperserve.config import settings
+from hyperserve.memory.radix_cache import RadixCache, RadixNode
+
+logger = structlog.get_logger()
+
+SNAPSHOT_MAGIC = b"HSRADIX\0"
+SNAPSHOT_VERSION = 2 # 2: per-node owners
+_ALIGN = 64
+
+@dataclass
+class RadixSnapshot:
+    """
+    A RadixCache flattened into arrays, nodes in pre-order (parents first).
+    Block contents are stored rather than block IDs: device memory does not
+    survive a restart, so IDs are reassigned on restore. Owners are indices
+    into meta["tenants"], so restored nodes are charged to the same tenants.
+    """
+    meta: dict
+    parents: np.ndarray    # int32 [N], index of the parent node, -1 = root
+    num_blocks: np.ndarray # int32 [N], blocks (= edge length / block_size) per node
+    owners: np.ndarray     # int32 [N], index into meta["tenants"] of the node's owner
+    tokens: np.ndarray     # int32 [B, block_size], edge tokens, node after node
+    kv: np.ndarray         # [B, *block_shape], KV contents in the same order
+
+    @property
+    def total_blocks(self) -> int:
+        return len(self.tokens)
+
+def expected_meta(kv_cache: torch.Tensor, block_size: int) -> dict:
+    """What a snapshot must have been taken with to be usable by this engine."""
+    return {
+        "version": SNAPSHOT_VERSION,
+        "model": settings.MODEL_NAME,
+        "block_size": block_size,
+        "block_shape": list(kv_cache.shape[1:]),
+        "dtype": str(kv_cache.dtype),
+    }
+
+def capture(cache: RadixCache, kv_cache: torch.Tensor) -> RadixSnapshot:
+    """
+    Copies the tree and its KV into a snapshot. Must run on the engine's
+    thread between steps (it reads the tree and the pool as they are).
+    Paths still being promoted from swap are left out; demoted nodes are
+    read from the swap tier.
+    """
+    nodes: List[RadixNode] = []
+    parents: List[int] = []
+    # Pre-order DFS, hottest child first, so a budget-limited restore keeps the hot paths
+    stack = [(child, -1) for child in _coldest_first(cache.root)]
+    while stack:
+        node, parent = stack.pop()
+        if node.promotion is not None and not node.promotion.done():
+            continue # Its device blocks are still being filled in
+        parents.append(parent)
+        nodes.append(node)
+        stack.extend((child, len(nodes) - 1) for child in _coldest_first(node))
+
+    num_blocks = np.array([len(n.value) for n in nodes], dtype=np.int32)
+    tenants: Dict[str, int] = {}
+    owners = np.array([tenants.setdefault(n.owner, len(tenants)) for n in nodes], dtype=np.int32)
+    total = int(num_blocks.sum())
+    tokens = np.empty((total, cache.block_size), dtype=np.int32)
+    kv = np.empty((total,) + tuple(kv_cache.shape[1:]), dtype=torch.empty(0, dtype=kv_cache.dtype).numpy().dtype)
+
+    resident_rows, resident_ids, demoted_rows, demoted_slots = [], [], [], []
+    row = 0
+    for node in nodes:
+        n = len(node.value)
+        tokens[row:row + n] = np.asarray(node.key, dtype=np.int32).reshape(n, cache.block_size)
+        rows = range(row, row + n)
+        if node.demoted:
+            demoted_rows.extend(rows)
+            demoted_slots.extend(node.value)
+        else:
+            resident_rows.extend(rows)
+            resident_ids.extend(node.value)
+        row += n
+    if resident_ids:
+        kv[resident_rows] = kv_cache[torch.tensor(resident_ids, dtype=torch.long)].cpu().numpy()
+    if demoted_slots:
+        kv[demoted_rows] = cache.swap.read(demoted_slots)
+
+    meta = expected_meta(kv_cache, cache.block_size)
+    meta.update(created_at=time.time(), num_nodes=len(nodes), num_blocks=total, tenants=list(tenants))
+    return RadixSnapshot(meta, np.array(parents, dtype=np.int32), num_blocks, owners, tokens, kv)
+
+def write(snapshot: RadixSnapshot, path: str):
+    """
+    Layout: magic | uint64 header length | JSON header | arrays, each
+    64-byte aligned so read() can map them in place. Safe to call off the
+    event loop thread: the snapshot owns copies of everything it holds.
+    """
+    arrays = {
+        "parents": snapshot.parents, "num_blocks": snapshot.num_blocks, "owners": snapshot.owners,
+        "tokens": snapshot.tokens, "kv": snapshot.kv,
+    }
+    layout: Dict[str, dict] = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({"meta": snapshot.meta, "arrays": layout}).encode()
+    data_start = _aligned(len(SNAPSHOT_MAGIC) + 8 + len(header))
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp, path) # Never leave a half-written snapshot behind
+
+def read(path: str, expected: dict, max_age_s: float = None) -> RadixSnapshot:
+    """
+    Maps a snapshot without copying it. Raises ValueError if it is not a
+    snapshot, was taken with a different format / model / block layout,
+    or is older than max_age_s (0 = no limit).
+    """
+    max_age_s = settings.RADIX_SNAPSHOT_MAX_AGE_S if max_age_s is None else max_age_s
+    with open(path, "rb") as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError("not a radix snapshot")
+        header = json.loads(f.read(int.from_bytes(f.read(8), "little")))
+        data_start = _aligned(f.tell())
+
+    meta = header["meta"]
+    for key, value in expected.items():
+        if meta.get(key) != value:
+            raise ValueError(f"{key} mismatch: snapshot has {meta.get(key)!r}, engine has {value!r}")
+    age = time.time() - meta["created_at"]
+    if max_age_s and age > max_age_s:
+        raise ValueError(f"stale: taken {age:.0f}s ago (limit {max_age_s:.0f}s)")
+
+    raw = np.memmap(path, dtype=np.uint8, mode="r")
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        start = data_start + spec["offset"]
+        count = int(np.prod(spec["shape"]))
+        arrays[name] = raw[start:start + count * dtype.itemsize].view(dtype).reshape(spec["shape"])
+    return RadixSnapshot(meta, **arrays)
+
+def restore(cache: RadixCache, kv_cache: torch.Tensor, snapshot: RadixSnapshot,
+            max_blocks: Optional[int] = None) -> int:
+    """
+    Rebuilds the snapshot's tree in cache, copying its KV into freshly
+    allocated device blocks, each node charged to its original owner.
+    Stops taking nodes once max_blocks (default: the free pool) is used
+    up, so a restore never evicts anything. A node cut short by its
+    owner's ceiling keeps what fit; nodes whose parent was not restored
+    in full are skipped.
+    Returns: number of blocks restored.
+    """
+    budget = cache.allocator.num_free if max_blocks is None else min(max_blocks, cache.allocator.num_free)
+    starts = np.concatenate(([0], np.cumsum(snapshot.num_blocks))).tolist()
+    tenants = snapshot.meta["tenants"]
+    nodes: List[Optional[RadixNode]] = []
+    pinned: List[RadixNode] = []
+    restored = 0
+    for i, (parent, n, owner) in enumerate(zip(snapshot.parents.tolist(), snapshot.num_blocks.tolist(),
+                                               snapshot.owners.tolist())):
+        attach = cache.root if parent < 0 else nodes[parent]
+        if attach is None or n > budget - restored:
+            nodes.append(None)
+            continue
+        rows = slice(starts[i], starts[i] + n)
+        block_ids = cache.allocator.allocate_blocks(n)
+        kv_cache[torch.tensor(block_ids, dtype=torch.long)] = torch.from_numpy(np.array(snapshot.kv[rows])).to(kv_cache.device)
+        # The cache takes over our reference on the blocks (and releases what
+        # the owner's ceiling leaves out). Pinning each new node keeps it from
+        # being merged away while its children still attach to it.
+        node = cache.insert(snapshot.tokens[rows].ravel().tolist(), last_node=attach, block_ids=block_ids,
+                            tenant=tenants[owner])
+        cache.lock(node)
+        pinned.append(node)
+        kept = _path_len(node, attach) // cache.block_size
+        nodes.append(node if kept == n else None) # Children continue past the blocks that were left out
+        restored += kept
+
+    # Children before parents, so each unpin may compress the chain below it
+    for node in reversed(pinned):
+        cache.unlock(node)
+    return restored
+
+def _path_len(node: RadixNode, ancestor: RadixNode) -> int:
+    """Tokens on the path from ancestor down to node."""
+    length = 0
+    while node is not ancestor:
+        length += len(node.key)
+        node = node.parent
+    return length
+
+def _coldest_first(node: RadixNode) -> List[RadixNode]:
+    return sorted(node.children.values(), key=lambda n: (n.hit_count, n.last_access))
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _ALIGN) * _ALIGN
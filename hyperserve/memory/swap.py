@@ -0,0 +1,132 @@
+import os
+import tempfile
+import numpy as np
+import torch
+import structlog
+from typing import List, Optional
+from hyperserve.config import settings
+
+logger = structlog.get_logger()
+
+class SwapSpace:
+    """
+    Second-tier storage for KV blocks demoted out of the device pool.
+    Architecture:
+    - Slots [0, num_host_blocks) are a host-RAM tensor (pinned when CUDA is
+      present, so device copies can run asynchronously).
+    - Slots [num_host_blocks, num_host_blocks + num_disk_blocks) are rows of
+      a memory-mapped file on disk; the OS page cache does the buffering.
+    - allocate() prefers host slots and spills to disk once they run out.
+    - store() runs on the caller's thread (the device block is reused right
+      after); load() only reads swap slots and writes freshly allocated
+      device blocks, so it is safe to run on a background thread.
+    """
+    def __init__(self, device_cache: torch.Tensor, num_host_blocks: int = None,
+                 num_disk_blocks: int = None, disk_path: str = None):
+        self.device_cache = device_cache
+        self.num_host_blocks = settings.SWAP_HOST_BLOCKS if num_host_blocks is None else num_host_blocks
+        self.num_disk_blocks = settings.SWAP_DISK_BLOCKS if num_disk_blocks is None else num_disk_blocks
+        block_shape = tuple(device_cache.shape[1:])
+
+        self.host = torch.empty((self.num_host_blocks,) + block_shape, dtype=device_cache.dtype)
+        if torch.cuda.is_available():
+            self.host = self.host.pin_memory()
+
+        self.disk = None
+        self.disk_path = None
+        self._owns_disk_file = False
+        if self.num_disk_blocks:
+            self.disk_path = disk_path or settings.SWAP_DISK_PATH
+            if not self.disk_path:
+                fd, self.disk_path = tempfile.mkstemp(prefix="hyperserve-swap-", suffix=".kv")
+                os.close(fd)
+                self._owns_disk_file = True
+            self.disk = np.memmap(self.disk_path, dtype=self.host.numpy().dtype, mode="w+",
+                                  shape=(self.num_disk_blocks,) + block_shape)
+
+        self._free_host: List[int] = list(range(self.num_host_blocks - 1, -1, -1))
+        self._free_disk: List[int] = list(range(self.capacity - 1, self.num_host_blocks - 1, -1))
+        self.num_stored_blocks = 0
+        self.num_loaded_blocks = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.num_host_blocks + self.num_disk_blocks
+
+    @property
+    def num_free(self) -> int:
+        return len(self._free_host) + len(self._free_disk)
+
+    def tier_of(self, slot: int) -> str:
+        return "host" if slot < self.num_host_blocks else "disk"
+
+    def allocate(self, num_slots: int) -> Optional[List[int]]:
+        """All-or-nothing, host slots first. Returns None if there is no room."""
+        if num_slots > self.num_free:
+            return None
+        slots = []
+        for free in (self._free_host, self._free_disk):
+            take = min(num_slots - len(slots), len(free))
+            if take:
+                slots.extend(free[-take:])
+                del free[-take:]
+        return slots
+
+    def free(self, slots: List[int]):
+        for slot in slots:
+            (self._free_host if slot < self.num_host_blocks else self._free_disk).append(slot)
+
+    def store(self, block_ids: List[int], slots: List[int]):
+        """Copies device blocks into swap slots (demotion)."""
+        blocks, slots, on_host = self._index(block_ids, slots)
+        if on_host.any():
+            self.host[slots[on_host]] = self.device_cache[blocks[on_host]].cpu()
+        if not on_host.all():
+            on_disk = ~on_host
+            self.disk[(slots[on_disk] - self.num_host_blocks).numpy()] = \
+                self.device_cache[blocks[on_disk]].cpu().numpy()
+        self.num_stored_blocks += len(slots)
+
+    def load(self, slots: List[int], block_ids: List[int]):
+        """Copies swap slots back into device blocks (promotion)."""
+        blocks, slots, on_host = self._index(block_ids, slots)
+        device = self.device_cache.device
+        if on_host.any():
+            self.device_cache[blocks[on_host]] = self.host[slots[on_host]].to(device, non_blocking=True)
+        if not on_host.all():
+            on_disk = ~on_host
+            rows = np.asarray(self.disk[(slots[on_disk] - self.num_host_blocks).numpy()]) # A copy, not a view
+            self.device_cache[blocks[on_disk]] = torch.from_numpy(rows).to(device)
+        if self.device_cache.is_cuda:
+            torch.cuda.current_stream().synchronize()
+        self.num_loaded_blocks += len(slots)
+
+    def read(self, slots: List[int]) -> np.ndarray:
+        """Copies swap slots out as one host array, in slot order (e.g. for snapshots)."""
+        _, slots, on_host = self._index(slots, slots)
+        out = np.empty((len(slots),) + tuple(self.host.shape[1:]), dtype=self.host.numpy().dtype)
+        if on_host.any():
+            out[on_host.numpy()] = self.host[slots[on_host]].numpy()
+        if not on_host.all():
+            on_disk = ~on_host
+            out[on_disk.numpy()] = self.disk[(slots[on_disk] - self.num_host_blocks).numpy()]
+        return out
+
+    def close(self):
+        self.disk = None
+        if self._owns_disk_file:
+            os.unlink(self.disk_path)
+            self._owns_disk_file = False
+
+    def stats(self) -> dict:
+        return {
+            "host_blocks_used": self.num_host_blocks - len(self._free_host),
+            "disk_blocks_used": self.num_disk_blocks - len(self._free_disk),
+            "stored_blocks": self.num_stored_blocks,
+            "loaded_blocks": self.num_loaded_blocks,
+        }
+
+    def _index(self, block_ids: List[int], slots: List[int]):
+        blocks = torch.tensor(block_ids, dtype=torch.long)
+        slots = torch.tensor(slots, dtype=torch.long)
+        return blocks, slots, slots < self.num_host_blocks
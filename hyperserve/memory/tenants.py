@@ -0,0 +1,90 @@
+from typing import Dict, Optional
+from hyperserve import metrics
+from hyperserve.config import settings
+
+DEFAULT_TENANT = "default"
+_OTHER_LABEL = "other" # Metric label for tenants without configured limits (bounds label cardinality)
+
+class TenantUsage:
+    """One tenant's share of a RadixCache, plus its bound metric children."""
+    __slots__ = ("cached_blocks", "lookup_tokens", "tokens_saved", "_lookup_metric", "_saved_metric")
+
+    def __init__(self, label: str):
+        self.cached_blocks = 0 # Device blocks of nodes this tenant inserted
+        self.lookup_tokens = 0 # Prompt tokens its requests looked up
+        self.tokens_saved = 0  # ... and found cached (whoever owns the blocks)
+        self._lookup_metric = metrics.TENANT_LOOKUP_TOKENS.labels(tenant=label)
+        self._saved_metric = metrics.TENANT_TOKENS_SAVED.labels(tenant=label)
+
+    def record_lookup(self, tokens: int, saved: int):
+        self.lookup_tokens += tokens
+        self.tokens_saved += saved
+        self._lookup_metric.inc(tokens)
+        if saved:
+            self._saved_metric.inc(saved)
+
+class TenantQuotas:
+    """
+    Per-tenant accounting and limits for the device blocks a RadixCache holds.
+    Architecture:
+    - Every cached node is owned by the tenant whose request inserted it.
+      Its blocks are stored once and charged to that owner only, however
+      many tenants hit them.
+    - min_blocks: a guaranteed floor. Eviction takes other tenants' blocks
+      first and only goes below a floor when nothing else is evictable.
+    - max_blocks: a ceiling on what a tenant keeps cached. Inserting beyond
+      it evicts the tenant's own coldest blocks; what still does not fit
+      is simply not cached.
+    - Hits are counted for the requesting tenant, not the owner, so hit
+      rates show what each tenant gets out of the shared cache.
+    """
+    def __init__(self, min_blocks: Dict[str, int] = None, max_blocks: Dict[str, int] = None,
+                 default_max_blocks: int = None, replica: int = 0):
+        self.min_blocks = dict(settings.TENANT_MIN_BLOCKS if min_blocks is None else min_blocks)
+        self.max_blocks = dict(settings.TENANT_MAX_BLOCKS if max_blocks is None else max_blocks)
+        self.default_max_blocks = settings.TENANT_DEFAULT_MAX_BLOCKS if default_max_blocks is None else default_max_blocks
+        self.replica = replica
+        self.tenants: Dict[str, TenantUsage] = {}
+        metrics.TENANT_CACHED_BLOCKS.labels(replica=replica, tenant=_OTHER_LABEL).set_function(
+            lambda: sum(t.cached_blocks for name, t in self.tenants.items() if self._label(name) == _OTHER_LABEL))
+
+    def get(self, tenant: str) -> TenantUsage:
+        usage = self.tenants.get(tenant)
+        if usage is None:
+            label = self._label(tenant)
+            usage = self.tenants[tenant] = TenantUsage(label)
+            if label != _OTHER_LABEL:
+                metrics.TENANT_CACHED_BLOCKS.labels(replica=self.replica, tenant=label).set_function(
+                    lambda: usage.cached_blocks)
+        return usage
+
+    def _label(self, tenant: str) -> str:
+        configured = tenant == DEFAULT_TENANT or tenant in self.min_blocks or tenant in self.max_blocks
+        return tenant if configured else _OTHER_LABEL
+
+    def charge(self, tenant: str, blocks: int):
+        """Adds (or, negative, removes) device blocks cached under tenant."""
+        self.get(tenant).cached_blocks += blocks
+
+    def record_lookup(self, tenant: str, tokens: int, saved: int):
+        self.get(tenant).record_lookup(tokens, saved)
+
+    def reclaimable(self, tenant: str) -> int:
+        """Cached blocks above the tenant's guaranteed floor."""
+        return max(0, self.get(tenant).cached_blocks - self.min_blocks.get(tenant, 0))
+
+    def ceiling(self, tenant: str) -> Optional[int]:
+        limit = self.max_blocks.get(tenant, self.default_max_blocks)
+        return limit or None
+
+    def stats(self, total_blocks: int) -> Dict[str, dict]:
+        return {
+            name: {
+                "cached_blocks": t.cached_blocks,
+                "occupancy": round(t.cached_blocks / total_blocks, 4),
+                "min_blocks": self.min_blocks.get(name, 0),
+                "max_blocks": self.ceiling(name),
+                "hit_rate": round(t.tokens_saved / t.lookup_tokens, 4) if t.lookup_tokens else None,
+            }
+            for name, t in self.tenants.items()
+        }
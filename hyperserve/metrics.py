@@ -0,0 +1,219 @@
+import bisect
+import math
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, 50us .. 10s: radix lookups sit at the bottom, request latency at the top
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _fmt(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+def _label_str(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+class _GaugeChild:
+    __slots__ = ("value", "fn")
+
+    def __init__(self):
+        self.value = 0.0
+        self.fn: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set_function(self, fn: Callable[[], float]):
+        """Reads the value at scrape time instead: zero cost per event."""
+        self.fn = fn
+
+    def get(self) -> float:
+        return self.fn() if self.fn is not None else self.value
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # Last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: "Registry" = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            # Unlabelled: expose the child's methods directly (no forwarding call)
+            child = self._children[()] = self._new_child()
+            for method in self._child_methods:
+                setattr(self, method, getattr(child, method))
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, **labels):
+        """
+        Returns the child for one label combination. Hot paths should bind
+        it once (at import or construction time) rather than per event.
+        """
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self._children.items()):
+            lines.extend(self._sample_lines(key, child))
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+    _child_methods = ("inc",)
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def _sample_lines(self, key, child):
+        return [f"{self.name}{_label_str(self.labelnames, key)} {_fmt(child.value)}"]
+
+class Gauge(_Metric):
+    kind = "gauge"
+    _child_methods = ("set", "inc", "dec", "set_function", "get")
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def _sample_lines(self, key, child):
+        return [f"{self.name}{_label_str(self.labelnames, key)} {_fmt(child.get())}"]
+
+class Histogram(_Metric):
+    kind = "histogram"
+    _child_methods = ("observe",)
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: "Registry" = None):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def _sample_lines(self, key, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), list(child.counts)):
+            cumulative += count
+            le = _label_str(self.labelnames, key, f'le="{_fmt(bound)}"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+        labels = _label_str(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_fmt(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Registry:
+    """
+    Minimal Prometheus registry, tuned for instrumenting hot paths.
+    Architecture:
+    - Recording an event is one bound-method call doing plain attribute
+      arithmetic on a __slots__ child: no locks, no label lookups, no
+      allocation. Histograms bisect a tuple of bucket bounds.
+    - All recording happens on the engine's event loop thread; a scrape
+      may read a histogram mid-update and be off by one event, which
+      Prometheus tolerates.
+    - Cumulative buckets, _sum and _count are only derived at scrape time.
+    - Gauges for pool and tree sizes are callbacks, evaluated per scrape.
+    """
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self._metrics[metric.name] = metric
+
+    def expose(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# --- HyperServe metrics ---
+
+# Histograms (seconds)
+RADIX_LOOKUP_SECONDS = Histogram(
+    "hyperserve_radix_lookup_seconds", "RadixCache prefix lookup time")
+KERNEL_SECONDS = Histogram(
+    "hyperserve_kernel_seconds", "Batched PagedAttention call time", ["phase"])
+QUEUE_WAIT_SECONDS = Histogram(
+    "hyperserve_queue_wait_seconds", "Time from arrival to admission")
+REQUEST_LATENCY_SECONDS = Histogram(
+    "hyperserve_request_latency_seconds", "End-to-end latency of completed requests")
+PARSE_SECONDS = Histogram(
+    "hyperserve_parse_seconds", "Request body decode + validation time, by format", ["format"])
+
+# Gauges (callbacks set per engine replica)
+FREE_BLOCKS = Gauge(
+    "hyperserve_free_blocks", "Free device KV blocks", ["replica"])
+PINNED_BLOCKS = Gauge(
+    "hyperserve_pinned_blocks", "Device KV blocks pinned by in-flight requests", ["replica"])
+CACHE_NODES = Gauge(
+    "hyperserve_cache_nodes", "RadixCache node count", ["replica"])
+WAITING_REQUESTS = Gauge(
+    "hyperserve_waiting_requests", "Requests queued for admission", ["replica"])
+TENANT_CACHED_BLOCKS = Gauge(
+    "hyperserve_tenant_cached_blocks", "Device KV blocks cached and charged to each tenant", ["replica", "tenant"])
+
+# Counters
+TOKENS_SAVED = Counter(
+    "hyperserve_tokens_saved_total", "Prompt tokens served from the prefix cache")
+LOOKUP_TOKENS = Counter(
+    "hyperserve_lookup_tokens_total", "Prompt tokens looked up in the prefix cache")
+TENANT_TOKENS_SAVED = Counter(
+    "hyperserve_tenant_tokens_saved_total", "Prompt tokens served from the prefix cache, by requesting tenant", ["tenant"])
+TENANT_LOOKUP_TOKENS = Counter(
+    "hyperserve_tenant_lookup_tokens_total", "Prompt tokens looked up in the prefix cache, by requesting tenant", ["tenant"])
+EVICTED_BLOCKS = Counter(
+    "hyperserve_evicted_blocks_total", "Cached blocks evicted, by outcome", ["outcome"])
+PREEMPTIONS = Counter(
+    "hyperserve_preemptions_total", "Running requests preempted under KV pressure, by mode", ["mode"])
+REJECTED_REQUESTS = Counter(
+    "hyperserve_rejected_requests_total", "Requests turned away because the admission queue was full")
+DRAFT_TOKENS = Counter(
+    "hyperserve_draft_tokens_total", "Speculative draft tokens proposed, by source", ["source"])
+ACCEPTED_DRAFT_TOKENS = Counter(
+    "hyperserve_accepted_draft_tokens_total", "Speculative draft tokens the model agreed with, by source", ["source"])
+ROUTER_DECISIONS = Counter(
+    "hyperserve_router_decisions_total", "RL router decisions, by action", ["action"])
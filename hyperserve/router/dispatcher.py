@@ -0,0 +1,226 @@
+import random
+import asyncio
+import itertools
+import numpy as np
+import structlog
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+from hyperserve import tracing
+from hyperserve.config import settings
+from hyperserve.memory.radix_cache import RadixCache, hash_blocks
+from hyperserve.memory.tenants import DEFAULT_TENANT
+from hyperserve.serving.engine import HyperEngine, resolve_max_new_tokens
+
+logger = structlog.get_logger()
+
+DISPATCH_POLICIES = ("prefix", "round_robin", "random")
+
+def _as_list(prompt_tokens) -> list:
+    # Binary ingestion delivers int32 arrays; hashing and the radix tree want ints
+    return prompt_tokens.tolist() if isinstance(prompt_tokens, np.ndarray) else prompt_tokens
+
+class PrefixSummary:
+    """
+    Compact, approximate view of one replica's RadixCache: the set of
+    chained block hashes it is believed to hold, bounded LRU-style to the
+    replica's capacity. Updated optimistically on dispatch and resynced
+    from the real tree periodically (which picks up evictions).
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._hashes: "OrderedDict[int, None]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def match(self, hashes: List[int]) -> int:
+        """Number of leading blocks of a prompt this replica holds."""
+        n = 0
+        for h in hashes:
+            if h not in self._hashes:
+                break
+            n += 1
+        return n
+
+    def add(self, hashes: Iterable[int]):
+        for h in hashes:
+            self._hashes[h] = None
+            self._hashes.move_to_end(h)
+        while len(self._hashes) > self.capacity:
+            self._hashes.popitem(last=False)
+
+    def reset(self, hashes: Iterable[int]):
+        self._hashes = OrderedDict.fromkeys(hashes)
+
+class ReplicaDispatcher:
+    """
+    Front-end over N in-process HyperEngine replicas, each with its own RadixCache.
+    Architecture:
+    - "prefix" policy: every replica keeps a PrefixSummary; a request goes to
+      the replica minimising
+          uncached prompt tokens + DISPATCH_LOAD_WEIGHT * outstanding tokens
+      so a prefix hit is worth exactly the prefill it saves, and a hot prefix
+      spills onto a second replica (which then caches it too) once queueing
+      on the first costs more than recomputing it.
+    - "round_robin" and "random" are the cache-oblivious baselines.
+    - stats() reports the cluster-wide hit rate across all replicas.
+    """
+    def __init__(self, num_replicas: int = None, policy: str = None, load_weight: float = None):
+        self.num_replicas = num_replicas or settings.NUM_REPLICAS
+        self.policy = policy or settings.DISPATCH_POLICY
+        if self.policy not in DISPATCH_POLICIES:
+            raise ValueError(f"Unknown dispatch policy '{self.policy}'. Available: {list(DISPATCH_POLICIES)}")
+        self.load_weight = settings.DISPATCH_LOAD_WEIGHT if load_weight is None else load_weight
+
+        self.replicas = [HyperEngine(replica=i) for i in range(self.num_replicas)]
+        self.block_size = self.replicas[0].cache.block_size
+        self.summaries = [
+            PrefixSummary(r.allocator.num_blocks + (r.swap.capacity if r.swap else 0)) for r in self.replicas
+        ]
+        self.outstanding_tokens = [0] * self.num_replicas
+        self.num_dispatched = [0] * self.num_replicas
+        self._round_robin = itertools.cycle(range(self.num_replicas))
+        self._rng = random.Random(0)
+        self._since_refresh = 0
+
+    async def generate(self, prompt_tokens: list, max_new_tokens: int = None, priority: int = 0,
+                       tenant: str = DEFAULT_TENANT, trace=tracing.AUTO) -> dict:
+        prompt_tokens = _as_list(prompt_tokens)
+        idx, cost, hashes = self._dispatch(prompt_tokens, max_new_tokens)
+        try:
+            result = await self.replicas[idx].generate(prompt_tokens, max_new_tokens, block_hashes=hashes,
+                                                       priority=priority, tenant=tenant, trace=trace)
+        finally:
+            self.outstanding_tokens[idx] -= cost
+        result["metrics"]["replica"] = idx
+        return result
+
+    async def generate_stream(self, prompt_tokens: list, max_new_tokens: int = None,
+                              priority: int = 0, tenant: str = DEFAULT_TENANT,
+                              trace=tracing.AUTO) -> AsyncIterator[int]:
+        prompt_tokens = _as_list(prompt_tokens)
+        idx, cost, hashes = self._dispatch(prompt_tokens, max_new_tokens)
+        try:
+            async for token in self.replicas[idx].generate_stream(prompt_tokens, max_new_tokens,
+                                                                  block_hashes=hashes, priority=priority,
+                                                                  tenant=tenant, trace=trace):
+                yield token
+        finally:
+            self.outstanding_tokens[idx] -= cost
+
+    async def generate_many(self, prompts: List[list], max_new_tokens: int = None, priority: int = 0,
+                            tenant: str = DEFAULT_TENANT, trace=tracing.AUTO) -> list:
+        """
+        A batch of prompts: each is dispatched on its own, then every replica
+        gets its share in one HyperEngine.generate_many() call. Results (or
+        per-prompt exceptions) come back in input order. Refused as a whole
+        if any replica's queue cannot take its share.
+        """
+        prompts = [_as_list(p) for p in prompts]
+        if any(len(p) == 0 for p in prompts):
+            raise ValueError("prompt_tokens must not be empty")
+        # One by one, so each dispatch sees the load and prefixes booked before it
+        routed = [self._dispatch(p, max_new_tokens) for p in prompts]
+        groups: Dict[int, List[int]] = {}
+        for i, (idx, _, _) in enumerate(routed):
+            groups.setdefault(idx, []).append(i)
+        try:
+            for idx, items in groups.items():
+                replica = self.replicas[idx]
+                replica.admission.check_queue(len(replica.scheduler.waiting), len(items))
+            outputs = await asyncio.gather(*[
+                self.replicas[idx].generate_many([prompts[i] for i in items], max_new_tokens, priority,
+                                                 [routed[i][2] for i in items], tenant=tenant, trace=trace)
+                for idx, items in groups.items()
+            ])
+        finally:
+            for idx, cost, _ in routed:
+                self.outstanding_tokens[idx] -= cost
+        results = [None] * len(prompts)
+        for (idx, items), output in zip(groups.items(), outputs):
+            for i, result in zip(items, output):
+                if isinstance(result, dict):
+                    result["metrics"]["replica"] = idx
+                results[i] = result
+        return results
+
+    def check_capacity(self):
+        """Raises QueueFullError if every replica's queue is full (with the shortest retry hint)."""
+        if all(r.queue_full() for r in self.replicas):
+            min(self.replicas, key=lambda r: r.admission.retry_after()).check_capacity()
+
+    def shutdown(self):
+        for replica in self.replicas:
+            replica.shutdown()
+
+    def refresh(self):
+        """Resyncs every PrefixSummary with its replica's actual tree."""
+        self._since_refresh = 0
+        for replica, summary in zip(self.replicas, self.summaries):
+            summary.reset(self._cached_hashes(replica.cache))
+
+    def _dispatch(self, prompt_tokens: list, max_new_tokens: Optional[int]):
+        """
+        Picks a replica and books the request's expected work against it.
+        Returns the prompt's block hashes too when it computed them, so the
+        replica's radix hash index need not rehash the prompt.
+        """
+        if len(prompt_tokens) == 0:
+            raise ValueError("prompt_tokens must not be empty")
+        max_new_tokens = resolve_max_new_tokens(max_new_tokens)
+
+        if self.num_replicas == 1:
+            idx, uncached, hashes = 0, len(prompt_tokens), None
+        elif self.policy == "prefix":
+            idx, uncached, hashes = self._pick_by_prefix(prompt_tokens)
+        else:
+            idx = next(self._round_robin) if self.policy == "round_robin" else self._rng.randrange(self.num_replicas)
+            uncached, hashes = len(prompt_tokens), None
+
+        cost = uncached + max_new_tokens
+        self.outstanding_tokens[idx] += cost
+        self.num_dispatched[idx] += 1
+        if hashes is not None:
+            self.summaries[idx].add(hashes) # It will hold this prompt's blocks once served
+            self._maybe_refresh()
+        return idx, cost, hashes
+
+    def _pick_by_prefix(self, prompt_tokens: list):
+        hashes = hash_blocks(prompt_tokens, self.block_size)
+        best = None
+        for idx, summary in enumerate(self.summaries):
+            uncached = len(prompt_tokens) - summary.match(hashes) * self.block_size
+            cost = uncached + self.load_weight * self.outstanding_tokens[idx]
+            if best is None or cost < best[0]:
+                best = (cost, idx, uncached)
+        _, idx, uncached = best
+        return idx, uncached, hashes
+
+    def _maybe_refresh(self):
+        self._since_refresh += 1
+        if self._since_refresh < settings.DISPATCH_REFRESH_INTERVAL:
+            return
+        self.refresh()
+
+    def _cached_hashes(self, cache: RadixCache) -> List[int]:
+        """Exact chained block hashes of everything in a replica's tree (any tier)."""
+        hashes = []
+        stack = [(child, 0) for child in cache.root.children.values()]
+        while stack:
+            node, h = stack.pop()
+            node_hashes = hash_blocks(node.key, self.block_size, h)
+            hashes.extend(node_hashes)
+            stack.extend((child, node_hashes[-1]) for child in node.children.values())
+        return hashes
+
+    def stats(self) -> dict:
+        saved = sum(r.cache.total_tokens_saved for r in self.replicas)
+        looked_up = sum(r.cache.total_lookup_tokens for r in self.replicas)
+        return {
+            "policy": self.policy,
+            "replicas": self.num_replicas,
+            "cluster_hit_rate": round(saved / looked_up, 4) if looked_up else 0.0,
+            "dispatched": list(self.num_dispatched),
+            "outstanding_tokens": list(self.outstanding_tokens),
+            "summary_blocks": [len(s) for s in self.summaries],
+        }
@@ -1,6 +1,12 @@
-import random
+import os
+import json
+import math
+import numpy as np
 import structlog
 from dataclasses import dataclass
+from typing import Dict, List
+from hyperserve import metrics
+from hyperserve.config import settings
 
 logger = structlog.get_logger()
 
@@ -9,19 +15,43 @@ class SystemState:
     prompt_len: int
     cache_hit_rate: float
     gpu_utilization: float
+    queue_depth: int = 0
+
+    def features(self) -> np.ndarray:
+        """
+        Continuous context vector for the bandit, each entry roughly in [0, 1].
+        The leading 1.0 is the bias term.
+        """
+        return np.array([
+            1.0,
+            math.log1p(self.prompt_len) / 10.0,
+            self.cache_hit_rate,
+            self.gpu_utilization,
+            math.log1p(self.queue_depth) / 5.0,
+        ])
+
+NUM_FEATURES = 5
 
 class RLRouter:
     """
-    Contextual Bandit implementation for Routing.
+    Contextual Bandit implementation for Routing (disjoint LinUCB).
     Learns to map State -> Action (Worker ID).
+    - Each action keeps a ridge-regression model (A^-1, b) of reward given
+      the SystemState features; route() picks the highest upper confidence
+      bound, so exploration is driven by uncertainty instead of coin flips.
+    - update() folds in the observed reward with a Sherman-Morrison rank-1
+      update, so both calls are O(d^2) with d = 5: a few microseconds.
     """
-    def __init__(self):
-        # Q-Table simulation: State (High/Low Load) -> Action Rewards
-        self.q_table = {
-            "high_load": {"local": -1.0, "remote": 1.0},
-            "low_load":  {"local": 1.0,  "remote": 0.5}
-        }
-        self.epsilon = 0.1 # Exploration rate
+    ACTIONS = ("local", "remote")
+
+    def __init__(self, alpha: float = None, ridge: float = 1.0):
+        self.alpha = alpha if alpha is not None else settings.ROUTER_ALPHA # Exploration strength
+        d = NUM_FEATURES
+        self.a_inv = np.stack([np.eye(d) / ridge for _ in self.ACTIONS]) # [K, d, d]
+        self.b = np.zeros((len(self.ACTIONS), d))                         # [K, d]
+        self.theta = np.zeros((len(self.ACTIONS), d))                     # [K, d] = A^-1 b
+        self.counts = np.zeros(len(self.ACTIONS), dtype=np.int64)
+        self._decision_counters = [metrics.ROUTER_DECISIONS.labels(action=action) for action in self.ACTIONS]
 
     def route(self, state: SystemState) -> str:
         """
@@ -29,24 +59,62 @@ class RLRouter:
         1. 'local_worker': Compute on this node (Fast for small/cached)
         2. 'remote_worker': Offload to cluster (Fast for heavy prefill)
         """
-        # Discretize state
-        state_key = "high_load" if state.gpu_utilization > 0.8 or state.prompt_len > 1000 else "low_load"
-        
-        # Epsilon-Greedy Policy
-        if random.random() < self.epsilon:
-            action = random.choice(["local", "remote"])
-            logger.info("router_exploration", action=action)
-        else:
-            # Exploitation: Pick best Q-value
-            rewards = self.q_table[state_key]
-            action = max(rewards, key=rewards.get)
-        
-        # Override for cache hits (The "Radix" advantage)
-        if state.cache_hit_rate > 0.8:
-            action = "local" # Data Locality
-            
-        return action
-
-    def update(self, state, action, reward):
-        # Mock Q-Learning update
-        pass
\ No newline at end of file
+        x = state.features()
+        mean = self.theta @ x
+        width = np.sqrt(np.einsum("kij,i,j->k", self.a_inv, x, x))
+        k = int(np.argmax(mean + self.alpha * width))
+        self._decision_counters[k].inc()
+        return self.ACTIONS[k]
+
+    def update(self, state: SystemState, action: str, reward: float):
+        k = self.ACTIONS.index(action)
+        x = state.features()
+        a_inv = self.a_inv[k]
+        a_inv_x = a_inv @ x
+        a_inv -= np.outer(a_inv_x, a_inv_x) / (1.0 + x @ a_inv_x)
+        self.b[k] += reward * x
+        self.theta[k] = a_inv @ self.b[k]
+        self.counts[k] += 1
+
+    @staticmethod
+    def compute_reward(latency_s: float, num_tokens: int) -> float:
+        """
+        Negative log of milliseconds per generated token: rewards low latency
+        and high throughput alike, and stays well scaled across workloads.
+        """
+        return -math.log1p(latency_s * 1000.0 / max(1, num_tokens))
+
+    def state_dict(self) -> Dict[str, List]:
+        return {
+            "actions": list(self.ACTIONS),
+            "alpha": self.alpha,
+            "a_inv": self.a_inv.tolist(),
+            "b": self.b.tolist(),
+            "counts": self.counts.tolist(),
+        }
+
+    def load_state_dict(self, state: Dict[str, List]):
+        if list(state["actions"]) != list(self.ACTIONS):
+            raise ValueError(f"Router snapshot actions {state['actions']} do not match {list(self.ACTIONS)}")
+        a_inv = np.asarray(state["a_inv"], dtype=np.float64)
+        if a_inv.shape != self.a_inv.shape:
+            raise ValueError(f"Router snapshot has {a_inv.shape[-1]} features, expected {NUM_FEATURES}")
+        self.alpha = state["alpha"]
+        self.a_inv = a_inv
+        self.b = np.asarray(state["b"], dtype=np.float64)
+        self.counts = np.asarray(state["counts"], dtype=np.int64)
+        self.theta = np.einsum("kij,kj->ki", self.a_inv, self.b)
+        logger.info("router_state_restored", decisions=int(self.counts.sum()))
+
+    def save(self, path: str):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state_dict(), f)
+        os.replace(tmp, path) # Never leave a half-written snapshot behind
+
+    def load(self, path: str) -> bool:
+        if not os.path.exists(path):
+            return False
+        with open(path) as f:
+            self.load_state_dict(json.load(f))
+        return True
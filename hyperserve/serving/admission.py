@@ -0,0 +1,87 @@
+import math
+import numpy as np
+import structlog
+from typing import Iterable
+from hyperserve import metrics
+from hyperserve.config import settings
+from hyperserve.memory.allocator import BlockAllocator
+from hyperserve.serving.scheduler import Request
+
+logger = structlog.get_logger()
+
+class QueueFullError(Exception):
+    """Raised on submission when the waiting queue is at its limit."""
+    def __init__(self, retry_after: int):
+        super().__init__(f"Admission queue full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Decides whether the KV pool can take one more request.
+    Architecture:
+    - A request needs blocks for its uncached prompt plus a decode budget
+      (ADMISSION_DECODE_FRACTION of max_new_tokens; 1.0 never runs out
+      mid-decode, lower values overcommit and lean on preemption).
+    - Available = free blocks + blocks only the radix tree holds (one
+      reference, evictable) - private blocks of in-flight requests,
+      minus what in-flight requests will still allocate to finish.
+    - Requests past MAX_WAITING_REQUESTS are refused up front with a
+      retry hint: a moving average of recent queue waits.
+    """
+    def __init__(self, allocator: BlockAllocator, block_size: int, max_waiting: int = None,
+                 decode_fraction: float = None):
+        self.allocator = allocator
+        self.block_size = block_size
+        self.max_waiting = settings.MAX_WAITING_REQUESTS if max_waiting is None else max_waiting
+        self.decode_fraction = settings.ADMISSION_DECODE_FRACTION if decode_fraction is None else decode_fraction
+        self.avg_queue_wait = 0.0
+        self.num_rejected = 0
+        self.num_deferred = 0
+
+    def queue_full(self, num_waiting: int) -> bool:
+        return bool(self.max_waiting) and num_waiting >= self.max_waiting
+
+    def check_queue(self, num_waiting: int, num_new: int = 1):
+        """Raises QueueFullError if num_new more requests would overflow the queue."""
+        if self.queue_full(num_waiting + num_new - 1):
+            self.num_rejected += 1
+            metrics.REJECTED_REQUESTS.inc()
+            raise QueueFullError(self.retry_after())
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.avg_queue_wait))
+
+    def record_wait(self, seconds: float):
+        self.avg_queue_wait += 0.1 * (seconds - self.avg_queue_wait)
+
+    def blocks_needed(self, req: Request, num_tokens: int, cached_blocks: int) -> int:
+        """Blocks req takes beyond its cached prefix: the rest of num_tokens plus its decode budget."""
+        remaining = req.max_new_tokens - len(req.output_tokens)
+        total = num_tokens + int(max(0, remaining - 1) * self.decode_fraction)
+        return max(0, -(-total // self.block_size) - cached_blocks)
+
+    def can_admit(self, req: Request, num_tokens: int, cached_blocks: int, in_flight: Iterable[Request]) -> bool:
+        """
+        in_flight: every other request holding blocks. Must run after req
+        took its reference on its cached prefix, so that it does not look
+        evictable.
+        """
+        available = int(np.count_nonzero(self.allocator.ref_counts == 1))
+        available += self.allocator.num_free
+        booked = 0
+        for other in in_flight:
+            available -= len(other.block_ids) - other.num_prefix_blocks
+            booked += int(other.blocks_to_completion(self.block_size) * self.decode_fraction)
+        if self.blocks_needed(req, num_tokens, cached_blocks) <= available - booked:
+            return True
+        self.num_deferred += 1
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "max_waiting": self.max_waiting,
+            "decode_fraction": self.decode_fraction,
+            "avg_queue_wait_s": round(self.avg_queue_wait, 4),
+            "rejected": self.num_rejected,
+            "deferred": self.num_deferred,
+        }
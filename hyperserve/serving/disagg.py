@@ -0,0 +1,249 @@
+import queue
+import threading
+import multiprocessing as mp
+import numpy as np
+import torch
+import structlog
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Optional, Tuple
+from hyperserve.config import settings
+from hyperserve.kernels.paged_attn import paged_attention
+from hyperserve.memory.kv_pool import KVPool, StagingBuffer
+from hyperserve.serving.model import KVProjection, sample_token
+
+logger = structlog.get_logger()
+
+# Tokens of trailing context the decode worker keeps per sequence (sample_token's window)
+CONTEXT_WINDOW = 4
+# Seconds the pump waits on an idle result queue before checking the workers are alive
+LIVENESS_POLL_S = 0.5
+
+class SharedKVPool:
+    """
+    The paged KV cache placed in a named shared-memory segment.
+    Every process that attaches sees the same block-major KVPool storage,
+    so handing KV from one worker to another is just passing the block IDs
+    the BlockAllocator gave out: no bytes move.
+    """
+    def __init__(self, shm: shared_memory.SharedMemory, shape: Tuple[int, ...], dtype: torch.dtype, owner: bool):
+        self.shm = shm
+        self.shape = shape
+        self.dtype = dtype
+        self.owner = owner
+        self.tensor = torch.frombuffer(shm.buf, dtype=dtype, count=int(np.prod(shape))).view(shape)
+
+    @classmethod
+    def create(cls, shape: Tuple[int, ...], dtype: torch.dtype = torch.float32) -> "SharedKVPool":
+        nbytes = int(np.prod(shape)) * torch.empty(0, dtype=dtype).element_size()
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        pool = cls(shm, shape, dtype, owner=True)
+        pool.tensor.zero_()
+        return pool
+
+    @classmethod
+    def attach(cls, name: str, shape: Tuple[int, ...], dtype: torch.dtype) -> "SharedKVPool":
+        return cls(shared_memory.SharedMemory(name=name), shape, dtype, owner=False)
+
+    def close(self):
+        self.tensor = None # Drop the exported buffer before closing the mapping
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def _attach_kv(shm_name: str, shape, dtype, max_tokens: int):
+    shared = SharedKVPool.attach(shm_name, shape, dtype)
+    kv = KVPool(shape, storage=shared.tensor, max_tokens=max_tokens)
+    query = StagingBuffer(max_tokens, (kv.num_heads, kv.head_dim), kv.dtype, random=True)
+    return shared, kv, KVProjection(kv), query
+
+def _prefill_worker_main(shm_name: str, shape, dtype, jobs, results):
+    """
+    Prefill process: computes prompt KV into the shared blocks chunk by
+    chunk (same chunking as the colocated path), then samples the first token.
+    Job: (request_id, prompt_tokens, block_ids, num_computed_tokens)
+    """
+    torch.set_num_threads(1)
+    chunk_size = settings.PREFILL_CHUNK_SIZE
+    shared, kv, projection, query_buf = _attach_kv(shm_name, shape, dtype, chunk_size)
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        request_id, prompt, block_ids, start = job
+        block_table = kv.block_table([block_ids])
+        num_chunks = 0
+        while start < len(prompt):
+            end = min(start + chunk_size, len(prompt))
+            projection.write(kv.stage_tokens([(prompt[start:end], block_ids, start)]))
+            query = query_buf.take(end - start).view(1, end - start, kv.num_heads, kv.head_dim)
+            context_lens, query_lens = kv.context_lens([end]), kv.query_lens([end - start])
+            for layer in range(kv.num_layers):
+                paged_attention(query, kv.keys[layer], kv.values[layer], block_table, context_lens,
+                                query_lens=query_lens)
+            num_chunks += 1
+            start = end
+        results.put(("prefilled", request_id, (sample_token(prompt), num_chunks)))
+    kv = projection = block_table = None # Views of the segment
+    shared.close()
+
+def _decode_worker_main(shm_name: str, shape, dtype, jobs, results):
+    """
+    Decode process: continuous batching over every sequence handed to it,
+    one token per sequence per step, reading prompt KV written by the
+    prefill workers straight out of the shared blocks.
+    Jobs: ("decode", request_id, (context, block_ids, num_computed, num_tokens))
+          ("abort", request_id, None)
+    Sends ("step", None, [(request_id, token), ...]) per step and
+    ("released", request_id, num_computed) once it stops touching a sequence.
+    """
+    torch.set_num_threads(1)
+    shared, kv, projection, query_buf = _attach_kv(shm_name, shape, dtype, settings.MAX_NUM_SEQS)
+    running: Dict[int, list] = {} # request_id -> [context, block_ids, num_computed, remaining]
+
+    while True:
+        # 1. Drain new work; block only when there is nothing to decode
+        try:
+            while True:
+                msg = jobs.get() if not running else jobs.get_nowait()
+                if msg is None:
+                    kv = projection = None # Views of the segment
+                    shared.close()
+                    return
+                kind, request_id, payload = msg
+                if kind == "decode":
+                    running[request_id] = list(payload)
+                elif kind == "abort" and request_id in running:
+                    results.put(("released", request_id, running.pop(request_id)[2]))
+        except queue.Empty:
+            pass
+
+        # 2. One batched step: write each sequence's newest KV slot, attend, sample
+        seqs = list(running.items())
+        projection.write(kv.stage_tokens((s[0][-1:], s[1], s[2]) for _, s in seqs))
+        context_lens = kv.context_lens([s[2] + 1 for _, s in seqs])
+        block_table = kv.block_table([s[1] for _, s in seqs])
+        query = query_buf.take(len(seqs))
+        for layer in range(kv.num_layers):
+            paged_attention(query, kv.keys[layer], kv.values[layer], block_table, context_lens)
+
+        tokens = []
+        for request_id, seq in seqs:
+            token = sample_token(seq[0])
+            seq[0] = seq[0][1 - CONTEXT_WINDOW:] + [token]
+            seq[2] += 1
+            seq[3] -= 1
+            tokens.append((request_id, token))
+        results.put(("step", None, tokens))
+
+        # 3. Retire finished sequences
+        for request_id, seq in seqs:
+            if seq[3] <= 0:
+                del running[request_id]
+                results.put(("released", request_id, seq[2]))
+
+class DisaggregatedWorkers:
+    """
+    Separate prefill and decode worker processes on this host.
+    Architecture:
+    - The engine keeps the BlockAllocator and RadixCache; workers only read
+      and write KV slots of the blocks they are told about.
+    - The KV cache lives in a SharedKVPool, so a request's prompt KV is
+      handed from the prefill worker to the decode worker by block ID.
+    - NUM_PREFILL_WORKERS prefill processes share one job queue; a single
+      decode process batches every remote sequence.
+    - Results come back on one queue; a pump thread forwards them onto the
+      engine's event loop via call_soon_threadsafe.
+    - Whenever that queue goes idle the pump checks the workers are alive.
+      If one has died, the rest are terminated (no process may still write
+      into blocks the engine is about to free), alive turns False and the
+      engine gets ("died", None, worker name) after every earlier result.
+    """
+    def __init__(self, kv_pool: SharedKVPool, num_prefill_workers: int = None):
+        self.kv_pool = kv_pool
+        self.num_prefill_workers = num_prefill_workers or settings.NUM_PREFILL_WORKERS
+        ctx = mp.get_context("spawn") # Never fork a process holding torch / asyncio state
+        self._ctx = ctx
+        self._prefill_jobs = ctx.Queue()
+        self._decode_jobs = ctx.Queue()
+        self._results = ctx.Queue()
+        self._procs: List[mp.Process] = []
+        self._pump: Optional[threading.Thread] = None
+        self.loop = None
+        self.on_message: Optional[Callable[[tuple], None]] = None
+        self.alive = False # Started and no worker has died since
+
+    @property
+    def started(self) -> bool:
+        return bool(self._procs)
+
+    def start(self):
+        args = (self.kv_pool.shm.name, self.kv_pool.shape, self.kv_pool.dtype)
+        procs = [self._ctx.Process(target=_prefill_worker_main, args=args + (self._prefill_jobs, self._results),
+                                   name=f"hyperserve-prefill-{i}", daemon=True)
+                 for i in range(self.num_prefill_workers)]
+        procs.append(self._ctx.Process(target=_decode_worker_main, args=args + (self._decode_jobs, self._results),
+                                       name="hyperserve-decode", daemon=True))
+        for proc in procs:
+            proc.start()
+            self._procs.append(proc) # Only started processes are joined on shutdown
+        self._pump = threading.Thread(target=self._pump_results, name="hyperserve-disagg-pump", daemon=True)
+        self.alive = True
+        self._pump.start()
+        logger.info("disagg_workers_started", prefill=self.num_prefill_workers, decode=1)
+
+    def submit_prefill(self, request_id: int, prompt: List[int], block_ids: List[int], num_computed: int):
+        self._prefill_jobs.put((request_id, prompt, block_ids, num_computed))
+
+    def submit_decode(self, request_id: int, context: List[int], block_ids: List[int],
+                      num_computed: int, num_tokens: int):
+        self._decode_jobs.put(("decode", request_id,
+                               (context[-CONTEXT_WINDOW:], block_ids, num_computed, num_tokens)))
+
+    def abort(self, request_id: int):
+        self._decode_jobs.put(("abort", request_id, None))
+
+    def shutdown(self):
+        if not self.started:
+            return
+        self.alive = False # Workers exiting from here on are not deaths
+        for _ in range(self.num_prefill_workers):
+            self._prefill_jobs.put(None)
+        self._decode_jobs.put(None)
+        for proc in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        if self._pump is not None:
+            self._results.put(None)
+            self._pump.join(timeout=5)
+        self._procs = []
+        logger.info("disagg_workers_stopped")
+
+    def _pump_results(self):
+        while True:
+            try:
+                msg = self._results.get(timeout=LIVENESS_POLL_S)
+            except queue.Empty:
+                dead = next((proc for proc in self._procs if not proc.is_alive()), None)
+                if dead is None or not self.alive:
+                    continue # Healthy, or shutting down
+                msg = ("died", None, self._stop_after_death(dead))
+            if msg is None:
+                return
+            try:
+                self.loop.call_soon_threadsafe(self.on_message, msg)
+            except RuntimeError:
+                logger.warning("disagg_result_dropped", kind=msg[0], request_id=msg[1])
+            if msg[0] == "died":
+                return # The rest are gone: nothing more will arrive
+
+    def _stop_after_death(self, dead: mp.Process) -> str:
+        """Terminates the surviving workers once one has died; returns the dead one's name."""
+        self.alive = False
+        logger.error("disagg_worker_died", worker=dead.name, exitcode=dead.exitcode)
+        for proc in self._procs:
+            if proc.is_alive():
+                proc.terminate()
+        for proc in self._procs:
+            proc.join(timeout=5)
+        return dead.name
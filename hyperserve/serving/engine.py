@@ -1,62 +1,895 @@
+import os
+import time
+import atexit
 import asyncio
 import torch
+import numpy as np
 import structlog
-from hyperserve.memory.radix_cache import RadixCache
+from typing import AsyncIterator, Dict, List, Optional
+from hyperserve import metrics, tracing
+from hyperserve.config import settings
+from hyperserve.memory.radix_cache import RadixCache, RadixNode, hash_prompts
 from hyperserve.memory.allocator import BlockAllocator
+from hyperserve.memory.kv_pool import KVPool, StagingBuffer, kv_dtype, kv_shape
+from hyperserve.memory.swap import SwapSpace
+from hyperserve.memory.tenants import DEFAULT_TENANT, TenantQuotas
+from hyperserve.memory import snapshot
 from hyperserve.router.policy import RLRouter, SystemState
 from hyperserve.kernels.paged_attn import paged_attention
+from hyperserve.serving.disagg import DisaggregatedWorkers, SharedKVPool
+from hyperserve.serving.admission import AdmissionController
+from hyperserve.serving.model import KVProjection, sample_token
+from hyperserve.serving.scheduler import Request, RequestStatus, Scheduler, ScheduledBatch
+from hyperserve.serving.speculative import Drafter
 
 logger = structlog.get_logger()
 
+def resolve_max_new_tokens(max_new_tokens: Optional[int]) -> int:
+    """The decode budget of a request: MAX_NEW_TOKENS if unset, else at least 1 (ValueError otherwise)."""
+    if max_new_tokens is None:
+        return settings.MAX_NEW_TOKENS
+    if max_new_tokens < 1:
+        raise ValueError(f"max_new_tokens must be at least 1, got {max_new_tokens}")
+    return max_new_tokens
+
 class HyperEngine:
-    def __init__(self):
+    """
+    Continuous-batching inference engine.
+    Architecture:
+    - generate() only enqueues a Request and awaits its future;
+      generate_stream() yields each token as soon as its step completes.
+    - A single background loop runs one batched forward step per iteration
+      over every running request; new requests join and finished ones
+      leave between iterations.
+    - Finished sequences are inserted into the RadixCache, which adopts
+      their KV blocks so later requests can reuse them.
+    - The block IDs index a KVPool allocated once at startup (per-layer K/V
+      pages); each step stages its new tokens, block tables and lengths in
+      the pool's preallocated buffers rather than building tensors.
+    - With NUM_PREFILL_WORKERS > 0, requests the router sends "remote" are
+      handed off to separate prefill/decode processes sharing the KV pool
+      (see DisaggregatedWorkers); their blocks return to the tree once the
+      decode worker reports it is done with them.
+    - Hot-path metrics (lookup, kernel, queue wait, latency) go to the
+      process-wide registry in hyperserve.metrics; pool and tree gauges are
+      read at scrape time under this engine's replica label.
+    - Admission is gated on KV pressure (AdmissionController) and on a
+      bounded, priority-ordered queue. A step that runs out of blocks
+      preempts the lowest-priority running request (PREEMPTION_MODE:
+      recompute or swap) instead of cutting a sequence short.
+    - With SPECULATIVE_TOKENS > 0, decodes carry a draft (radix-tree
+      continuation or n-gram prompt lookup, see Drafter) that is verified
+      in one multi-query PagedAttention call; every accepted token is a
+      decode step saved.
+    - A sampled request (hyperserve.tracing) records spans for its queue
+      wait, prefix match, routing, each step it takes part in, the
+      PagedAttention calls inside them and the tree insert; unsampled
+      requests skip all of it.
+    """
+    def __init__(self, replica: int = 0):
+        self.replica = replica
         self.allocator = BlockAllocator()
-        self.cache = RadixCache(self.allocator)
+
+        # Paged KV memory behind the allocator's block IDs, allocated once
+        self.workers: Optional[DisaggregatedWorkers] = None
+        self.shared_kv: Optional[SharedKVPool] = None
+        if settings.NUM_PREFILL_WORKERS > 0:
+            self.shared_kv = SharedKVPool.create(kv_shape(), kv_dtype())
+            self.kv = KVPool(self.shared_kv.shape, storage=self.shared_kv.tensor)
+            self.workers = DisaggregatedWorkers(self.shared_kv)
+            self.workers.on_message = self._on_worker_message
+        else:
+            self.kv = KVPool()
+        self.kv_cache = self.kv.blocks # Block-major: one row per block, every layer
+        self.projection = KVProjection(self.kv)
+        self._query = StagingBuffer(settings.MAX_BATCH_TOKENS, (self.kv.num_heads, self.kv.head_dim), self.kv.dtype,
+                                    random=True)
+        self.allocator.copy_fn = self.kv.copy_block
+        self.tracer = tracing.TRACER
+
+        # Cold prefix blocks are demoted to host RAM / disk rather than dropped
+        self.swap: Optional[SwapSpace] = None
+        if settings.SWAP_HOST_BLOCKS + settings.SWAP_DISK_BLOCKS > 0:
+            self.swap = SwapSpace(self.kv_cache)
+        if self.workers is not None or (self.swap is not None and self.swap.disk is not None):
+            atexit.register(self.shutdown)
+
+        self.cache = RadixCache(self.allocator, swap=self.swap, tenants=TenantQuotas(replica=replica))
         self.router = RLRouter()
-        self.load_metric = 0.2
-        
-    async def generate(self, prompt_tokens: list):
-        # 1. Radix Tree Lookup (Prefix Matching)
-        start_time = asyncio.get_running_loop().time()
-        
-        cached_node, match_len = self.cache.match_prefix(prompt_tokens)
-        hit_rate = match_len / len(prompt_tokens) if prompt_tokens else 0
-        
-        logger.info("radix_lookup", hit_rate=f"{hit_rate:.2%}", saved_tokens=match_len)
+        self.scheduler = Scheduler()
+        self.admission = AdmissionController(self.allocator, self.cache.block_size)
+        self.num_speculative_tokens = settings.SPECULATIVE_TOKENS
+        self.drafter = Drafter(self.cache)
+        self._remote: Dict[int, Request] = {} # request_id -> request held by the workers
+
+        # Scrape-time gauges (a new engine with the same replica label takes them over)
+        allocator, cache = self.allocator, self.cache
+        metrics.FREE_BLOCKS.labels(replica=replica).set_function(lambda: allocator.num_free)
+        metrics.PINNED_BLOCKS.labels(replica=replica).set_function(cache.num_pinned_blocks)
+        metrics.CACHE_NODES.labels(replica=replica).set_function(cache.num_nodes)
+        waiting = self.scheduler.waiting
+        metrics.WAITING_REQUESTS.labels(replica=replica).set_function(lambda: len(waiting))
+        self._preemptions = {mode: metrics.PREEMPTIONS.labels(mode=mode) for mode in ("recompute", "swap")}
+        self._decode_kernel = metrics.KERNEL_SECONDS.labels(phase="decode")
+        self._prefill_kernel = metrics.KERNEL_SECONDS.labels(phase="prefill")
+        self._verify_kernel = metrics.KERNEL_SECONDS.labels(phase="verify")
+        self._drafted = {source: metrics.DRAFT_TOKENS.labels(source=source) for source in ("radix", "ngram")}
+        self._accepted = {source: metrics.ACCEPTED_DRAFT_TOKENS.labels(source=source) for source in ("radix", "ngram")}
+
+        self._loop_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.num_steps = 0
+        self.num_batched_seqs = 0
         
-        # 2. RL Routing
+    async def generate(self, prompt_tokens: list, max_new_tokens: int = None, block_hashes: List[int] = None,
+                       priority: int = 0, tenant: str = DEFAULT_TENANT, trace=tracing.AUTO):
+        """
+        trace: the caller's Trace to record into (None: the caller decided
+        not to sample), or AUTO to let the engine sample this request.
+        """
+        req = self._submit(prompt_tokens, max_new_tokens, block_hashes=block_hashes, priority=priority, tenant=tenant,
+                           trace=trace)
+        try:
+            return await req.future
+        except asyncio.CancelledError:
+            self._abort(req)
+            raise
+
+    async def generate_stream(self, prompt_tokens: list, max_new_tokens: int = None,
+                              block_hashes: List[int] = None, priority: int = 0,
+                              tenant: str = DEFAULT_TENANT, trace=tracing.AUTO) -> AsyncIterator[int]:
+        """
+        Yields token IDs as they are decoded. Closing the generator early
+        (e.g. client disconnect) aborts the request and releases its blocks.
+        """
+        req = self._submit(prompt_tokens, max_new_tokens, stream=True, block_hashes=block_hashes,
+                           priority=priority, tenant=tenant, trace=trace)
+        try:
+            while True:
+                token = await req.stream.get()
+                if token is None:
+                    break
+                yield token
+            await req.future # Surface engine errors to the consumer
+        finally:
+            if not req.future.done():
+                self._abort(req)
+
+    async def generate_many(self, prompts: List[list], max_new_tokens: int = None, priority: int = 0,
+                            block_hashes: List[Optional[List[int]]] = None, tenant: str = DEFAULT_TENANT,
+                            trace=tracing.AUTO) -> list:
+        """
+        Submits a batch of prompts in one go, so they are admitted into the
+        same steps, and returns their results in order. An entry that failed
+        holds its exception. The batch is refused as a whole (QueueFullError)
+        if the queue cannot take all of it.
+        """
+        if any(len(p) == 0 for p in prompts):
+            raise ValueError("prompt_tokens must not be empty")
+        max_new_tokens = resolve_max_new_tokens(max_new_tokens) # Before any of them is queued
+        self.admission.check_queue(len(self.scheduler.waiting), len(prompts))
+        if self.cache.has_hash_index and (block_hashes is None or None in block_hashes):
+            # Shared prefixes (system prompts) are hashed once for the batch; lookups stay per request at admission
+            hashed = hash_prompts([p.tolist() if isinstance(p, np.ndarray) else p for p in prompts], self.cache.block_size)
+            block_hashes = [h if h is not None else hashed[i] for i, h in enumerate(block_hashes or hashed)]
+        reqs = [
+            self._submit(p, max_new_tokens, block_hashes=block_hashes[i] if block_hashes else None, priority=priority,
+                         tenant=tenant, trace=trace)
+            for i, p in enumerate(prompts)
+        ]
+        try:
+            return await asyncio.gather(*[r.future for r in reqs], return_exceptions=True)
+        except asyncio.CancelledError:
+            for req in reqs:
+                self._abort(req)
+            raise
+
+    def _submit(self, prompt_tokens: list, max_new_tokens: Optional[int], stream: bool = False,
+                block_hashes: Optional[List[int]] = None, priority: int = 0,
+                tenant: str = DEFAULT_TENANT, trace=tracing.AUTO) -> Request:
+        if len(prompt_tokens) == 0:
+            raise ValueError("prompt_tokens must not be empty")
+        max_new_tokens = resolve_max_new_tokens(max_new_tokens)
+        self.check_capacity()
+
+        loop = asyncio.get_running_loop()
+        self._ensure_loop(loop)
+
+        req = Request(
+            # Binary ingestion hands over int32 arrays: one C-level conversion
+            prompt_tokens=prompt_tokens.tolist() if isinstance(prompt_tokens, np.ndarray) else list(prompt_tokens),
+            max_new_tokens=max_new_tokens,
+            future=loop.create_future(),
+            arrival_time=loop.time(),
+            stream=asyncio.Queue() if stream else None,
+            block_hashes=block_hashes,
+            priority=priority,
+            tenant=tenant or DEFAULT_TENANT,
+        )
+        if trace is tracing.AUTO:
+            trace = self.tracer.start("engine.generate")
+            req.owns_trace = trace is not None
+        if trace is not None:
+            req.trace = trace
+            req.trace_start = req.trace_queued = time.perf_counter()
+            trace.track(req.request_id, f"request {req.request_id}")
+        self.scheduler.add(req)
+        self._wakeup.set()
+        return req
+
+    def queue_full(self) -> bool:
+        return self.admission.queue_full(len(self.scheduler.waiting))
+
+    def check_capacity(self):
+        """Raises QueueFullError (with a retry hint) if the waiting queue is full."""
+        self.admission.check_queue(len(self.scheduler.waiting))
+
+    def pin_prefix(self, tokens: List[int]) -> RadixNode:
+        """
+        Keeps the cached prefix of tokens from being evicted until
+        unpin_prefix(), for callers that know more requests on it are coming
+        (e.g. offline batch jobs). Must be called between steps, like _abort().
+        """
+        return self.cache.pin(tokens)
+
+    def unpin_prefix(self, node: RadixNode):
+        self.cache.unlock(node)
+
+    def _ensure_loop(self, loop: asyncio.AbstractEventLoop):
+        # (Re)start the step loop on the caller's event loop
+        if self._loop_task is None or self._loop_task.done() or self._loop_task.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._loop_task = loop.create_task(self._run_loop())
+        if self.workers is not None:
+            self.workers.loop = loop
+            if not self.workers.started:
+                self.workers.start()
+
+    async def save_snapshot(self, path: str) -> int:
+        """
+        Snapshots the radix tree and its KV. The capture runs right here on
+        the event loop (steps never await, so it sees a consistent tree);
+        the file is written on a worker thread.
+        Returns: number of blocks written.
+        """
+        snap = snapshot.capture(self.cache, self.kv_cache)
+        await asyncio.to_thread(snapshot.write, snap, path)
+        logger.info("radix_snapshot_saved", path=path, nodes=snap.meta["num_nodes"], blocks=snap.total_blocks)
+        return snap.total_blocks
+
+    def load_snapshot(self, path: str) -> int:
+        """
+        Warm restart: rebuilds the radix tree from a snapshot written by
+        save_snapshot(). A missing, foreign or stale snapshot is skipped.
+        Returns: number of blocks restored.
+        """
+        if not os.path.exists(path):
+            return 0
+        start = time.perf_counter()
+        try:
+            snap = snapshot.read(path, snapshot.expected_meta(self.kv_cache, self.cache.block_size))
+        except (ValueError, KeyError, OSError) as e:
+            logger.warning("radix_snapshot_rejected", path=path, reason=str(e))
+            return 0
+        restored = snapshot.restore(self.cache, self.kv_cache, snap)
+        logger.info("radix_snapshot_restored", path=path, blocks=restored, snapshot_blocks=snap.total_blocks,
+                    ms=round((time.perf_counter() - start) * 1000, 2))
+        return restored
+
+    def shutdown(self):
+        """
+        Stops the step loop and the worker processes, and frees the shared KV
+        segment and swap file. The loop task is only cancelled here; inside
+        the event loop, await aclose() to also wait for it to exit.
+        """
+        task = self._loop_task
+        if task is not None and not task.done() and not task.get_loop().is_closed():
+            task.cancel()
+        if self.swap is not None:
+            self.swap.close()
+        if self.workers is None:
+            return
+        self.workers.shutdown()
+        self.workers = None
+        self.allocator.copy_fn = None
+        self.kv_cache = self.kv = self.projection = None # Drop every view of the segment before closing it
+        self.shared_kv.close()
+
+    async def aclose(self):
+        """shutdown(), then waits for the cancelled step loop to exit."""
+        self.shutdown()
+        if self._loop_task is not None:
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+
+    async def _run_loop(self):
+        while True:
+            if not self.scheduler.has_work():
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue # Woken by a submission or by freed blocks: re-check
+
+            schedule_start = time.perf_counter()
+            try:
+                batch = self.scheduler.schedule(self._admit, self._preempt)
+            except Exception as e:
+                logger.error("engine_schedule_failed", error=str(e))
+                self._fail_scheduled(e)
+                continue
+            traced = self._traced(batch, schedule_start) if self.tracer.num_active else None
+            if self.workers is not None:
+                self._offload(batch)
+            if len(batch) == 0:
+                if not self.scheduler.running and not self._remote:
+                    # Nothing will ever free enough blocks for the head request
+                    req = self.scheduler.waiting.peek()
+                    self.scheduler.abort(req)
+                    self._resolve(req, error=MemoryError("Prompt exceeds KV cache capacity"))
+                    continue
+                # Waiting requests but no memory: let others finish first
+                await asyncio.sleep(0.001)
+                continue
+
+            try:
+                self._step(batch, traced)
+            except Exception as e:
+                logger.error("engine_step_failed", error=str(e))
+                for req in batch.requests:
+                    self._finish(req, error=e)
+
+            # Yield so newly arrived requests can join the next step
+            await asyncio.sleep(0)
+
+    def _fail_scheduled(self, error: Exception):
+        """
+        schedule() raised partway through admitting or preempting, so which
+        requests it left half-done is unknown: fail every one queued or
+        running here instead of letting the loop die with them pending.
+        """
+        for req in self.scheduler.running + list(self.scheduler.waiting):
+            self.scheduler.abort(req)
+            try:
+                self._release(req)
+            except Exception as e:
+                logger.error("release_failed", request_id=req.request_id, error=str(e))
+            self._resolve(req, error)
+
+    def _admit(self, req: Request) -> bool:
+        """
+        Prefix match, pin, route and reserve blocks for the uncached prompt.
+        Returns False (leaving no side effects) if the pool cannot hold it.
+        A preempted request comes back through here as well: it either
+        swaps its KV back in, or matches its prompt plus the tokens it had
+        generated against the tree and recomputes the rest.
+        """
+        if req.prefix_node is not None:
+            return True # Already admitted, waiting for token budget
+        if req.swapped_slots is not None:
+            if not self._swap_in(req):
+                return False
+            if req.trace is not None:
+                self._trace_admitted(req)
+            return True
+
+        # 1. Radix Tree Lookup (Prefix Matching); demoted blocks start coming back
+        tokens = req.all_tokens
+        lookup_start = time.perf_counter()
+        match = self.cache.lookup(tokens, None if req.output_tokens else req.block_hashes, req.tenant)
+        cached_node, match_len = match.node, match.matched_len
+        if req.trace is not None:
+            req.trace.add("radix.match_prefix", lookup_start, time.perf_counter(), req.request_id,
+                          tokens=len(tokens), matched=match_len,
+                          tiers={t: match.block_tiers.count(t) for t in set(match.block_tiers)})
+        self.cache.lock(cached_node)
+
+        # 2. Take our reference on the shared prefix (pinning first so eviction
+        #    skips it), check the whole footprint fits, then reserve blocks for
+        #    the rest of the prompt. Alone on the engine, only the prompt must fit.
+        prefix_blocks = self.cache.get_block_ids(cached_node)
+        self.allocator.share(prefix_blocks)
+        own_blocks = None
+        in_flight = self._in_flight()
+        if not in_flight or self.admission.can_admit(req, len(tokens), len(prefix_blocks), in_flight):
+            own_blocks = self.allocator.allocate_blocks(-(-len(tokens) // self.cache.block_size) - len(prefix_blocks))
+        if own_blocks is None:
+            self.allocator.release(prefix_blocks)
+            self.cache.unlock(cached_node)
+            return False
+
+        req.prefix_node = cached_node
+        req.block_ids = prefix_blocks + own_blocks
+        req.num_prefix_blocks = len(prefix_blocks)
+        # A fully cached prompt still recomputes its last token to get logits
+        req.num_computed_tokens = min(match_len, len(tokens) - 1)
+        req.promotions = match.promotions
+        if req.num_preemptions:
+            if req.trace is not None:
+                self._trace_admitted(req)
+            return True # Hit rate, route and queue wait belong to the first admission
+
+        hit_rate = match_len / len(req.prompt_tokens)
+        req.match_tiers = {tier: match.block_tiers.count(tier) for tier in set(match.block_tiers)}
+        logger.info("radix_lookup", hit_rate=f"{hit_rate:.2%}", saved_tokens=match_len, tiers=req.match_tiers)
+
+        # 3. RL Routing
         state = SystemState(
-            prompt_len=len(prompt_tokens),
+            prompt_len=len(req.prompt_tokens),
             cache_hit_rate=hit_rate,
-            gpu_utilization=self.load_metric
+            gpu_utilization=self.load_metric,
+            queue_depth=len(self.scheduler.waiting)
         )
-        worker = self.router.route(state)
-        
-        # 3. Execution (Simulated)
-        # If cache hit, we only compute the *new* tokens
-        new_tokens_to_compute = prompt_tokens[match_len:]
-        
-        if new_tokens_to_compute:
-            # Simulate PagedAttention Kernel Call
-            # In production, we would prepare the Block Tables here
-            dummy_tensor = torch.randn(1, 10, 64) 
-            paged_attention(dummy_tensor, dummy_tensor, dummy_tensor, None)
-            
-            # Update Cache with new path
-            self.cache.insert(new_tokens_to_compute, cached_node)
-        
-        # Simulate Decode Latency
-        await asyncio.sleep(0.05) 
-        
-        latency = asyncio.get_running_loop().time() - start_time
-        
+        route_start = time.perf_counter()
+        req.routed_to = self.router.route(state)
+        req.route_state = state
+        if req.trace is not None:
+            req.trace.add("router.route", route_start, time.perf_counter(), req.request_id, action=req.routed_to)
+
+        req.match_len = match_len
+        req.admit_time = asyncio.get_running_loop().time()
+        metrics.QUEUE_WAIT_SECONDS.observe(req.admit_time - req.arrival_time)
+        self.admission.record_wait(req.admit_time - req.arrival_time)
+        if req.trace is not None:
+            self._trace_admitted(req)
+        return True
+
+    def _trace_admitted(self, req: Request):
+        req.trace.add("queue", req.trace_queued, time.perf_counter(), req.request_id,
+                      replica=self.replica, preemptions=req.num_preemptions)
+
+    def _traced(self, batch: ScheduledBatch, schedule_start: float) -> Optional[List[tracing.Trace]]:
+        """
+        Distinct traces of the sampled requests in this step (None if there
+        are none), with the scheduling pass recorded on each.
+        """
+        traces = {id(r.trace): r.trace for r in batch.requests if r.trace is not None}
+        if not traces:
+            return None
+        end, tid = time.perf_counter(), tracing.engine_tid(self.replica)
+        for trace in traces.values():
+            trace.track(tid, f"replica {self.replica} scheduler")
+            trace.add("schedule", schedule_start, end, tid, step=self.num_steps, seqs=len(batch),
+                      tokens=batch.num_tokens)
+        return list(traces.values())
+
+    def _swap_in(self, req: Request) -> bool:
+        """Re-admits a request preempted by swap: its KV goes back to fresh device blocks."""
+        in_flight = self._in_flight()
+        if in_flight and not self.admission.can_admit(req, len(req.all_tokens), 0, in_flight):
+            return False
+        blocks = self.allocator.allocate_blocks(len(req.swapped_slots))
+        if blocks is None:
+            return False
+        self.swap.load(req.swapped_slots, blocks)
+        self.swap.free(req.swapped_slots)
+        req.swapped_slots = None
+        req.prefix_node = self.cache.root # Pins nothing: all of its blocks are its own
+        req.block_ids = blocks
+        req.num_prefix_blocks = 0
+        return True
+
+    def _preempt(self, req: Request):
+        """
+        Takes a running request off the device to free its blocks, and
+        requeues it. "swap" parks its computed KV in the swap tier until it
+        is re-admitted; "recompute" (and swap without room) hands its KV to
+        the radix tree like a finished request, so re-admission recomputes
+        only what has been evicted since.
+        """
+        req.draft_tokens = []
+        mode = "recompute"
+        num_blocks = -(-req.num_computed_tokens // self.cache.block_size)
+        if settings.PREEMPTION_MODE == "swap" and self.swap is not None and num_blocks and req.is_ready:
+            slots = self.swap.allocate(num_blocks)
+            if slots is not None:
+                self.swap.store(req.block_ids[:num_blocks], slots)
+                self.allocator.release(req.block_ids)
+                self.cache.unlock(req.prefix_node)
+                req.prefix_node = None
+                req.block_ids = []
+                req.num_prefix_blocks = 0
+                req.swapped_slots = slots
+                mode = "swap"
+        if mode == "recompute":
+            self._release(req)
+            req.num_computed_tokens = 0
+        self.scheduler.preempt(req)
+        self._preemptions[mode].inc()
+        if req.trace is not None:
+            req.trace_queued = time.perf_counter()
+            req.trace.add("preempted", req.trace_queued, None, req.request_id, mode=mode)
+        logger.info("request_preempted", request_id=req.request_id, mode=mode, priority=req.priority,
+                    computed_tokens=req.num_computed_tokens)
+
+    def _in_flight(self) -> List[Request]:
+        """Admitted requests holding blocks: running here or on the workers."""
+        if not self._remote:
+            return self.scheduler.running
+        return self.scheduler.running + list(self._remote.values())
+
+    def _prepare_blocks(self, req: Request) -> bool:
+        """
+        Makes req's block table ready for this step's KV writes: grows it at
+        block boundaries and copies-on-write a shared block before writing.
+        Returns False on OOM.
+        """
+        bs = self.cache.block_size
+        needed = -(-(req.num_computed_tokens + req.num_scheduled_tokens) // bs) - len(req.block_ids)
+        if needed > 0:
+            blocks = self.allocator.allocate_blocks(needed)
+            if blocks is None:
+                return False
+            req.block_ids.extend(blocks)
+
+        idx = req.num_computed_tokens // bs
+        if self.allocator.ref_counts[req.block_ids[idx]] > 1:
+            block_id = self.allocator.copy_on_write(req.block_ids[idx])
+            if block_id < 0:
+                return False
+            req.block_ids[idx] = block_id
+        return True
+
+    def _offload(self, batch: ScheduledBatch):
+        """
+        Pulls newly admitted "remote" requests out of this step and hands them
+        to the prefill workers. The allocator lives here, so the request's
+        whole KV footprint (prompt + decode) is reserved before it leaves.
+        Once the workers have died everything runs colocated.
+        """
+        for req in [r for r in batch.prefills if r.routed_to == "remote"]:
+            if not self.workers.alive:
+                req.routed_to = "local"
+                continue
+            chunk = req.num_scheduled_tokens
+            req.num_scheduled_tokens = len(req.prompt_tokens) + req.max_new_tokens - 1 - req.num_computed_tokens
+            if not self._prepare_blocks(req):
+                # Cannot reserve decode blocks up front: run it colocated instead
+                logger.warning("remote_reservation_failed", request_id=req.request_id)
+                req.routed_to = "local"
+                req.num_scheduled_tokens = chunk
+                continue
+            batch.prefills.remove(req)
+            batch.num_tokens -= chunk
+            self.scheduler.hand_off(req)
+            self._remote[req.request_id] = req
+            if req.trace is not None:
+                req.trace.add("offloaded", time.perf_counter(), None, req.request_id)
+            self.workers.submit_prefill(req.request_id, req.prompt_tokens, req.block_ids, req.num_computed_tokens)
+
+    def _on_worker_message(self, msg: tuple):
+        """
+        Applies one worker result on the event loop thread.
+        Blocks of a remote request are released only on "released" (or on
+        "prefilled" if it was aborted meanwhile): until then a worker may
+        still be writing into them.
+        """
+        kind, request_id, payload = msg
+        if kind == "died":
+            self._fail_remote(payload)
+            return
+        now = asyncio.get_running_loop().time()
+        if kind == "step":
+            for rid, token in payload:
+                req = self._remote[rid]
+                if req.status == RequestStatus.REMOTE:
+                    self._emit(req, token, now)
+                    if req.is_finished:
+                        self._complete_remote(req)
+            return
+
+        req = self._remote[request_id]
+        if kind == "prefilled":
+            token, num_chunks = payload
+            req.num_computed_tokens = len(req.prompt_tokens)
+            req.num_prefill_chunks += num_chunks
+            if req.status != RequestStatus.REMOTE:
+                self._release_remote(req) # Aborted while prefilling
+                return
+            self._emit(req, token, now)
+            if req.is_finished:
+                self._complete_remote(req)
+                self._release_remote(req)
+                return
+            self.workers.submit_decode(request_id, req.all_tokens, req.block_ids,
+                                       req.num_computed_tokens, req.max_new_tokens - len(req.output_tokens))
+        elif kind == "released":
+            req.num_computed_tokens = payload
+            self._release_remote(req)
+
+    def _complete_remote(self, req: Request):
+        req.status = RequestStatus.FINISHED
+        self._record_reward(req)
+        self._resolve(req)
+
+    def _fail_remote(self, worker: str):
+        """
+        The workers are gone (one died, the rest were terminated), so nothing
+        writes into remote requests' blocks any more: fail those requests and
+        take their blocks back. Their computed prompt KV is still valid.
+        """
+        error = RuntimeError(f"disaggregated worker {worker} died")
+        logger.error("remote_requests_failed", worker=worker, count=len(self._remote))
+        for req in list(self._remote.values()):
+            if req.status == RequestStatus.REMOTE:
+                req.status = RequestStatus.FINISHED
+                self._resolve(req, error=error)
+            self._release_remote(req)
+
+    def _release_remote(self, req: Request):
+        del self._remote[req.request_id]
+        self._release(req)
+        self._wakeup.set() # Freed blocks may unblock waiting admissions
+
+    def _step(self, batch: ScheduledBatch, traced: Optional[List[tracing.Trace]] = None):
+        """
+        One forward pass for the whole batch: prefill chunks and decodes together.
+        traced: the traces of its sampled requests, if any (see _traced()).
+        """
+        step_start = time.perf_counter()
+        if self.num_speculative_tokens:
+            self._propose_drafts(batch)
+
+        # 1. Block tables: grow at boundaries, copy-on-write shared blocks.
+        #    Out of blocks: preempt the lowest-priority running request and retry.
+        for req in batch.requests:
+            if req.status != RequestStatus.RUNNING:
+                continue # Already preempted to make room for another one
+            while not self._prepare_blocks(req):
+                if req.draft_tokens:
+                    self._drop_draft(req, batch) # Speculation is the first thing to give up
+                    continue
+                victim = self.scheduler.pick_victim()
+                if victim is req and len(self.scheduler.running) == 1:
+                    # Alone on the engine: preempting would only replay this
+                    logger.warning("step_oom_truncated", request_id=req.request_id)
+                    batch.remove(req)
+                    self._finish(req)
+                    break
+                batch.remove(victim)
+                self._preempt(victim)
+                if victim is req:
+                    break
+        if len(batch) == 0:
+            return
+        self.projection.write(self.kv.stage_tokens(
+            (req.scheduled_tokens, req.block_ids, req.num_computed_tokens) for req in batch.requests))
+
+        # 2. Batched PagedAttention: one call for all plain decodes (one query
+        #    each), one for all drafted decodes (last token + draft, causal) and
+        #    one for all prefill chunks (causal, padded to the longest chunk)
+        verifying = [r for r in batch.decodes if r.draft_tokens]
+        with self.tracer.profile(traced):
+            if len(verifying) < len(batch.decodes):
+                self._attention([r for r in batch.decodes if not r.draft_tokens], query_len=1, traced=traced)
+            if verifying:
+                self._attention(verifying, query_len=max(r.num_scheduled_tokens for r in verifying),
+                                timer=self._verify_kernel, traced=traced)
+            if batch.prefills:
+                self._attention(batch.prefills, query_len=max(r.num_scheduled_tokens for r in batch.prefills),
+                                traced=traced)
+
+        # 3. Sample one token per sequence whose prompt is complete; retire finished ones
+        now = asyncio.get_running_loop().time()
+        for req in batch.decodes:
+            self._verify(req, now)
+            if req.trace is not None:
+                self._trace_step(req, "decode", step_start, len(batch), drafted=req.num_drafted)
+            if req.is_finished:
+                self._finish(req)
+        for req in batch.prefills:
+            req.num_prefill_chunks += 1
+            req.num_computed_tokens += req.num_scheduled_tokens
+            if req.num_computed_tokens < len(req.prompt_tokens) + len(req.output_tokens):
+                if req.trace is not None:
+                    self._trace_step(req, "prefill", step_start, len(batch), tokens=req.num_scheduled_tokens)
+                continue # Mid-prompt chunk: no logits to sample yet
+            self._emit(req, self._sample(req.all_tokens), now)
+            if req.trace is not None:
+                self._trace_step(req, "prefill", step_start, len(batch), tokens=req.num_scheduled_tokens)
+            if req.is_finished:
+                self._finish(req)
+
+        self.num_steps += 1
+        self.num_batched_seqs += len(batch)
+
+    def _trace_step(self, req: Request, phase: str, step_start: float, seqs: int, **args):
+        # Ends once this request's tokens are sampled, before it may be retired
+        req.trace.add(phase, step_start, time.perf_counter(), req.request_id, step=self.num_steps, seqs=seqs,
+                      output_tokens=len(req.output_tokens), **args)
+
+    def _propose_drafts(self, batch: ScheduledBatch):
+        """Gives decodes a draft each, out of the step's leftover token budget."""
+        budget = self.scheduler.max_batch_tokens - batch.num_tokens
+        for req in batch.decodes:
+            # The step always samples one token past the draft, so leave room for it
+            k = min(self.num_speculative_tokens, req.max_new_tokens - len(req.output_tokens) - 1, budget)
+            if k <= 0:
+                continue
+            draft, source = self.drafter.draft(req, k)
+            if not draft:
+                continue
+            req.draft_tokens = draft
+            req.draft_source = source
+            req.num_scheduled_tokens = 1 + len(draft)
+            batch.num_tokens += len(draft)
+            budget -= len(draft)
+
+    def _drop_draft(self, req: Request, batch: ScheduledBatch):
+        batch.num_tokens -= len(req.draft_tokens)
+        req.num_scheduled_tokens = 1
+        req.draft_tokens = []
+
+    def _verify(self, req: Request, now: float):
+        """
+        Samples a decode step: the token after the context, then, while the
+        model agrees with the draft, the token after each accepted draft
+        token. KV written for rejected draft positions is simply overwritten
+        later. Emits accepted + 1 tokens.
+        """
+        draft = req.draft_tokens
+        req.draft_tokens = []
+        req.num_computed_tokens += 1 # The last token's KV, written by this pass
+        accepted = 0
+        while True:
+            token = self._sample(req.all_tokens)
+            self._emit(req, token, now)
+            if accepted == len(draft) or token != draft[accepted] or req.is_finished:
+                break
+            accepted += 1
+            req.num_computed_tokens += 1 # Its KV from this pass stands
+        req.num_decode_passes += 1
+        req.num_decode_tokens += accepted + 1
+        if draft:
+            req.num_drafted += len(draft)
+            req.num_accepted += accepted
+            self._drafted[req.draft_source].inc(len(draft))
+            self._accepted[req.draft_source].inc(accepted)
+
+    def _emit(self, req: Request, token: int, now: float):
+        req.output_tokens.append(token)
+        if req.stream is not None:
+            req.stream.put_nowait(token)
+        req.num_steps += 1
+        if req.first_token_time is None:
+            req.first_token_time = now
+
+    def _attention(self, reqs: List[Request], query_len: int, timer=None, traced=None):
+        """
+        PagedAttention over every layer of the pool. Block table, lengths
+        and the (simulated) query are views of preallocated buffers.
+        """
+        kv = self.kv
+        context_lens = kv.context_lens([r.num_computed_tokens + r.num_scheduled_tokens for r in reqs])
+        block_table = kv.block_table([r.block_ids for r in reqs])
+        max_blocks = block_table.shape[1]
+        query = self._query.take(len(reqs) * query_len)
+        if query_len == 1:
+            start = time.perf_counter()
+            for layer in range(kv.num_layers):
+                out = paged_attention(query, kv.keys[layer], kv.values[layer], block_table, context_lens)
+            end = time.perf_counter()
+            self._decode_kernel.observe(end - start)
+        else:
+            query = query.view(len(reqs), query_len, kv.num_heads, kv.head_dim)
+            query_lens = kv.query_lens([r.num_scheduled_tokens for r in reqs])
+            start = time.perf_counter()
+            for layer in range(kv.num_layers):
+                out = paged_attention(query, kv.keys[layer], kv.values[layer], block_table, context_lens,
+                                      query_lens=query_lens)
+            end = time.perf_counter()
+            (timer or self._prefill_kernel).observe(end - start)
+        if traced:
+            for req in reqs:
+                if req.trace is not None:
+                    req.trace.add("paged_attention", start, end, req.request_id, seqs=len(reqs), query_len=query_len,
+                                  max_blocks=max_blocks)
+        return out
+
+    def _sample(self, context: List[int]) -> int:
+        return sample_token(context)
+
+    @property
+    def load_metric(self) -> float:
+        # KV pool occupancy stands in for GPU utilization
+        return 1.0 - self.allocator.num_free / self.allocator.num_blocks
+
+    def _finish(self, req: Request, error: Exception = None):
+        self.scheduler.finish(req)
+        self._release(req)
+        if error is None:
+            self._record_reward(req)
+        self._resolve(req, error)
+
+    def _record_reward(self, req: Request):
+        # Close the bandit loop with what this routing decision actually cost
+        if not req.output_tokens:
+            return
+        latency = asyncio.get_running_loop().time() - req.arrival_time
+        reward = self.router.compute_reward(latency, len(req.output_tokens))
+        self.router.update(req.route_state, req.routed_to, reward)
+
+    def _abort(self, req: Request):
+        """
+        Drops a request wherever it is (queued, admitted or running).
+        Safe to call between steps only, which holds since steps never await.
+        """
+        if req.status == RequestStatus.FINISHED:
+            return
+        if req.status == RequestStatus.REMOTE:
+            # Blocks come back once the workers let go of them (_on_worker_message)
+            req.status = RequestStatus.FINISHED
+            self.workers.abort(req.request_id)
+        else:
+            self.scheduler.abort(req)
+            self._release(req)
+        if req.trace is not None and not req.future.done():
+            self._end_trace(req, error="aborted")
+        req.future.cancel()
+        logger.info("request_aborted", request_id=req.request_id, tokens_generated=len(req.output_tokens))
+
+    def _release(self, req: Request):
+        if req.swapped_slots is not None:
+            self.swap.free(req.swapped_slots) # Preempted by swap, never resumed
+            req.swapped_slots = None
+        if req.prefix_node is None:
+            return # Never admitted: holds no blocks or pins
+        # Hand our block references to the radix tree: it adopts new blocks and
+        # drops our reference on ones it already holds. Then drop the prefix pin.
+        insert_start = time.perf_counter()
+        self.cache.insert(req.all_tokens[:req.num_computed_tokens], block_ids=req.block_ids, tenant=req.tenant)
+        if req.trace is not None:
+            req.trace.add("radix.insert", insert_start, time.perf_counter(), req.request_id,
+                          tokens=req.num_computed_tokens)
+        self.cache.unlock(req.prefix_node)
+        req.prefix_node = None
+        req.block_ids = []
+        req.num_prefix_blocks = 0
+
+    def _resolve(self, req: Request, error: Exception = None):
+        if req.stream is not None:
+            req.stream.put_nowait(None)
+        if req.future.done():
+            return
+        if req.trace is not None:
+            self._end_trace(req, error=type(error).__name__ if error is not None else None)
+        if error is not None:
+            req.future.set_exception(error)
+        else:
+            req.future.set_result(self._build_response(req))
+
+    def _end_trace(self, req: Request, error: Optional[str]):
+        """Closes the request's own track; finishes the trace if the engine sampled it."""
+        args = {"error": error} if error else {}
+        req.trace.add("request", req.trace_start, time.perf_counter(), req.request_id, replica=self.replica,
+                      prompt_tokens=len(req.prompt_tokens), output_tokens=len(req.output_tokens),
+                      tokens_saved=req.match_len, routed_to=req.routed_to, tenant=req.tenant, **args)
+        if req.owns_trace:
+            self.tracer.finish(req.trace)
+
+    def _build_response(self, req: Request) -> dict:
+        now = asyncio.get_running_loop().time()
+        metrics.REQUEST_LATENCY_SECONDS.observe(now - req.arrival_time)
+        hit_rate = req.match_len / len(req.prompt_tokens)
         return {
             "text": "This is a generated response demonstrating prefix reuse.",
+            "output_ids": req.output_tokens,
             "metrics": {
                 "cache_hit_rate": hit_rate,
-                "tokens_saved": match_len,
-                "routed_to": worker,
-                "latency_ms": round(latency * 1000, 2),
+                "tokens_saved": req.match_len,
+                "matched_blocks_by_tier": req.match_tiers,
+                "routed_to": req.routed_to,
+                "tenant": req.tenant,
+                "latency_ms": round((now - req.arrival_time) * 1000, 2),
+                "queue_ms": round((req.admit_time - req.arrival_time) * 1000, 2),
+                "ttft_ms": round((req.first_token_time - req.arrival_time) * 1000, 2) if req.first_token_time else None,
+                "decode_steps": req.num_steps,
+                "prefill_chunks": req.num_prefill_chunks,
+                "preemptions": req.num_preemptions,
+                "speculative": {
+                    "drafted_tokens": req.num_drafted,
+                    "accepted_tokens": req.num_accepted,
+                    "acceptance_rate": round(req.num_accepted / req.num_drafted, 4) if req.num_drafted else None,
+                    # Decode tokens per decode pass: 1.0 without speculation
+                    "speedup": round(req.num_decode_tokens / req.num_decode_passes, 4) if req.num_decode_passes else None,
+                },
                 "kernel_backend": "triton" if torch.cuda.is_available() else "pytorch_cpu"
             }
-        }
\ No newline at end of file
+        }
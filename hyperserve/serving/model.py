@@ -0,0 +1,41 @@
+import numpy as np
+import torch
+from typing import List
+from hyperserve.config import settings
+from hyperserve.memory.kv_pool import KVPool, StagingBuffer
+
+_EMBED_ROWS = 1024 # Distinct simulated K/V rows (token IDs wrap around)
+
+def sample_token(context: List[int]) -> int:
+    # Simulated LM head: deterministic in the trailing context, so a
+    # repeated prompt decodes to the same continuation (in any process).
+    return hash(tuple(context[-4:])) % settings.VOCAB_SIZE
+
+class KVProjection:
+    """
+    Simulated K/V projection: a token's K and V in each layer are fixed
+    rows of a seeded table, so cached blocks hold exactly what recomputing
+    them would write. Gathers straight into the pool's staging rows.
+    """
+    def __init__(self, pool: KVPool):
+        self.pool = pool
+        generator = torch.Generator().manual_seed(0)
+        self.table = torch.randn(_EMBED_ROWS, pool.num_heads, pool.head_dim, generator=generator).to(pool.dtype)
+        self._rows = StagingBuffer(settings.MAX_BATCH_TOKENS)
+
+    def write(self, num_tokens: int):
+        """K/V of the num_tokens tokens staged in the pool, into every layer."""
+        if not num_tokens:
+            return
+        key, value = self.pool.staged_kv()
+        tokens = self.pool.staged_tokens()
+        self._rows.ensure(num_tokens)
+        rows, rows_np = self._rows.tensor[:num_tokens], self._rows.numpy[:num_tokens]
+        for layer in range(self.pool.num_layers):
+            np.add(tokens, 2 * layer, out=rows_np)
+            np.remainder(rows_np, _EMBED_ROWS, out=rows_np)
+            torch.index_select(self.table, 0, rows, out=key)
+            np.add(rows_np, 1, out=rows_np)
+            np.remainder(rows_np, _EMBED_ROWS, out=rows_np)
+            torch.index_select(self.table, 0, rows, out=value)
+            self.pool.write(layer)
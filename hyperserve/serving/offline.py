@@ -0,0 +1,387 @@
+import os
+import json
+import time
+import heapq
+import asyncio
+import tempfile
+import numpy as np
+import structlog
+from typing import Iterator, List, Optional, Tuple
+from hyperserve.config import settings
+from hyperserve.memory.tenants import DEFAULT_TENANT
+from hyperserve.serving.engine import HyperEngine, resolve_max_new_tokens
+
+logger = structlog.get_logger()
+
+# Sort keys are prompts as big-endian uint32 bytes: comparing the bytes orders
+# prompts exactly like comparing the token lists, but in C and at 4 bytes/token
+_KEY_DTYPE = np.dtype(">u4")
+_ENTRY_OVERHEAD = 200 # Approximate per-entry bytes besides key and line (tuple, str and bytes headers)
+_PROGRESS_INTERVAL_S = 10.0
+
+# (sort key, input line number, raw JSON line)
+Entry = Tuple[bytes, int, str]
+
+class BatchInputError(ValueError):
+    """An input line that is not a valid request; recorded as an error in the output."""
+
+def parse_line(raw: str) -> Tuple[dict, bytes]:
+    """Validates one JSONL request. Returns (record, sort key)."""
+    try:
+        rec = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise BatchInputError(f"invalid JSON: {e}")
+    if not isinstance(rec, dict):
+        raise BatchInputError("each line must be a JSON object")
+    prompt = np.asarray(rec.get("prompt_ids") or [])
+    if prompt.ndim != 1 or not len(prompt) or prompt.dtype.kind not in "iu":
+        raise BatchInputError("'prompt_ids' must be a non-empty list of token ids")
+    if prompt.min() < 0 or prompt.max() >= settings.VOCAB_SIZE:
+        raise BatchInputError(f"token ids must be in [0, {settings.VOCAB_SIZE})")
+    for field, low in (("max_new_tokens", 1), ("priority", None)):
+        value = rec.get(field)
+        if value is not None and (type(value) is not int or (low is not None and value < low)):
+            raise BatchInputError(f"'{field}' must be an integer" + (f" >= {low}" if low is not None else ""))
+    if not isinstance(rec.get("tenant", ""), str):
+        raise BatchInputError("'tenant' must be a string")
+    return rec, prompt.astype(_KEY_DTYPE).tobytes()
+
+def shared_blocks(a: bytes, b: bytes, block_size: int) -> int:
+    """Full KV blocks two prompts (as sort keys) have in common."""
+    n = min(len(a), len(b)) // _KEY_DTYPE.itemsize
+    diff = np.flatnonzero(np.frombuffer(a, _KEY_DTYPE, n) != np.frombuffer(b, _KEY_DTYPE, n))
+    return (int(diff[0]) if len(diff) else n) // block_size
+
+class LineSet:
+    """Set of input line numbers as a growable bitmap: 1 bit per line, whatever the input size."""
+    def __init__(self):
+        self._bits = bytearray()
+        self._count = 0
+
+    def add(self, line: int):
+        byte, bit = line >> 3, 1 << (line & 7)
+        if byte >= len(self._bits):
+            self._bits.extend(bytes(max(byte + 1, 2 * len(self._bits)) - len(self._bits)))
+        if not self._bits[byte] & bit:
+            self._bits[byte] |= bit
+            self._count += 1
+
+    def __contains__(self, line: int) -> bool:
+        byte = line >> 3
+        return byte < len(self._bits) and bool(self._bits[byte] & (1 << (line & 7)))
+
+    def __len__(self) -> int:
+        return self._count
+
+def completed_lines(path: str) -> LineSet:
+    """
+    Input lines an earlier run already wrote a result (or error) for.
+    A torn last line from an interrupted write is cut off, so that
+    request simply runs again.
+    """
+    done = LineSet()
+    if not os.path.exists(path):
+        return done
+    valid = 0
+    with open(path, "rb") as f:
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break
+            try:
+                done.add(int(json.loads(raw)["line"]))
+            except (ValueError, KeyError, TypeError):
+                break
+            valid += len(raw)
+    if valid < os.path.getsize(path):
+        logger.warning("batch_output_truncated", path=path, dropped_bytes=os.path.getsize(path) - valid)
+        with open(path, "r+b") as f:
+            f.truncate(valid)
+    return done
+
+def prefix_sorted(entries: Iterator[Entry], buffer_bytes: int, tmp_dir: Optional[str] = None) -> Iterator[Entry]:
+    """
+    External merge sort of entries by prompt tokens, which is the depth-first
+    order of the trie of all prompts: requests sharing a prefix come out back
+    to back. Runs of buffer_bytes are sorted in memory and spilled to temp
+    files; the last run stays in memory and all are k-way merged, so memory
+    is bounded by the buffer plus one entry per run.
+    """
+    run: List[Entry] = []
+    size = 0
+    paths: List[str] = []
+    tmp = None
+    try:
+        for entry in entries:
+            run.append(entry)
+            size += len(entry[0]) + len(entry[2]) + _ENTRY_OVERHEAD
+            if size >= buffer_bytes:
+                if tmp is None:
+                    tmp = tempfile.TemporaryDirectory(prefix="hyperserve-batch-", dir=tmp_dir)
+                paths.append(_spill(sorted(run), os.path.join(tmp.name, f"run{len(paths)}.tsv")))
+                run, size = [], 0
+        run.sort()
+        if paths:
+            logger.info("batch_sort_spilled", runs=len(paths) + 1, tmp_dir=tmp.name)
+        yield from heapq.merge(run, *[_read_run(p) for p in paths])
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+def _spill(run: List[Entry], path: str) -> str:
+    # line \t key (hex) \t raw JSON: merging needs no JSON parsing
+    with open(path, "w", encoding="utf-8") as f:
+        for key, line, raw in run:
+            f.write(f"{line}\t{key.hex()}\t{raw}\n")
+    return path
+
+def _read_run(path: str) -> Iterator[Entry]:
+    with open(path, encoding="utf-8") as f:
+        for row in f:
+            line, key, raw = row.rstrip("\n").split("\t", 2)
+            yield bytes.fromhex(key), int(line), raw
+
+class _Pending:
+    """A request handed to the dispatcher, the earlier one it waits for, and its capacity charge."""
+    __slots__ = ("key", "dep", "dep_blocks", "dependents", "max_shared", "charge", "kept", "pin", "done")
+
+    def __init__(self, key: bytes):
+        self.key = key
+        self.dep: Optional["_Pending"] = None # Computes the prefix blocks we share with it
+        self.dep_blocks = 0 # Blocks we share with the request before us in prefix order
+        self.dependents = 0 # Later requests waiting on (or running off) our prefix
+        self.max_shared = 0 # Most blocks any of them shares with us
+        self.charge = 0     # Blocks booked on the gate
+        self.kept = 0       # Of those, still held for dependents after we finished
+        self.pin = None     # Radix node pinning the shared prefix for them
+        self.done = asyncio.Event()
+
+class _CapacityGate:
+    """
+    Engine capacity (a request slot plus its KV blocks) handed to ready
+    requests in dispatch order rather than arrival order: a follower whose
+    prefix just landed in the tree goes ahead of later groups' leaders,
+    before that prefix can be evicted. Blocks can outlive their request
+    (release_blocks): a finished prefix stays booked while others use it.
+    A lone request always gets in, even if it is larger than the pool.
+    """
+    def __init__(self, max_requests: int, max_blocks: int):
+        self.max_requests = max_requests
+        self.max_blocks = max_blocks
+        self.requests = 0
+        self.blocks = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = [] # Heap of (seq, blocks, future)
+
+    async def acquire(self, seq: int, blocks: int):
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (seq, blocks, fut))
+        self._grant()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(blocks) # Granted, but we were cancelled before using it
+            raise
+
+    def release(self, blocks: int):
+        self.requests -= 1
+        self.release_blocks(blocks)
+
+    def release_blocks(self, blocks: int):
+        self.blocks -= blocks
+        self._grant()
+
+    def _grant(self):
+        while self._waiters:
+            seq, blocks, fut = self._waiters[0]
+            if fut.cancelled():
+                heapq.heappop(self._waiters)
+                continue
+            if self.requests and (self.requests >= self.max_requests or self.blocks + blocks > self.max_blocks):
+                return
+            heapq.heappop(self._waiters)
+            self.requests += 1
+            self.blocks += blocks
+            fut.set_result(None)
+
+class BatchRunner:
+    """
+    Offline inference over a JSONL file, driving one HyperEngine directly
+    (no HTTP). One request per line: {"prompt_ids": [...]} plus optional
+    "id", "max_new_tokens", "priority" and "tenant".
+    Architecture:
+    - The input is streamed line by line. Lines an earlier run already
+      answered (resume) are skipped using a 1-bit-per-line LineSet.
+    - order="prefix": prompts go through an external merge sort by tokens
+      (prefix_sorted), i.e. a walk of the trie of all inputs. Requests that
+      share a prefix then reach the engine while it is still in the
+      RadixCache instead of after it was evicted.
+    - The tree only learns a prefix when a request finishes. So a request
+      whose shared blocks an earlier, still running request is computing
+      waits for it rather than prefilling the same blocks alongside it.
+      Siblings under a common leader are not chained; they run together.
+      The finished leader pins the shared prefix in the tree until its last
+      dependent is done, so eviction cannot take it in between.
+    - At most `concurrency` requests and a pool's worth of KV blocks (their
+      prompt plus decode budget, less the blocks they find cached) are in
+      the engine; ready requests get that capacity in prefix order
+      (_CapacityGate), so nothing waits in the engine queue while the tree
+      evicts its prefix. `lookahead` bounds those read but still waiting.
+    - Each result is appended (in completion order, tagged with its input
+      "line") and flushed as it completes. An interrupted run resumes from
+      the output; a torn last line is dropped and redone.
+    """
+    def __init__(self, engine: HyperEngine, concurrency: int = None, max_new_tokens: int = None,
+                 order: str = "prefix", sort_buffer_mb: int = None, tmp_dir: Optional[str] = None):
+        if order not in ("prefix", "input"):
+            raise ValueError(f"unknown order {order!r} (prefix | input)")
+        self.engine = engine
+        self.concurrency = concurrency or settings.BATCH_CONCURRENCY
+        if settings.MAX_WAITING_REQUESTS:
+            self.concurrency = min(self.concurrency, settings.MAX_WAITING_REQUESTS) # Never trip a 429
+        self.lookahead = 4 * self.concurrency
+        self.max_new_tokens = resolve_max_new_tokens(max_new_tokens) # Default for records without one
+        self.order = order
+        self.sort_buffer_bytes = (sort_buffer_mb or settings.BATCH_SORT_BUFFER_MB) << 20
+        self.tmp_dir = tmp_dir
+        self._out = None
+        self._stats = {}
+
+    async def run(self, input_path: str, output_path: str, restart: bool = False) -> dict:
+        """Processes every line not answered yet. Returns a summary of this run."""
+        done = LineSet() if restart else completed_lines(output_path)
+        self._stats = {"requests": 0, "errors": 0, "resumed": len(done), "output_tokens": 0, "tokens_saved": 0,
+                       "prompt_tokens": 0}
+        self._start = self._last_progress = time.perf_counter()
+        with open(output_path, "w" if restart else "a", encoding="utf-8") as out:
+            self._out = out
+            entries = self._read(input_path, done)
+            if self.order == "prefix":
+                entries = prefix_sorted(entries, self.sort_buffer_bytes, self.tmp_dir)
+            await self._dispatch(entries)
+        summary = self._summary()
+        logger.info("batch_done", **summary)
+        return summary
+
+    def _read(self, path: str, done: LineSet) -> Iterator[Entry]:
+        with open(path, encoding="utf-8") as f:
+            for line, raw in enumerate(f):
+                raw = raw.strip()
+                if not raw or line in done:
+                    continue
+                try:
+                    _, key = parse_line(raw)
+                except BatchInputError as e:
+                    self._write({"line": line, "error": str(e)})
+                    continue
+                yield key, line, raw
+
+    async def _dispatch(self, entries: Iterator[Entry]):
+        gate = _CapacityGate(self.concurrency, self.engine.allocator.num_blocks)
+        lookahead = asyncio.Semaphore(self.lookahead)
+        tasks = set()
+        prev = None
+        try:
+            for seq, (key, line, raw) in enumerate(entries):
+                await lookahead.acquire()
+                item = _Pending(key)
+                if self.order == "prefix" and prev is not None:
+                    self._link(item, prev)
+                prev = item
+                task = asyncio.ensure_future(self._run_one(item, seq, line, raw, gate))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda _: lookahead.release())
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Interrupted: abort what is in flight; it is redone on resume
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    def _link(self, item: _Pending, prev: _Pending):
+        # In prefix order the previous request shares the longest prefix with
+        # us of any earlier one. Blocks it shares with its own predecessor are
+        # computed by that one's dependency, the rest by prev itself.
+        shared = shared_blocks(item.key, prev.key, self.engine.cache.block_size)
+        dep = prev.dep if shared <= prev.dep_blocks else prev
+        if shared and dep is not None and not dep.done.is_set():
+            item.dep = dep
+            dep.dependents += 1
+            dep.max_shared = max(dep.max_shared, shared)
+        item.dep_blocks = shared
+
+    async def _run_one(self, item: _Pending, seq: int, line: int, raw: str, gate: _CapacityGate):
+        rec = json.loads(raw)
+        record = {"line": line}
+        if "id" in rec:
+            record["id"] = rec["id"]
+        # Blocks our dependency keeps booked for us are not charged again
+        cached = item.dep_blocks if item.dep is not None else 0
+        try:
+            if item.dep is not None:
+                await item.dep.done.wait()
+            max_new_tokens = rec.get("max_new_tokens")
+            if max_new_tokens is None:
+                max_new_tokens = self.max_new_tokens
+            blocks = -(-(len(rec["prompt_ids"]) + max_new_tokens) // self.engine.cache.block_size)
+            charge = max(1, blocks - cached)
+            await gate.acquire(seq, charge)
+            item.charge = charge
+            try:
+                result = await self.engine.generate(rec["prompt_ids"], max_new_tokens, priority=rec.get("priority") or 0,
+                                                    tenant=rec.get("tenant") or DEFAULT_TENANT)
+            finally:
+                self._settle(item, rec["prompt_ids"], cached, gate)
+            record.update(output_ids=result["output_ids"], metrics=result["metrics"])
+            self._stats["output_tokens"] += len(result["output_ids"])
+            self._stats["prompt_tokens"] += len(rec["prompt_ids"])
+            self._stats["tokens_saved"] += result["metrics"]["tokens_saved"]
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("batch_request_failed", line=line, error=str(e))
+            record["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            item.done.set()
+            if item.dep is not None:
+                self._unref(item.dep, gate)
+                item.dep = None # Let finished chains be collected
+        self._write(record)
+
+    def _settle(self, item: _Pending, prompt: List[int], cached: int, gate: _CapacityGate):
+        # Keep the prefix dependents share pinned, and our part of it booked, until they are done
+        if item.dependents:
+            item.pin = self.engine.pin_prefix(prompt[:item.max_shared * self.engine.cache.block_size])
+            item.kept = min(item.charge, max(0, item.max_shared - cached))
+        gate.release(item.charge - item.kept)
+
+    def _unref(self, dep: _Pending, gate: _CapacityGate):
+        dep.dependents -= 1
+        if dep.dependents:
+            return
+        if dep.pin is not None:
+            self.engine.unpin_prefix(dep.pin)
+            dep.pin = None
+        gate.release_blocks(dep.kept)
+        dep.kept = 0
+
+    def _write(self, record: dict):
+        self._out.write(json.dumps(record) + "\n")
+        self._out.flush() # A crash loses at most the line being written
+        self._stats["errors" if "error" in record else "requests"] += 1
+        now = time.perf_counter()
+        if now - self._last_progress >= _PROGRESS_INTERVAL_S:
+            self._last_progress = now
+            logger.info("batch_progress", **self._summary())
+
+    def _summary(self) -> dict:
+        elapsed = time.perf_counter() - self._start
+        stats = dict(self._stats)
+        prompt_tokens = stats.pop("prompt_tokens")
+        stats.update(
+            elapsed_s=round(elapsed, 2),
+            output_tokens_per_s=round(stats["output_tokens"] / elapsed, 1) if elapsed else None,
+            cache_hit_rate=round(stats["tokens_saved"] / prompt_tokens, 4) if prompt_tokens else None,
+        )
+        return stats
@@ -0,0 +1,323 @@
+import bisect
+import itertools
+import asyncio
+import structlog
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Optional
+from hyperserve.config import settings
+from hyperserve.memory.tenants import DEFAULT_TENANT
+
+logger = structlog.get_logger()
+
+_request_ids = itertools.count()
+
+class RequestStatus:
+    WAITING = "waiting"
+    RUNNING = "running"
+    REMOTE = "remote"   # Handed off to the disaggregated prefill/decode workers
+    FINISHED = "finished"
+
+@dataclass
+class Request:
+    """
+    One generation request as it moves through the scheduler.
+    KV for the first num_computed_tokens of all_tokens lives in block_ids.
+    The request holds one allocator reference on every block in block_ids;
+    the leading ones are shared with the radix tree (pinned via prefix_node).
+    """
+    prompt_tokens: List[int]
+    max_new_tokens: int
+    future: asyncio.Future
+    arrival_time: float
+    stream: Optional[asyncio.Queue] = None # Decoded tokens, then None, for streaming callers
+    block_hashes: Optional[List[int]] = None # Chained prompt block hashes, if the dispatcher has them
+    priority: int = 0 # Lower values are admitted first and preempted last
+    tenant: str = DEFAULT_TENANT # Whose cache quota its blocks are charged to once cached
+    request_id: int = field(default_factory=lambda: next(_request_ids))
+    status: str = RequestStatus.WAITING
+    output_tokens: List[int] = field(default_factory=list)
+
+    # Filled in on admission
+    prefix_node: Any = None
+    match_len: int = 0
+    routed_to: str = "local"
+    route_state: Any = None # SystemState the router saw, for its reward update
+    block_ids: List[int] = field(default_factory=list)
+    num_prefix_blocks: int = 0 # Leading block_ids shared with the radix tree
+    num_computed_tokens: int = 0
+    match_tiers: dict = field(default_factory=dict) # Tier -> matched blocks found there
+    promotions: List[Any] = field(default_factory=list) # Swap -> device copies of the prefix
+
+    # Preemption: the request goes back to the queue, its KV to the tree or to swap
+    num_preemptions: int = 0
+    swapped_slots: Optional[List[int]] = None # SwapSpace slots holding its computed KV
+
+    # Set by the scheduler each step
+    num_scheduled_tokens: int = 0
+    draft_tokens: List[int] = field(default_factory=list) # Speculated tokens verified this step
+    draft_source: str = ""
+    draft_index: Any = None # NgramIndex over its own context, built on first use
+
+    # Timeline
+    admit_time: Optional[float] = None
+    first_token_time: Optional[float] = None
+    num_steps: int = 0
+    num_prefill_chunks: int = 0
+    num_decode_passes: int = 0 # Decode forward passes it took part in
+    num_decode_tokens: int = 0 # Tokens those passes produced (> passes when drafts are accepted)
+    num_drafted: int = 0
+    num_accepted: int = 0
+
+    # Tracing (hyperserve.tracing): None unless sampled
+    trace: Any = None
+    owns_trace: bool = False # Sampled by the engine, which finishes it; else the caller does
+    trace_start: float = 0.0  # perf_counter() at submission
+    trace_queued: float = 0.0 # ... and when it last joined the queue
+
+    @property
+    def all_tokens(self) -> List[int]:
+        return self.prompt_tokens + self.output_tokens
+
+    @property
+    def scheduled_tokens(self) -> List[int]:
+        """Token IDs whose KV this step computes: the next num_scheduled_tokens, drafts included."""
+        start = self.num_computed_tokens
+        end = start + self.num_scheduled_tokens
+        prompt_len = len(self.prompt_tokens)
+        if end <= prompt_len:
+            return self.prompt_tokens[start:end]
+        tail = self.output_tokens[max(0, start - prompt_len):] + self.draft_tokens
+        return (self.prompt_tokens[start:] + tail)[:end - start] if start < prompt_len else tail[:end - start]
+
+    @property
+    def is_finished(self) -> bool:
+        return len(self.output_tokens) >= self.max_new_tokens
+
+    @property
+    def is_ready(self) -> bool:
+        # A prefix coming back from the swap tier must land before we read it
+        return all(f.done() for f in self.promotions)
+
+    @property
+    def is_prefilling(self) -> bool:
+        # The first output token is sampled by the step that completes the prompt;
+        # a request preempted by recompute prefills its prompt and outputs again
+        return not self.output_tokens or self.num_tokens_to_compute() > 1
+
+    def num_tokens_to_compute(self) -> int:
+        """Tokens whose KV is still missing (rest of the prompt, or one decode token)."""
+        return len(self.prompt_tokens) + len(self.output_tokens) - self.num_computed_tokens
+
+    def blocks_to_completion(self, block_size: int) -> int:
+        """Blocks it still has to allocate to finish, if it decodes its full budget."""
+        total = len(self.prompt_tokens) + self.max_new_tokens - 1
+        return max(0, -(-total // block_size) - len(self.block_ids))
+
+@dataclass
+class ScheduledBatch:
+    decodes: List[Request] = field(default_factory=list)
+    prefills: List[Request] = field(default_factory=list) # Prefill chunks, see num_scheduled_tokens
+    num_tokens: int = 0
+
+    @property
+    def requests(self) -> List[Request]:
+        return self.decodes + self.prefills
+
+    def __len__(self):
+        return len(self.decodes) + len(self.prefills)
+
+    def remove(self, req: Request):
+        """Drops req from this step, if it was scheduled in it."""
+        for scheduled in (self.decodes, self.prefills):
+            if req in scheduled:
+                scheduled.remove(req)
+                self.num_tokens -= req.num_scheduled_tokens
+
+class WaitingQueue:
+    """
+    Requests waiting for admission: one FIFO per priority level, lower
+    levels first. Preempted requests rejoin at the head of their level.
+    """
+    def __init__(self):
+        self._levels: Dict[int, Deque[Request]] = {}
+        self._priorities: List[int] = [] # Sorted levels that have a queue
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self) -> Iterator[Request]:
+        for priority in self._priorities:
+            yield from self._levels[priority]
+
+    def append(self, req: Request):
+        self._level(req.priority).append(req)
+        self._len += 1
+
+    def appendleft(self, req: Request):
+        self._level(req.priority).appendleft(req)
+        self._len += 1
+
+    def peek(self) -> Request:
+        return self._levels[self._priorities[0]][0]
+
+    def popleft(self) -> Request:
+        priority = self._priorities[0]
+        req = self._levels[priority].popleft()
+        self._shrunk(priority)
+        return req
+
+    def remove(self, req: Request):
+        self._levels[req.priority].remove(req)
+        self._shrunk(req.priority)
+
+    def depths(self) -> Dict[int, int]:
+        return {priority: len(self._levels[priority]) for priority in self._priorities}
+
+    def _level(self, priority: int) -> Deque[Request]:
+        level = self._levels.get(priority)
+        if level is None:
+            level = self._levels[priority] = deque()
+            bisect.insort(self._priorities, priority)
+        return level
+
+    def _shrunk(self, priority: int):
+        self._len -= 1
+        if not self._levels[priority]:
+            del self._levels[priority]
+            self._priorities.remove(priority)
+
+class Scheduler:
+    """
+    Iteration-level (continuous) batching.
+    Architecture:
+    - Every step, all running requests decode one token each.
+    - The leftover token budget goes to prefill chunks of at most
+      PREFILL_CHUNK_SIZE tokens: first requests already mid-prefill, then
+      waiting requests admitted in priority order, FIFO within a level
+      (see WaitingQueue). A long prompt is ingested over several
+      steps, so decode latency of live streams stays bounded by the chunk.
+    - Finished requests leave between steps.
+    - A streaming request whose consumer falls behind is skipped (not
+      evicted) until its buffer drains: backpressure without stalling others.
+    - Admission itself (prefix match, block allocation) is delegated to the
+      engine through admit_fn, which may refuse when memory is short and
+      must be idempotent for a request that was admitted but not yet run.
+    - A request whose cached prefix is still being promoted back from the
+      swap tier holds its slot but gets no prefill chunk until the copy lands.
+    - When the head request cannot be admitted, running requests of a lower
+      priority are preempted through preempt_fn (which releases or parks
+      their KV) and requeued, until it fits or none are left.
+    """
+    def __init__(self, max_batch_tokens: int = None, max_num_seqs: int = None,
+                 stream_buffer_tokens: int = None, prefill_chunk_size: int = None):
+        self.max_batch_tokens = max_batch_tokens or settings.MAX_BATCH_TOKENS
+        self.prefill_chunk_size = prefill_chunk_size or settings.PREFILL_CHUNK_SIZE
+        self.max_num_seqs = max_num_seqs or settings.MAX_NUM_SEQS
+        self.stream_buffer_tokens = stream_buffer_tokens or settings.STREAM_BUFFER_TOKENS
+        self.waiting = WaitingQueue()
+        self.running: List[Request] = []
+        self.num_preemptions = 0
+
+    def add(self, req: Request):
+        self.waiting.append(req)
+
+    def has_work(self) -> bool:
+        return bool(self.waiting or self.running)
+
+    def schedule(self, admit_fn, preempt_fn=None) -> ScheduledBatch:
+        batch = ScheduledBatch()
+
+        # 1. Decodes first: running streams must never stall behind new prompts
+        prefilling = []
+        for req in self.running:
+            if req.is_prefilling or not req.is_ready:
+                prefilling.append(req)
+                continue
+            if req.stream is not None and req.stream.qsize() >= self.stream_buffer_tokens:
+                continue # Slow consumer: hold this stream back
+            req.num_scheduled_tokens = 1
+            batch.decodes.append(req)
+            batch.num_tokens += 1
+
+        # 2. Continue chunked prefills already in flight
+        for req in prefilling:
+            if not req.is_ready:
+                continue # Prefix still being promoted from swap
+            if not self._schedule_chunk(req, batch):
+                break
+
+        # 3. Fill the remaining budget with new requests
+        while self.waiting and len(self.running) < self.max_num_seqs:
+            if batch.num_tokens >= self.max_batch_tokens:
+                break
+            req = self.waiting.peek()
+            if not admit_fn(req):
+                victim = self.pick_victim(below=req.priority) if preempt_fn is not None else None
+                if victim is None:
+                    break # Out of KV blocks: retry once something finishes
+                batch.remove(victim)
+                preempt_fn(victim)
+                continue
+            self.waiting.popleft()
+            req.status = RequestStatus.RUNNING
+            self.running.append(req)
+            if req.is_ready:
+                self._schedule_chunk(req, batch)
+
+        return batch
+
+    def _schedule_chunk(self, req: Request, batch: ScheduledBatch) -> bool:
+        chunk = min(
+            req.num_tokens_to_compute(),
+            self.prefill_chunk_size,
+            self.max_batch_tokens - batch.num_tokens,
+        )
+        if chunk <= 0:
+            return False
+        req.num_scheduled_tokens = chunk
+        batch.prefills.append(req)
+        batch.num_tokens += chunk
+        return True
+
+    def pick_victim(self, below: Optional[int] = None) -> Optional[Request]:
+        """
+        The running request to preempt first: lowest priority, then latest
+        arrival (it has the least work to lose). With below, only requests
+        of a strictly lower priority than that qualify.
+        """
+        victim = None
+        for req in self.running:
+            if below is not None and req.priority <= below:
+                continue
+            if victim is None or (req.priority, req.arrival_time) > (victim.priority, victim.arrival_time):
+                victim = req
+        return victim
+
+    def preempt(self, req: Request):
+        """Requeues a running request at the head of its priority level."""
+        self.running.remove(req)
+        req.status = RequestStatus.WAITING
+        req.num_preemptions += 1
+        self.num_preemptions += 1
+        self.waiting.appendleft(req)
+
+    def finish(self, req: Request):
+        req.status = RequestStatus.FINISHED
+        self.running.remove(req)
+
+    def hand_off(self, req: Request):
+        """
+        Moves an admitted request out of the local batch to another executor,
+        freeing its sequence slot here. The engine tracks it from then on.
+        """
+        self.running.remove(req)
+        req.status = RequestStatus.REMOTE
+
+    def abort(self, req: Request):
+        if req.status == RequestStatus.RUNNING:
+            self.running.remove(req)
+        elif req.status == RequestStatus.WAITING:
+            self.waiting.remove(req)
+        req.status = RequestStatus.FINISHED
@@ -0,0 +1,59 @@
+from typing import Dict, List, Tuple
+from hyperserve.config import settings
+from hyperserve.memory.radix_cache import RadixCache
+from hyperserve.serving.scheduler import Request
+
+_MIN_NGRAM = 2 # Single-token matches are too weak to be worth verifying
+
+class NgramIndex:
+    """
+    Prompt-lookup index over one growing token sequence: maps every n-gram
+    (n <= max_n) to the position right after its latest occurrence.
+    Indexing is incremental, so each token is hashed max_n times in total.
+    """
+    def __init__(self, max_n: int):
+        self.max_n = max_n
+        self._next: Dict[Tuple[int, ...], int] = {}
+        self._indexed = 1 # n-grams ending before this position are indexed
+
+    def draft(self, tokens: List[int], k: int) -> List[int]:
+        """Up to k tokens that followed the longest earlier occurrence of tokens' suffix."""
+        # Index everything but the suffix itself, which must match an earlier copy
+        end = len(tokens)
+        for stop in range(self._indexed, end):
+            for n in range(1, min(self.max_n, stop) + 1):
+                self._next[tuple(tokens[stop - n:stop])] = stop
+        self._indexed = max(self._indexed, end)
+
+        for n in range(min(self.max_n, end), _MIN_NGRAM - 1, -1):
+            start = self._next.get(tuple(tokens[end - n:]))
+            if start is not None:
+                return tokens[start:start + k]
+        return []
+
+class Drafter:
+    """
+    Draft-model-free speculation for decode steps.
+    Architecture:
+    - "radix": walk the RadixCache from the request's pinned prefix along
+      its uncached prompt and outputs; if an earlier sequence continued from
+      there, its next tokens are the draft (agent loops replay outputs).
+    - "ngram": otherwise, prompt lookup over the request's own context
+      (NgramIndex, kept on the request).
+    - Drafts are only proposals: the engine verifies them in one batched
+      multi-query pass and keeps the prefix the model agrees with.
+    """
+    def __init__(self, cache: RadixCache, max_ngram: int = None):
+        self.cache = cache
+        self.max_ngram = max_ngram or settings.SPECULATIVE_NGRAM
+
+    def draft(self, req: Request, k: int) -> Tuple[List[int], str]:
+        """Returns (up to k draft tokens, source)."""
+        tokens = req.all_tokens
+        prefix_len = req.num_prefix_blocks * self.cache.block_size
+        draft = self.cache.continuation(tokens, k, req.prefix_node, prefix_len)
+        if draft:
+            return draft, "radix"
+        if req.draft_index is None:
+            req.draft_index = NgramIndex(self.max_ngram)
+        return req.draft_index.draft(tokens, k), "ngram"
@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import random
+import itertools
+import contextlib
+import structlog
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+from hyperserve.config import settings
+
+logger = structlog.get_logger()
+
+# Chrome-trace thread ids within one trace (one trace = one process):
+# requests get their request_id, these get the fixed tracks below
+API_TID = -1    # The API handler
+TORCH_TID = -2  # torch.profiler op events
+
+def engine_tid(replica: int) -> int:
+    """Track for a replica's batch-wide work (scheduling passes)."""
+    return -3 - replica
+
+AUTO = object() # generate(trace=AUTO): the engine samples the request itself
+
+_trace_ids = itertools.count(1)
+_NULL_CONTEXT = contextlib.nullcontext()
+
+class Trace:
+    """
+    Spans of one sampled API call or engine request. Timestamps are
+    time.perf_counter() seconds; export converts them to Chrome-trace
+    microseconds.
+    """
+    __slots__ = ("trace_id", "name", "spans", "tracks", "refs")
+
+    def __init__(self, name: str):
+        self.trace_id = next(_trace_ids)
+        self.name = name
+        self.spans: List[Tuple[str, float, Optional[float], int, dict]] = []
+        self.tracks: Dict[int, str] = {}
+        self.refs = 1 # Tracer.finish() calls still owed before it is exported
+
+    def retain(self):
+        """One more finish() before export, for work that outlives its starter (e.g. a response stream)."""
+        self.refs += 1
+
+    def add(self, name: str, start: float, end: Optional[float], tid: int, **args):
+        """A complete span, or an instant event if end is None."""
+        self.spans.append((name, start, end, tid, args))
+
+    def track(self, tid: int, label: str):
+        self.tracks.setdefault(tid, label)
+
+    def events(self) -> List[dict]:
+        """Chrome trace events (ph "X" spans, "i" instants, "M" track names)."""
+        pid = self.trace_id
+        events = [{"ph": "M", "name": "process_name", "pid": pid, "tid": 0,
+                   "args": {"name": f"{self.name} #{pid}"}}]
+        events += [{"ph": "M", "name": "thread_name", "pid": pid, "tid": tid, "args": {"name": label}}
+                   for tid, label in self.tracks.items()]
+        for name, start, end, tid, args in self.spans:
+            event = {"name": name, "pid": pid, "tid": tid, "ts": round(start * 1e6, 3), "args": args}
+            if end is None:
+                event.update(ph="i", s="t")
+            else:
+                event.update(ph="X", dur=round((end - start) * 1e6, 3))
+            events.append(event)
+        return events
+
+class Tracer:
+    """
+    Sampled per-request span tracing, exported as Chrome trace JSON
+    (chrome://tracing, ui.perfetto.dev).
+    Architecture:
+    - start() makes the sampling decision once per API call or engine
+      request. Unsampled requests carry trace=None, so instrumented code
+      pays one attribute check; batch-wide spans are skipped entirely
+      while num_active is zero.
+    - Each trace is one Chrome "process": one track per request, plus
+      tracks for the API handler, the engine's scheduling passes and
+      (optionally) torch.profiler ops.
+    - finish() keeps the trace in a ring of recent ones (GET /debug/traces)
+      and, with TRACE_DIR set, writes trace-<id>.json off the event loop.
+    - With TRACE_TORCH_PROFILER, steps that carry a sampled request run
+      under torch.profiler and its op events are folded into their traces
+      for kernel-level timing. Profiling costs far more than the spans
+      themselves, so keep the sample rate low.
+    """
+    def __init__(self, sample_rate: float = None, trace_dir: str = None, torch_profiler: bool = None,
+                 keep: int = None):
+        self.sample_rate = settings.TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.trace_dir = settings.TRACE_DIR if trace_dir is None else trace_dir
+        self.torch_profiler = settings.TRACE_TORCH_PROFILER if torch_profiler is None else torch_profiler
+        self.recent: Deque[Trace] = deque(maxlen=settings.TRACE_KEEP if keep is None else keep)
+        self.num_active = 0 # Started, not yet finished
+        self._writer: Optional[ThreadPoolExecutor] = None
+
+    def start(self, name: str) -> Optional[Trace]:
+        """A new trace, or None if this call is not sampled."""
+        if self.sample_rate <= 0.0 or (self.sample_rate < 1.0 and random.random() >= self.sample_rate):
+            return None
+        self.num_active += 1
+        return Trace(name)
+
+    def finish(self, trace: Trace):
+        trace.refs -= 1
+        if trace.refs:
+            return
+        self.num_active -= 1
+        self.recent.append(trace)
+        if self.trace_dir:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-writer")
+            path = os.path.join(self.trace_dir, f"trace-{trace.trace_id}.json")
+            self._writer.submit(self._write, path, [trace])
+
+    def export(self, traces: Iterable[Trace] = None) -> dict:
+        """Chrome trace JSON object for the given traces (default: the recent ones)."""
+        traces = list(self.recent) if traces is None else traces
+        return {"traceEvents": [e for t in traces for e in t.events()], "displayTimeUnit": "ms"}
+
+    def _write(self, path: str, traces: List[Trace]):
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.export(traces), f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.error("trace_write_failed", path=path, error=str(e))
+
+    def profile(self, traces: Optional[List[Trace]]):
+        """
+        Context for one step's kernels: torch.profiler when enabled and the
+        step carries sampled requests, otherwise a no-op.
+        """
+        if not traces or not self.torch_profiler:
+            return _NULL_CONTEXT
+        return self._profile(traces)
+
+    @contextlib.contextmanager
+    def _profile(self, traces: List[Trace]):
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        with profile(activities=activities) as prof:
+            entered = time.perf_counter()
+            yield
+        origin = _profiler_origin(prof, entered)
+        events = [
+            (e.name, origin + e.time_range.start / 1e6, origin + e.time_range.end / 1e6,
+             {"device": e.device_type.name, **({"input_shapes": e.input_shapes} if e.input_shapes else {})})
+            for e in prof.events()
+        ]
+        for trace in traces:
+            trace.track(TORCH_TID, "torch.profiler")
+            for name, start, end, args in events:
+                trace.add(name, start, end, TORCH_TID, **args)
+
+def _profiler_origin(prof, entered: float) -> float:
+    """perf_counter() time that torch.profiler event timestamps count from."""
+    try:
+        start_ns = prof.profiler.kineto_results.trace_start_ns() # Wall clock
+    except AttributeError:
+        return entered # Older torch: the first op lands close to the profiler start anyway
+    return start_ns / 1e9 + (time.perf_counter() - time.time())
+
+TRACER = Tracer()
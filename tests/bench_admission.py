@@ -0,0 +1,66 @@
+import time
+import random
+import asyncio
+import structlog
+import os
+import sys
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hyperserve.config import settings
+from hyperserve.serving.engine import HyperEngine
+
+structlog.configure(processors=[structlog.processors.JSONRenderer()])
+logger = structlog.get_logger()
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+async def run_case(mode, decode_fraction, num_requests=48, prompt_len=256, max_new=64,
+                   num_blocks=128, seed=0):
+    """
+    Overloads a small KV pool (every request alone needs a fifth of it) with
+    a mix of priorities, and reports throughput, per-priority latency and
+    how often running requests had to be preempted.
+    """
+    settings.MAX_GPU_BLOCKS = num_blocks
+    settings.PREEMPTION_MODE = mode
+    settings.ADMISSION_DECODE_FRACTION = decode_fraction
+    engine = HyperEngine()
+    rng = random.Random(seed)
+    prompts = [[rng.randint(1000, 30000) for _ in range(prompt_len)] for _ in range(num_requests)]
+    try:
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            engine.generate(p, max_new, priority=i % 2) for i, p in enumerate(prompts)
+        ])
+        elapsed = time.perf_counter() - start
+    finally:
+        engine.shutdown()
+
+    latency = {
+        priority: [r["metrics"]["latency_ms"] for i, r in enumerate(results) if i % 2 == priority]
+        for priority in (0, 1)
+    }
+    row = {
+        "mode": mode,
+        "decode_fraction": decode_fraction,
+        "requests": num_requests,
+        "tokens_per_s": round(num_requests * max_new / elapsed, 1),
+        "p99_ms_priority_0": _percentile(latency[0], 0.99),
+        "p99_ms_priority_1": _percentile(latency[1], 0.99),
+        "preemptions": engine.scheduler.num_preemptions,
+    }
+    logger.info("admission_bench", **row)
+    return row
+
+async def run_benchmark():
+    return [
+        await run_case(mode, fraction)
+        for mode in ("recompute", "swap")
+        for fraction in (0.0, 0.5, 1.0)
+    ]
+
+if __name__ == "__main__":
+    asyncio.run(run_benchmark())
@@ -0,0 +1,48 @@
+import os
+import sys
+import json
+import random
+import asyncio
+import tempfile
+import structlog
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hyperserve.config import settings
+from hyperserve.serving.engine import HyperEngine
+from hyperserve.serving.offline import BatchRunner
+
+structlog.configure(processors=[structlog.processors.JSONRenderer()])
+logger = structlog.get_logger()
+
+def write_input(path, num_prefixes=32, per_prefix=8, prefix_len=512, suffix_len=32, max_new=8, seed=0):
+    """Shuffled requests over shared system prompts that together overflow the KV pool."""
+    rng = random.Random(seed)
+    prefixes = [[rng.randint(1000, 30000) for _ in range(prefix_len)] for _ in range(num_prefixes)]
+    prompts = [p + [rng.randint(1000, 30000) for _ in range(suffix_len)] for p in prefixes for _ in range(per_prefix)]
+    rng.shuffle(prompts)
+    with open(path, "w") as f:
+        for i, prompt in enumerate(prompts):
+            f.write(json.dumps({"id": i, "prompt_ids": prompt, "max_new_tokens": max_new}) + "\n")
+
+async def run_case(order, input_path, output_path):
+    engine = HyperEngine()
+    try:
+        summary = await BatchRunner(engine, order=order).run(input_path, output_path, restart=True)
+    finally:
+        engine.shutdown()
+    row = {"order": order, "engine_steps": engine.num_steps, **summary}
+    logger.info("batch_bench", **row)
+    return row
+
+async def run_benchmark():
+    # A pool that holds ~half the distinct prefixes, and no host tier to fall back on
+    settings.MAX_GPU_BLOCKS = 512
+    settings.SWAP_HOST_BLOCKS = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, "requests.jsonl")
+        write_input(input_path)
+        return [await run_case(order, input_path, os.path.join(tmp, f"{order}.jsonl")) for order in ("input", "prefix")]
+
+if __name__ == "__main__":
+    asyncio.run(run_benchmark())
@@ -0,0 +1,69 @@
+import time
+import random
+import asyncio
+import structlog
+import os
+import sys
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hyperserve.config import settings
+from hyperserve.serving.engine import HyperEngine
+
+structlog.configure(processors=[structlog.processors.JSONRenderer()])
+logger = structlog.get_logger()
+
+def build_workload(num_requests, prompt_len, seed=0):
+    """Unique prompts (no prefix reuse), so both modes do the same prefill work."""
+    rng = random.Random(seed)
+    return [[rng.randint(1000, 30000) for _ in range(prompt_len)] for _ in range(num_requests)]
+
+async def _timed_stream(engine, prompt, max_new_tokens):
+    start = time.perf_counter()
+    stamps = []
+    async for _ in engine.generate_stream(prompt, max_new_tokens):
+        stamps.append(time.perf_counter())
+    gaps = [b - a for a, b in zip(stamps, stamps[1:])]
+    return stamps[0] - start, max(gaps, default=0.0)
+
+async def run_mode(mode, prompts, max_new_tokens, num_prefill_workers):
+    """
+    colocated:     every request runs in the engine's own batched loop.
+    disaggregated: every request is routed "remote" to the worker processes.
+    Worker startup is excluded by a warmup request.
+    """
+    settings.NUM_PREFILL_WORKERS = num_prefill_workers if mode == "disaggregated" else 0
+    engine = HyperEngine()
+    route = "remote" if mode == "disaggregated" else "local"
+    engine.router.route = lambda state: route # Pin the decision so both runs see identical work
+    try:
+        await engine.generate([1, 2, 3], 2) # Warmup (spawns workers)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[_timed_stream(engine, p, max_new_tokens) for p in prompts])
+        elapsed = time.perf_counter() - start
+    finally:
+        engine.shutdown()
+
+    ttfts = sorted(r[0] for r in results)
+    row = {
+        "mode": mode,
+        "requests": len(prompts),
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(prompts) / elapsed, 2),
+        "output_tokens_per_s": round(len(prompts) * max_new_tokens / elapsed, 1),
+        "ttft_p50_ms": round(ttfts[len(ttfts) // 2] * 1000, 1),
+        "max_decode_gap_ms": round(max(r[1] for r in results) * 1000, 1),
+    }
+    logger.info("disagg_bench", **row)
+    return row
+
+async def run_benchmark(num_requests=32, prompt_len=1024, max_new_tokens=32, num_prefill_workers=2):
+    prompts = build_workload(num_requests, prompt_len)
+    return [
+        await run_mode(mode, prompts, max_new_tokens, num_prefill_workers)
+        for mode in ("colocated", "disaggregated")
+    ]
+
+if __name__ == "__main__":
+    asyncio.run(run_benchmark())
@@ -0,0 +1,70 @@
+import time
+import random
+import asyncio
+import structlog
+import os
+import sys
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hyperserve.config import settings
+from hyperserve.router.dispatcher import ReplicaDispatcher
+
+structlog.configure(processors=[structlog.processors.JSONRenderer()])
+logger = structlog.get_logger()
+
+def build_workload(num_requests, num_docs, doc_len, suffix_len, zipf_s=1.1, seed=0):
+    """
+    Requests sharing one of num_docs long prefixes with Zipf popularity
+    (a few hot system prompts / documents), each with a unique suffix.
+    The working set is sized to exceed one replica but fit the cluster.
+    """
+    rng = random.Random(seed)
+    docs = [[rng.randint(1000, 30000) for _ in range(doc_len)] for _ in range(num_docs)]
+    weights = [1.0 / (rank + 1) ** zipf_s for rank in range(num_docs)]
+    return [
+        rng.choices(docs, weights)[0] + [rng.randint(1000, 30000) for _ in range(suffix_len)]
+        for _ in range(num_requests)
+    ]
+
+async def run_policy(policy, prompts, num_replicas, concurrency, max_new_tokens):
+    dispatcher = ReplicaDispatcher(num_replicas=num_replicas, policy=policy)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(prompt):
+        async with semaphore:
+            return await dispatcher.generate(prompt, max_new_tokens)
+
+    try:
+        start = time.perf_counter()
+        results = await asyncio.gather(*[one(p) for p in prompts])
+        elapsed = time.perf_counter() - start
+    finally:
+        dispatcher.shutdown()
+
+    stats = dispatcher.stats()
+    latencies = sorted(r["metrics"]["latency_ms"] for r in results)
+    row = {
+        "policy": policy,
+        "cluster_hit_rate": stats["cluster_hit_rate"],
+        "dispatched": stats["dispatched"],
+        "max_replica_share": round(max(stats["dispatched"]) / len(prompts), 3),
+        "elapsed_s": round(elapsed, 2),
+        "latency_p50_ms": latencies[len(latencies) // 2],
+        "latency_p99_ms": latencies[int(len(latencies) * 0.99) - 1],
+    }
+    logger.info("dispatch_bench", **row)
+    return row
+
+async def run_benchmark(num_replicas=4, num_requests=200, num_docs=32, doc_len=512, suffix_len=32,
+                        concurrency=16, max_new_tokens=4):
+    settings.MAX_GPU_BLOCKS = 512 # 8k tokens per replica vs a 16k-token working set
+    settings.SWAP_HOST_BLOCKS = 0
+    prompts = build_workload(num_requests, num_docs, doc_len, suffix_len)
+    return [
+        await run_policy(policy, prompts, num_replicas, concurrency, max_new_tokens)
+        for policy in ("prefix", "round_robin", "random")
+    ]
+
+if __name__ == "__main__":
+    asyncio.run(run_benchmark())
@@ -0,0 +1,68 @@
+import json
+import time
+import random
+import structlog
+import numpy as np
+import os
+import sys
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hyperserve.api import codec
+from hyperserve.api.server import BatchRequest, GenerateRequest
+
+structlog.configure(processors=[structlog.processors.JSONRenderer()])
+logger = structlog.get_logger()
+
+def _time(fn, repeats):
+    fn() # Warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+def run_case(prompt_len, batch_size=1, repeats=20, seed=0):
+    """
+    Server-side cost of turning one request body into engine-ready token
+    lists. "json_decoded" is FastAPI's default body path (json.loads, then
+    pydantic over Python ints); "json" validates the raw bytes in one pass;
+    "int32" is a raw view plus one tolist().
+    """
+    rng = random.Random(seed)
+    prompts = [[rng.randint(0, 31999) for _ in range(prompt_len)] for _ in range(batch_size)]
+    if batch_size == 1:
+        json_body = json.dumps({"prompt_ids": prompts[0]}).encode()
+        int32_body = np.asarray(prompts[0], dtype="<i4").tobytes()
+        parse_json = lambda: GenerateRequest.model_validate_json(json_body).prompt_ids
+        parse_dict = lambda: GenerateRequest.model_validate(json.loads(json_body)).prompt_ids
+        parse_int32 = lambda: [codec.decode_tokens(int32_body).tolist()]
+    else:
+        json_body = json.dumps({"prompts": prompts}).encode()
+        int32_body = codec.encode_token_batch(prompts)
+        parse_json = lambda: BatchRequest.model_validate_json(json_body).prompts
+        parse_dict = lambda: BatchRequest.model_validate(json.loads(json_body)).prompts
+        parse_int32 = lambda: [p.tolist() for p in codec.decode_token_batch(int32_body)]
+    assert parse_int32() == (prompts if batch_size > 1 else [parse_json()])
+
+    rows = []
+    for fmt, fn, body in (("json_decoded", parse_dict, json_body), ("json", parse_json, json_body),
+                          ("int32", parse_int32, int32_body)):
+        per_call = _time(fn, repeats)
+        row = {
+            "format": fmt,
+            "prompt_len": prompt_len,
+            "batch_size": batch_size,
+            "body_bytes": len(body),
+            "parse_ms": round(per_call * 1000, 3),
+            "ns_per_token": round(per_call * 1e9 / (prompt_len * batch_size), 1),
+        }
+        logger.info("ingest_bench", **row)
+        rows.append(row)
+    return rows
+
+def run_benchmark():
+    cases = [(1024, 1), (8192, 1), (32768, 1), (1024, 64)]
+    return [row for prompt_len, batch in cases for row in run_case(prompt_len, batch)]
+
+if __name__ == "__main__":
+    run_benchmark()
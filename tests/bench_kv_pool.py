@@ -0,0 +1,84 @@
+import time
+import random
+import structlog
+import torch
+import os
+import sys
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hyperserve.memory.kv_pool import KVPool, StagingBuffer
+from hyperserve.serving.model import KVProjection
+
+structlog.configure(processors=[structlog.processors.JSONRenderer()])
+logger = structlog.get_logger()
+
+def _time(fn, repeats):
+    fn() # Warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+def run_case(batch_size, new_tokens, context_len, repeats=200, seed=0):
+    """
+    Per-step host cost of everything around the attention call: writing
+    new K/V into their slots and building the padded block table, lengths
+    and query. "per_step" is the previous path (fresh tensors from Python
+    lists every call); "pool" stages into the preallocated KVPool buffers.
+    """
+    pool = KVPool()
+    projection = KVProjection(pool)
+    query_buf = StagingBuffer(batch_size * new_tokens, (pool.num_heads, pool.head_dim), pool.dtype, random=True)
+    rng = random.Random(seed)
+    blocks_per_seq = -(-(context_len + new_tokens) // pool.block_size)
+    free = list(range(pool.num_blocks))
+    rng.shuffle(free)
+    seqs = []
+    for i in range(batch_size):
+        block_ids = [free[(i * blocks_per_seq + j) % pool.num_blocks] for j in range(blocks_per_seq)]
+        tokens = [rng.randint(0, 31999) for _ in range(new_tokens)]
+        seqs.append((tokens, block_ids, context_len))
+    bs, heads, dim = pool.block_size, pool.num_heads, pool.head_dim
+
+    legacy = [torch.zeros(pool.num_blocks * bs, heads, dim) for _ in range(2 * pool.num_layers)]
+
+    def per_step():
+        for _, block_ids, start in seqs:
+            positions = torch.arange(start, start + new_tokens)
+            slots = torch.tensor(block_ids)[positions // bs] * bs + positions % bs
+            for cache in legacy:
+                cache[slots] = torch.randn(new_tokens, heads, dim)
+        context_lens = torch.tensor([start + new_tokens for _, _, start in seqs])
+        max_blocks = max(len(ids) for _, ids, _ in seqs)
+        block_table = torch.tensor([ids + [-1] * (max_blocks - len(ids)) for _, ids, _ in seqs])
+        query = torch.randn(batch_size, new_tokens, heads, dim)
+        return context_lens, block_table, query
+
+    def pooled():
+        projection.write(pool.stage_tokens(seqs))
+        context_lens = pool.context_lens([start + new_tokens for _, _, start in seqs])
+        block_table = pool.block_table([ids for _, ids, _ in seqs])
+        query = query_buf.take(batch_size * new_tokens)
+        return context_lens, block_table, query
+
+    rows = []
+    for path, fn in (("per_step", per_step), ("pool", pooled)):
+        per_call = _time(fn, repeats)
+        row = {
+            "path": path,
+            "batch_size": batch_size,
+            "new_tokens": new_tokens,
+            "context_len": context_len,
+            "us_per_step": round(per_call * 1e6, 1),
+        }
+        logger.info("kv_pool_bench", **row)
+        rows.append(row)
+    return rows
+
+def run_benchmark():
+    cases = [(8, 1, 512), (64, 1, 512), (64, 1, 2048), (4, 512, 0)]
+    return [row for batch, new, ctx in cases for row in run_case(batch, new, ctx)]
+
+if __name__ == "__main__":
+    run_benchmark()
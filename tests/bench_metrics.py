@@ -0,0 +1,54 @@
+import time
+import structlog
+import os
+import sys
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hyperserve.metrics import Counter, Gauge, Histogram, Registry
+
+structlog.configure(processors=[structlog.processors.JSONRenderer()])
+logger = structlog.get_logger()
+
+def time_per_call(fn, arg, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn(arg)
+    return time.perf_counter() - start
+
+def run_benchmark(n=1_000_000):
+    """
+    Per-event cost of the hot-path instruments, net of loop overhead
+    (a call to a no-op function of the same shape).
+    """
+    registry = Registry()
+    histogram = Histogram("bench_seconds", "bench", registry=registry)
+    labelled = Histogram("bench_labelled_seconds", "bench", ["phase"], registry=registry).labels(phase="decode")
+    counter = Counter("bench_total", "bench", registry=registry)
+    gauge = Gauge("bench_gauge", "bench", registry=registry)
+
+    baseline = time_per_call(lambda _: None, 0.001, n)
+    rows = []
+    for name, fn, arg in (
+        ("counter_inc", counter.inc, 1),
+        ("gauge_set", gauge.set, 1.0),
+        ("histogram_observe", histogram.observe, 0.003),
+        ("labelled_histogram_observe", labelled.observe, 0.003),
+        ("timed_observe", lambda _: histogram.observe(time.perf_counter() - time.perf_counter()), None),
+    ):
+        elapsed = time_per_call(fn, arg, n)
+        row = {
+            "instrument": name,
+            "ns_per_event": round((elapsed - baseline) / n * 1e9, 1),
+            "ns_per_event_with_call": round(elapsed / n * 1e9, 1),
+        }
+        logger.info("metrics_bench", **row)
+        rows.append(row)
+
+    start = time.perf_counter()
+    registry.expose()
+    logger.info("metrics_bench", instrument="expose", us=round((time.perf_counter() - start) * 1e6, 1))
+    return rows
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,136 @@
+import time
+import random
+import structlog
+import os
+import sys
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hyperserve.memory.allocator import BlockAllocator
+from hyperserve.memory.radix_cache import RadixCache, hash_blocks, hash_prompts
+
+structlog.configure(processors=[structlog.processors.JSONRenderer()])
+logger = structlog.get_logger()
+
+BLOCK_SIZE = 16
+
+class SlicingWalkCache(RadixCache):
+    """The previous _walk, kept as a reference: re-slices the prompt per edge, compares per token."""
+    def _walk(self, tokens, node, now):
+        matched_len = 0
+        curr_tokens = tokens
+        while len(curr_tokens) >= self.block_size:
+            child = node.children.get(self._child_key(curr_tokens))
+            if child is None:
+                break
+            n = min(len(curr_tokens), len(child.key))
+            match_size = 0
+            while match_size < n and curr_tokens[match_size] == child.key[match_size]:
+                match_size += 1
+            match_size -= match_size % self.block_size
+            diverged = match_size < len(child.key)
+            if diverged:
+                child = self._split_node(child, match_size)
+            node = child
+            matched_len += match_size
+            curr_tokens = curr_tokens[match_size:]
+            self._touch(node, now)
+            if diverged:
+                break
+        return node, matched_len
+
+def check_split_and_merge(block_size=4):
+    """
+    Radix semantics at block granularity, with and without the hash index:
+    a second prompt diverging inside an edge splits it at the last shared
+    block boundary and shares those blocks; evicting that branch merges the
+    single-child chain back; a lookup diverging mid-block matches only the
+    whole blocks before the divergence.
+    """
+    failures = []
+    for hash_index in (False, True):
+        cache = RadixCache(BlockAllocator(16), block_size=block_size, hash_index=hash_index)
+        a = list(range(1, 17))         # 4 blocks
+        b = a[:8] + list(range(50, 58)) # Shares a's first 2 blocks
+        cache.insert(a)
+        cache.insert(b)
+        node_a, matched_a = cache.match_prefix(a)
+        node_b, matched_b = cache.match_prefix(b)
+        shared = cache.get_block_ids(node_a)[:2] == cache.get_block_ids(node_b)[:2]
+        aligned = all(len(n.key) == len(n.value) * block_size for n in cache._iter_nodes())
+        if (matched_a, matched_b, cache.num_nodes(), shared, aligned) != (16, 16, 3, True, True):
+            failures.append(("split", hash_index, matched_a, matched_b, cache.num_nodes(), shared, aligned))
+
+        cache.match_prefix(a) # b's tail becomes the least recently used leaf
+        cache.evict(2)
+        merged = cache.num_nodes() # Before b's lookup splits the edge again
+        if (merged, cache.match_prefix(a)[1], cache.match_prefix(b)[1]) != (1, 16, 8):
+            failures.append(("merge", hash_index, merged))
+
+        _, matched = cache.match_prefix(a[:6] + [99] * 6) # Diverges inside block 2
+        aligned = all(len(n.key) == len(n.value) * block_size for n in cache._iter_nodes())
+        if (matched, cache.match_prefix(a)[1], aligned) != (4, 16, True):
+            failures.append(("mid_block", hash_index, matched, aligned))
+
+    passed = not failures
+    logger.info("radix_split_merge_correctness", passed=passed, failures=[str(f) for f in failures])
+    return passed
+
+def build_cache(mode, prompts):
+    num_blocks = sum(len(p) for p in prompts) // BLOCK_SIZE + 1
+    cls = SlicingWalkCache if mode == "slicing_walk" else RadixCache
+    cache = cls(BlockAllocator(num_blocks), block_size=BLOCK_SIZE, hash_index=mode.startswith("hash_index"))
+    for p in prompts:
+        cache.insert(p)
+    return cache
+
+def time_lookups(fn, queries, repeats):
+    fn(queries) # Warm-up: performs the one-off splits at each divergence point
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(queries)
+    return (time.perf_counter() - start) / (repeats * len(queries))
+
+def run_case(prompt_len, tree_prompts, num_queries=16, repeats=5, seed=0):
+    """
+    tree_prompts cached prompts sharing a system prefix of half the prompt
+    length; each query extends a cached prompt's first 3/4 with a new tail,
+    so it walks the shared prefix plus one private edge and then diverges.
+    """
+    rng = random.Random(seed)
+    rand = lambda n: [rng.randint(1000, 30000) for _ in range(n)]
+    system = rand(prompt_len // 2)
+    prompts = [system + rand(prompt_len - len(system)) for _ in range(tree_prompts)]
+    queries = [rng.choice(prompts)[:prompt_len * 3 // 4] + rand(prompt_len // 4) for _ in range(num_queries)]
+    queries.sort() # Admission waves are cheapest to batch in prefix order
+    hashes = [hash_blocks(q, BLOCK_SIZE) for q in queries]
+
+    rows = []
+    for mode in ("slicing_walk", "offset_walk", "hash_index", "hash_index_prehashed", "hash_index_batch_hashed"):
+        cache = build_cache(mode, prompts)
+        if mode == "hash_index_prehashed":
+            fn = lambda qs: [cache.lookup(q, h) for q, h in zip(qs, hashes)]
+        elif mode == "hash_index_batch_hashed":
+            fn = lambda qs: [cache.lookup(q, h) for q, h in zip(qs, hash_prompts(qs, BLOCK_SIZE))]
+        else:
+            fn = lambda qs: [cache.lookup(q) for q in qs]
+        per_lookup = time_lookups(fn, queries, repeats)
+        row = {
+            "mode": mode,
+            "prompt_len": prompt_len,
+            "tree_prompts": tree_prompts,
+            "tree_nodes": cache.num_nodes(),
+            "us_per_lookup": round(per_lookup * 1e6, 1),
+            "matched_tokens": cache.lookup(queries[0]).matched_len,
+        }
+        logger.info("radix_match_bench", **row)
+        rows.append(row)
+    return rows
+
+def run_benchmark(prompt_lens=(1024, 4096, 32768), tree_sizes=(16, 128)):
+    return [row for n in prompt_lens for t in tree_sizes for row in run_case(n, t)]
+
+if __name__ == "__main__":
+    if not check_split_and_merge():
+        sys.exit(1)
+    run_benchmark()
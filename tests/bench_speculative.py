@@ -0,0 +1,52 @@
+import time
+import random
+import asyncio
+import structlog
+import os
+import sys
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hyperserve.config import settings
+from hyperserve.serving.engine import HyperEngine
+
+structlog.configure(processors=[structlog.processors.JSONRenderer()])
+logger = structlog.get_logger()
+
+async def run_case(k, num_agents=8, num_turns=4, prompt_len=512, max_new=128, seed=0):
+    """
+    Agent loops: each agent re-sends the same context every turn, so from
+    the second turn on its output replays a continuation already in the
+    radix tree. Reports decode steps, throughput and draft acceptance.
+    """
+    settings.SPECULATIVE_TOKENS = k
+    engine = HyperEngine()
+    rng = random.Random(seed)
+    contexts = [[rng.randint(1000, 30000) for _ in range(prompt_len)] for _ in range(num_agents)]
+    results = []
+    try:
+        start = time.perf_counter()
+        for _ in range(num_turns):
+            results += await asyncio.gather(*[engine.generate(c, max_new) for c in contexts])
+        elapsed = time.perf_counter() - start
+    finally:
+        await engine.aclose()
+
+    spec = [r["metrics"]["speculative"] for r in results]
+    drafted = sum(s["drafted_tokens"] for s in spec)
+    row = {
+        "speculative_tokens": k,
+        "requests": len(results),
+        "engine_steps": engine.num_steps,
+        "tokens_per_s": round(len(results) * max_new / elapsed, 1),
+        "acceptance_rate": round(sum(s["accepted_tokens"] for s in spec) / drafted, 4) if drafted else None,
+        "mean_speedup": round(sum(s["speedup"] for s in spec) / len(spec), 3),
+    }
+    logger.info("speculative_bench", **row)
+    return row
+
+async def run_benchmark():
+    return [await run_case(k) for k in (0, 2, 4, 8)]
+
+if __name__ == "__main__":
+    asyncio.run(run_benchmark())
@@ -0,0 +1,173 @@
+import random
+import asyncio
+import structlog
+import torch
+import os
+import sys
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hyperserve.config import settings
+from hyperserve.memory.allocator import BlockAllocator
+from hyperserve.memory.eviction import get_eviction_policy
+from hyperserve.memory.radix_cache import RadixCache, hash_blocks
+from hyperserve.memory.swap import SwapSpace
+from hyperserve.serving.engine import HyperEngine
+
+structlog.configure(processors=[structlog.processors.JSONRenderer()])
+logger = structlog.get_logger()
+
+async def run_tier(tier, system_len=2048, num_flush=40, flush_len=512, seed=0):
+    """
+    Caches a long system prompt, floods the device pool with unrelated
+    prompts until it is evicted, then measures TTFT of the next request
+    sharing it: recomputed (no swap tier) vs read back from host RAM / disk.
+    """
+    settings.SWAP_HOST_BLOCKS = 1024 if tier == "host" else 0
+    settings.SWAP_DISK_BLOCKS = 1024 if tier == "disk" else 0
+    engine = HyperEngine()
+    rng = random.Random(seed)
+    system = [rng.randint(1000, 30000) for _ in range(system_len)]
+    try:
+        await engine.generate(system + [1], 1)
+        for _ in range(num_flush):
+            await engine.generate([rng.randint(1000, 30000) for _ in range(flush_len)], 1)
+
+        metrics = (await engine.generate(system + [2], 1))["metrics"]
+    finally:
+        engine.shutdown()
+
+    row = {
+        "tier": tier,
+        "system_tokens": system_len,
+        "tokens_saved": metrics["tokens_saved"],
+        "matched_blocks_by_tier": metrics["matched_blocks_by_tier"],
+        "ttft_ms": metrics["ttft_ms"],
+    }
+    logger.info("swap_tier_bench", **row)
+    return row
+
+def tree_problems(cache, prefixes):
+    """
+    Where a RadixCache's tree and block-hash index disagree with what was
+    inserted: every root-to-node path must be a block-aligned prefix of an
+    inserted sequence (prefixes), and each node's chained block hashes must
+    match its path and map back to it in the index.
+    """
+    problems = []
+    indexed = 0
+    stack = [(child, (), 0) for child in cache.root.children.values()]
+    while stack:
+        node, path, prev_hash = stack.pop()
+        path += tuple(node.key)
+        if len(node.key) != len(node.value) * cache.block_size:
+            problems.append(("key_value_mismatch", path))
+        if path not in prefixes:
+            problems.append(("never_inserted", path))
+        if cache._hash_index is not None:
+            hashes = hash_blocks(list(node.key), cache.block_size, prev_hash)
+            if node.block_hashes != hashes or any(cache._hash_index.get(h) is not node for h in hashes):
+                problems.append(("hash_index_mismatch", path))
+            indexed += len(hashes)
+            prev_hash = hashes[-1] if hashes else prev_hash
+        stack.extend((child, path, prev_hash) for child in node.children.values())
+    if cache._hash_index is not None and indexed != len(cache._hash_index):
+        problems.append(("stale_index_entries", len(cache._hash_index) - indexed))
+    return problems
+
+def check_small_swap_eviction(ops=2000, block_size=2, num_blocks=16, swap_slots=2, seed=0):
+    """
+    Random inserts, evictions and lookups over a tiny vocabulary (so paths
+    share prefixes and split) with fewer swap slots than eviction takes:
+    tails are then dropped while demoted children still hang off them. The
+    tree, its hash index and match_prefix must stay consistent throughout.
+    """
+    rng = random.Random(seed)
+    problems = []
+    for hash_index in (False, True):
+        allocator = BlockAllocator(num_blocks)
+        swap = SwapSpace(torch.zeros((num_blocks, 1, 2, block_size, 1, 4)), num_host_blocks=swap_slots,
+                         num_disk_blocks=0)
+        cache = RadixCache(allocator, block_size=block_size, swap=swap, hash_index=hash_index)
+        prefixes = set()
+        for _ in range(ops):
+            tokens = [rng.randint(1, 3) for _ in range(block_size * rng.randint(1, 6))]
+            action = rng.random()
+            if action < 0.4:
+                cache.insert(tokens)
+                prefixes.update(tuple(tokens[:end]) for end in range(block_size, len(tokens) + 1, block_size))
+            elif action < 0.7:
+                cache.evict(rng.randint(1, 4))
+            else:
+                _, matched = cache.match_prefix(tokens)
+                if matched and tuple(tokens[:matched]) not in prefixes:
+                    problems.append(("false_hit", tuple(tokens[:matched])))
+            problems += tree_problems(cache, prefixes)
+            if problems:
+                break
+        swap.close()
+
+    passed = not problems
+    logger.info("small_swap_eviction_consistency", ops=ops, swap_slots=swap_slots, passed=passed,
+                problems=[str(p) for p in problems[:5]])
+    return passed
+
+def check_eviction_order_and_pins(block_size=2):
+    """
+    Three cached prompts whose access order, hit counts and sizes make
+    each policy pick a different victim: lru the least recently used (y),
+    lfu the least hit (x), size the fewest hits per block (z). Then the
+    victim is pinned: eviction must take everything else and leave its
+    path cached until it is unpinned. The tree and hash index must stay
+    consistent after every eviction.
+    """
+    x = [1] * (2 * block_size)   # 2 blocks, 1 hit
+    y = [2] * (2 * block_size)   # 2 blocks, 2 hits, least recently used
+    z = [3] * (8 * block_size)   # 8 blocks, 3 hits, most recently used
+    victims = {"lru": y, "lfu": x, "size": z}
+    prefixes = {tuple(t[:end]) for t in (x, y, z) for end in range(block_size, len(t) + 1, block_size)}
+    failures = []
+    for policy, victim in victims.items():
+        for hash_index in (False, True):
+            cache = RadixCache(BlockAllocator(32), block_size=block_size, policy=get_eviction_policy(policy),
+                               hash_index=hash_index)
+            for tokens in (x, y, z):
+                cache.insert(tokens)
+            for tokens in (y, y, x, z, z, z):
+                cache.match_prefix(tokens)
+            pinned = cache.pin(victim)
+
+            cache.evict(len(victim) // block_size) # Must skip the pinned victim
+            problems = tree_problems(cache, prefixes)
+            cache.evict(32)                        # Everything unpinned
+            problems += tree_problems(cache, prefixes)
+            kept = [t for t in (x, y, z) if cache.match_prefix(t)[1] == len(t)]
+            cache.unlock(pinned)
+            cache.evict(32)
+            problems += tree_problems(cache, prefixes)
+            if kept != [victim] or cache.num_nodes() or problems:
+                failures.append((policy, hash_index, "pinned", len(kept), cache.num_nodes(), problems[:2]))
+
+            # Unpinned, the policy's victim goes first
+            cache = RadixCache(BlockAllocator(32), block_size=block_size, policy=get_eviction_policy(policy),
+                               hash_index=hash_index)
+            for tokens in (x, y, z):
+                cache.insert(tokens)
+            for tokens in (y, y, x, z, z, z):
+                cache.match_prefix(tokens)
+            cache.evict(len(victim) // block_size)
+            evicted = [t[0] for t in (x, y, z) if cache.match_prefix(t)[1] == 0]
+            if evicted != [victim[0]] or tree_problems(cache, prefixes):
+                failures.append((policy, hash_index, "order", evicted))
+
+    passed = not failures
+    logger.info("eviction_order_and_pins_correctness", passed=passed, failures=[str(f) for f in failures])
+    return passed
+
+async def run_benchmark():
+    return [await run_tier(tier) for tier in ("none", "host", "disk")]
+
+if __name__ == "__main__":
+    if not (check_eviction_order_and_pins() and check_small_swap_eviction()):
+        sys.exit(1)
+    asyncio.run(run_benchmark())
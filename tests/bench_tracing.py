@@ -0,0 +1,54 @@
+import time
+import random
+import asyncio
+import structlog
+import os
+import sys
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hyperserve import tracing
+from hyperserve.serving.engine import HyperEngine
+
+structlog.configure(processors=[structlog.processors.JSONRenderer()])
+logger = structlog.get_logger()
+
+async def run_case(sample_rate, torch_profiler=False, num_requests=32, prompt_len=64, max_new_tokens=32, seed=0):
+    """
+    One burst of short requests decoding together; reports wall time per
+    engine step and the span volume, so the cost of tracing (off, sampled,
+    everything, with torch.profiler) reads against an untraced run.
+    """
+    tracing.TRACER = tracer = tracing.Tracer(sample_rate, trace_dir="", torch_profiler=torch_profiler,
+                                             keep=num_requests)
+    engine = HyperEngine()
+    rng = random.Random(seed)
+    prompts = [[rng.randint(0, 31999) for _ in range(prompt_len)] for _ in range(num_requests)]
+    await engine.generate(prompts[0], 2, trace=None) # Warm-up, never traced
+    steps = engine.num_steps
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*[engine.generate(p, max_new_tokens) for p in prompts])
+    finally:
+        engine.shutdown()
+    elapsed = time.perf_counter() - start
+    steps = engine.num_steps - steps
+
+    row = {
+        "sample_rate": sample_rate,
+        "torch_profiler": torch_profiler,
+        "steps": steps,
+        "ms_per_step": round(elapsed * 1000 / steps, 3),
+        "traces": len(tracer.recent),
+        "spans": sum(len(t.spans) for t in tracer.recent),
+        "export_kb": round(len(str(tracer.export())) / 1024, 1),
+    }
+    logger.info("tracing_bench", **row)
+    return row
+
+async def run_benchmark():
+    cases = [(0.0, False), (0.05, False), (1.0, False), (0.05, True)]
+    return [await run_case(rate, prof) for rate, prof in cases]
+
+if __name__ == "__main__":
+    asyncio.run(run_benchmark())
@@ -1,67 +1,335 @@
+import argparse
 import asyncio
-import aiohttp
+import json
 import time
 import random
-import pandas as pd
+import numpy as np
 import structlog
 import os
 import sys
 
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 # Configure structured logging
 structlog.configure(processors=[structlog.processors.JSONRenderer()])
 logger = structlog.get_logger()
 
-SERVER_URL = "http://127.0.0.1:8000/v1/chat/completions"
-SYSTEM_PREFIX = [101, 102, 103]
+SERVER_URL = "http://127.0.0.1:8000"
+VOCAB = (1000, 30000)
+
+# Metrics compared against a baseline: (key, higher_is_better)
+REGRESSION_KEYS = (
+    ("ttft_p99_ms", False),
+    ("tpot_p99_ms", False),
+    ("latency_p99_ms", False),
+    ("goodput_rps", True),
+    ("hit_rate", True),
+)
+
+def _tokens(rng, n):
+    return [rng.randint(*VOCAB) for _ in range(n)]
+
+# --- Workload profiles ---
+# Each profile hands out (prompt, max_new_tokens, handle) at arrival time and
+# is told the outcome via complete(handle, output_ids), so stateful profiles
+# (chat history, agent trajectories) build on what was actually generated.
+
+class ChatProfile:
+    """Multi-turn chat: a shared system prompt, then each session resends its whole history."""
+    name = "chat"
+
+    def __init__(self, rng, num_sessions=16, system_len=256, max_history=2048, max_new_tokens=32):
+        self.rng = rng
+        self.system = _tokens(rng, system_len)
+        self.sessions = [list(self.system) for _ in range(num_sessions)]
+        self.max_history = max_history
+        self.max_new_tokens = max_new_tokens
+
+    def next_request(self):
+        sid = self.rng.randrange(len(self.sessions))
+        if len(self.sessions[sid]) > self.max_history:
+            self.sessions[sid] = list(self.system) # New conversation
+        prompt = self.sessions[sid] + _tokens(self.rng, self.rng.randint(32, 96))
+        return prompt, self.max_new_tokens, (sid, prompt)
+
+    def complete(self, handle, output_ids):
+        sid, prompt = handle
+        self.sessions[sid] = prompt + output_ids
+
+class RAGProfile:
+    """Retrieval-augmented QA: a few shared documents (Zipf-popular) plus a fresh question."""
+    name = "rag"
+
+    def __init__(self, rng, num_docs=24, doc_len=768, docs_per_query=2, system_len=128,
+                 max_new_tokens=32, zipf_s=1.1):
+        self.rng = rng
+        self.system = _tokens(rng, system_len)
+        self.docs = [_tokens(rng, doc_len) for _ in range(num_docs)]
+        self.weights = [1.0 / (rank + 1) ** zipf_s for rank in range(num_docs)]
+        self.docs_per_query = docs_per_query
+        self.max_new_tokens = max_new_tokens
+
+    def next_request(self):
+        docs = self.rng.choices(range(len(self.docs)), self.weights, k=self.docs_per_query)
+        prompt = list(self.system)
+        for d in sorted(set(docs)): # Retrievers return documents in a stable order
+            prompt += self.docs[d]
+        return prompt + _tokens(self.rng, 32), self.max_new_tokens, None
+
+    def complete(self, handle, output_ids):
+        pass
+
+class AgentProfile:
+    """Agent loops: a long shared tool spec, then a trajectory of tool calls and observations."""
+    name = "agent"
+
+    def __init__(self, rng, num_agents=8, tools_len=1024, max_trajectory=3072, max_new_tokens=24):
+        self.rng = rng
+        self.tools = _tokens(rng, tools_len)
+        self.trajectories = [self._new_task() for _ in range(num_agents)]
+        self.max_trajectory = max_trajectory
+        self.max_new_tokens = max_new_tokens
+
+    def _new_task(self):
+        return self.tools + _tokens(self.rng, 64)
+
+    def next_request(self):
+        aid = self.rng.randrange(len(self.trajectories))
+        if len(self.trajectories[aid]) > self.max_trajectory:
+            self.trajectories[aid] = self._new_task()
+        return list(self.trajectories[aid]), self.max_new_tokens, aid
+
+    def complete(self, aid, output_ids):
+        # Tool call, then the tool's observation, both part of the next step's context
+        self.trajectories[aid] = self.trajectories[aid] + output_ids + _tokens(self.rng, self.rng.randint(64, 128))
+
+PROFILES = {p.name: p for p in (ChatProfile, RAGProfile, AgentProfile)}
+
+# --- Arrival processes (open loop: arrivals never wait for completions) ---
+
+def arrival_times(num_requests, rate, pattern, rng, burstiness=0.25):
+    """
+    poisson: exponential inter-arrivals at `rate` req/s.
+    bursty:  Gamma inter-arrivals with the same mean but shape `burstiness`
+             (< 1), i.e. coefficient of variation 1/sqrt(burstiness).
+    """
+    if pattern == "poisson":
+        gaps = [rng.expovariate(rate) for _ in range(num_requests)]
+    elif pattern == "bursty":
+        gaps = [rng.gammavariate(burstiness, 1.0 / (rate * burstiness)) for _ in range(num_requests)]
+    else:
+        raise ValueError(f"Unknown arrival pattern '{pattern}'")
+    return np.cumsum(gaps).tolist()
+
+# --- Targets ---
 
-async def send_request(session, req_id, tokens, req_type):
+class InProcessTarget:
+    """Calls the dispatcher (and so HyperEngine) directly: no server, no network."""
+    def __init__(self, num_replicas=1):
+        from hyperserve.router.dispatcher import ReplicaDispatcher
+        self.dispatcher = ReplicaDispatcher(num_replicas=num_replicas)
+
+    async def send(self, prompt, max_new_tokens):
+        result = await self.dispatcher.generate(prompt, max_new_tokens)
+        return 200, result
+
+    async def occupancy(self):
+        return float(np.mean([r.load_metric for r in self.dispatcher.replicas]))
+
+    async def close(self):
+        self.dispatcher.shutdown()
+
+class HTTPTarget:
+    """Talks to a running server; needs aiohttp."""
+    def __init__(self, base_url=SERVER_URL):
+        import aiohttp
+        self.base_url = base_url
+        self.session = aiohttp.ClientSession()
+
+    async def send(self, prompt, max_new_tokens):
+        async with self.session.post(f"{self.base_url}/v1/chat/completions",
+                                     json={"prompt_ids": prompt, "max_new_tokens": max_new_tokens}) as resp:
+            return resp.status, await resp.json()
+
+    async def occupancy(self):
+        async with self.session.get(f"{self.base_url}/health") as resp:
+            return (await resp.json())["memory"]["occupancy"]
+
+    async def close(self):
+        await self.session.close()
+
+# --- Runner ---
+
+async def _sample_occupancy(target, samples, interval=0.05):
+    while True:
+        try:
+            samples.append(await target.occupancy())
+        except Exception as e:
+            logger.warning("occupancy_sample_failed", error=str(e))
+        await asyncio.sleep(interval)
+
+async def _one(target, profile, req_id, arrival_s):
+    prompt, max_new_tokens, handle = profile.next_request()
     start = time.perf_counter()
+    record = {
+        "id": req_id, "profile": profile.name, "arrival_s": round(arrival_s, 4),
+        "prompt_tokens": len(prompt), "output_tokens": 0,
+        "latency_ms": 0.0, "e2e_ms": 0.0, "ttft_ms": None, "tpot_ms": None, "hit_rate": 0.0,
+    }
     try:
-        async with session.post(SERVER_URL, json={"prompt_ids": tokens}) as resp:
-            data = await resp.json()
-            end = time.perf_counter()
-            
-            # Safe metrics extraction
-            metrics = data.get("metrics", {})
-            return {
-                "id": req_id,
-                "type": req_type,
-                "latency_ms": (end - start) * 1000,
-                "hit_rate": metrics.get("cache_hit_rate", 0),
-                "status": resp.status
-            }
+        status, data = await target.send(prompt, max_new_tokens)
     except Exception as e:
         # Fail gracefully
-        return {
-            "id": req_id, "type": req_type, "latency_ms": 0, "hit_rate": 0, "status": 500, "error": str(e)
-        }
+        record.update(status=500, error=str(e), type="Cold (Uncached)")
+        return record
+
+    record["e2e_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    record["status"] = status
+    if status == 200:
+        metrics = data.get("metrics", {})
+        output_ids = data.get("output_ids", [])
+        profile.complete(handle, output_ids)
+        record.update(
+            output_tokens=len(output_ids),
+            latency_ms=metrics.get("latency_ms", record["e2e_ms"]),
+            ttft_ms=metrics.get("ttft_ms"),
+            hit_rate=metrics.get("cache_hit_rate", 0.0),
+        )
+        if record["ttft_ms"] is not None and len(output_ids) > 1:
+            record["tpot_ms"] = round((record["latency_ms"] - record["ttft_ms"]) / (len(output_ids) - 1), 3)
+    record["type"] = "Warm (Cached)" if record["hit_rate"] > 0 else "Cold (Uncached)"
+    return record
 
-async def run_benchmark(num_requests=100):
+async def run_load(target, profile, arrivals):
+    """Fires every request at its arrival time, regardless of earlier ones finishing."""
+    occupancy = []
+    sampler = asyncio.ensure_future(_sample_occupancy(target, occupancy))
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    tasks = []
+    try:
+        for req_id, t in enumerate(arrivals):
+            delay = start + t - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(_one(target, profile, req_id, t)))
+        records = await asyncio.gather(*tasks)
+    finally:
+        sampler.cancel()
+    return records, loop.time() - start, occupancy
+
+def _pct(values, q):
+    return round(float(np.percentile(values, q)), 2) if values else None
+
+def summarize(records, duration_s, occupancy, slo_ttft_ms, slo_tpot_ms):
+    ok = [r for r in records if r["status"] == 200]
+    ttft = [r["ttft_ms"] for r in ok if r["ttft_ms"] is not None]
+    tpot = [r["tpot_ms"] for r in ok if r["tpot_ms"] is not None]
+    latency = [r["latency_ms"] for r in ok]
+    good = [
+        r for r in ok
+        if r["ttft_ms"] is not None and r["ttft_ms"] <= slo_ttft_ms
+        and (r["tpot_ms"] is None or r["tpot_ms"] <= slo_tpot_ms)
+    ]
+    prompt_tokens = sum(r["prompt_tokens"] for r in ok)
+    return {
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "duration_s": round(duration_s, 3),
+        "throughput_rps": round(len(ok) / duration_s, 3),
+        "output_tokens_per_s": round(sum(r["output_tokens"] for r in ok) / duration_s, 1),
+        "ttft_p50_ms": _pct(ttft, 50), "ttft_p99_ms": _pct(ttft, 99),
+        "tpot_p50_ms": _pct(tpot, 50), "tpot_p99_ms": _pct(tpot, 99),
+        "latency_p50_ms": _pct(latency, 50), "latency_p99_ms": _pct(latency, 99),
+        "goodput_rps": round(len(good) / duration_s, 3),
+        "slo_attainment": round(len(good) / len(records), 4) if records else 0.0,
+        "hit_rate": round(sum(r["hit_rate"] * r["prompt_tokens"] for r in ok) / prompt_tokens, 4) if prompt_tokens else 0.0,
+        "occupancy_mean": round(float(np.mean(occupancy)), 4) if occupancy else None,
+        "occupancy_max": round(float(np.max(occupancy)), 4) if occupancy else None,
+    }
+
+def compare_to_baseline(summary, baseline, tolerance):
+    """Returns the regressed metrics (worse than baseline by more than tolerance, relative)."""
+    regressions = []
+    for key, higher_is_better in REGRESSION_KEYS:
+        new, old = summary.get(key), baseline.get(key)
+        if new is None or not old:
+            continue
+        change = (new - old) / abs(old)
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append({"metric": key, "baseline": old, "current": new, "change": round(change, 4)})
+    return regressions
+
+async def run_suite(num_requests=100, profile="rag", arrival="poisson", rate=4.0, mode="inprocess",
+                    replicas=1, slo_ttft_ms=1000.0, slo_tpot_ms=100.0, seed=0, url=SERVER_URL):
+    rng = random.Random(seed)
+    workload = PROFILES[profile](rng)
+    arrivals = arrival_times(num_requests, rate, arrival, rng)
+    target = InProcessTarget(replicas) if mode == "inprocess" else HTTPTarget(url)
+    logger.info("benchmark_started", requests=num_requests, profile=profile, arrival=arrival, rate=rate, mode=mode)
+    try:
+        records, duration_s, occupancy = await run_load(target, workload, arrivals)
+    finally:
+        await target.close()
+
+    summary = summarize(records, duration_s, occupancy, slo_ttft_ms, slo_tpot_ms)
+    summary.update(profile=profile, arrival=arrival, rate=rate, mode=mode, replicas=replicas,
+                   slo_ttft_ms=slo_ttft_ms, slo_tpot_ms=slo_tpot_ms, seed=seed)
+    logger.info("benchmark_summary", **summary)
+    return records, summary
+
+async def run_benchmark(num_requests=100, **kwargs):
     """
-    Main entry point called directly by the dashboard.
+    Main entry point called directly by the dashboard: per-request records.
     """
-    logger.info("benchmark_started", requests=num_requests)
-    
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        for i in range(num_requests):
-            # 50/50 Split for Cache Hit/Miss simulation
-            if random.random() > 0.5:
-                # Warm Request (Shares Prefix)
-                tokens = SYSTEM_PREFIX + [random.randint(200, 999)]
-                req_type = "Warm (Cached)"
-            else:
-                # Cold Request (Random)
-                tokens = [random.randint(1000, 2000) for _ in range(4)]
-                req_type = "Cold (Uncached)"
-            
-            tasks.append(send_request(session, i, tokens, req_type))
-        
-        # Run all requests concurrently
-        results = await asyncio.gather(*tasks)
-        return results
+    records, _ = await run_suite(num_requests, **kwargs)
+    return records
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Open-loop HyperServe load generator")
+    parser.add_argument("--mode", choices=("inprocess", "http"), default="inprocess")
+    parser.add_argument("--url", default=SERVER_URL)
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="rag")
+    parser.add_argument("--arrival", choices=("poisson", "bursty"), default="poisson")
+    parser.add_argument("--rate", type=float, default=4.0, help="Mean arrival rate (req/s)")
+    parser.add_argument("--num-requests", type=int, default=100)
+    parser.add_argument("--replicas", type=int, default=1)
+    parser.add_argument("--slo-ttft-ms", type=float, default=1000.0)
+    parser.add_argument("--slo-tpot-ms", type=float, default=100.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the summary as JSON here")
+    parser.add_argument("--csv", help="Write per-request records here (the dashboard reads benchmark_data.csv)")
+    parser.add_argument("--baseline", help="Summary JSON to compare against; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression")
+    args = parser.parse_args(argv)
+
+    records, summary = asyncio.run(run_suite(
+        args.num_requests, profile=args.profile, arrival=args.arrival, rate=args.rate, mode=args.mode,
+        replicas=args.replicas, slo_ttft_ms=args.slo_ttft_ms, slo_tpot_ms=args.slo_tpot_ms,
+        seed=args.seed, url=args.url,
+    ))
+
+    if args.csv:
+        import csv
+        fields = ["id", "type", "profile", "arrival_s", "latency_ms", "e2e_ms", "ttft_ms", "tpot_ms",
+                  "hit_rate", "prompt_tokens", "output_tokens", "status"]
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(records)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+    print(json.dumps(summary, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(summary, json.load(f), args.tolerance)
+        for r in regressions:
+            logger.error("benchmark_regression", **r)
+        return 1 if regressions else 0
+    return 0
 
 if __name__ == "__main__":
-    # Allow standalone execution for debugging
-    results = asyncio.run(run_benchmark(100))
-    print(pd.DataFrame(results))
\ No newline at end of file
+    sys.exit(main())